@@ -1,26 +1,49 @@
 """
 MongoDB Archiver - Core archiving logic with Change Stream support
 """
-from pymongo import MongoClient, ASCENDING
+from pymongo import ASCENDING
 from pymongo.errors import ConnectionFailure, OperationFailure, PyMongoError
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Iterator
 import time
 import json
+import queue
+import threading
+from pathlib import Path
 from bson import json_util, ObjectId
 
 from config import Config
 from logger import setup_logger
+from dimension_cache import ClientSideEnricher
+from partitions import HistoriquePartitions
+from metrics import MetricsRegistry, MetricsServer
+from connection import get_client, release_client, pool_stats, format_pool_stats
+from indexes import IndexManager
 
 
 class OrderArchiver:
     """Main class for archiving delivered orders"""
     
+    # Available batch archiving engines
+    ENGINES = ("bulk", "lookup", "merge", "pipelined", "cached")
+    
+    # Fields checked by check_completeness and their placeholder values
+    REQUIRED_FIELDS = [
+        'nom_client', 'nom_livreur', 'nom_restaurant',
+        'nom_menu', 'coût_commande'
+    ]
+    PLACEHOLDER_VALUES = [
+        "Client inconnu", "Livreur non assigné",
+        "Restaurant non spécifié", "Menu non spécifié"
+    ]
+    
     def __init__(self, config: Config, logger=None):
         self.config = config
         self.logger = logger or setup_logger(__name__)
         self.client = None
         self.db = None
+        self.checkpoint_file = Path(config.batch_checkpoint_file)
+        self._partitions = None
         
         # Statistics
         self.stats = {
@@ -28,8 +51,54 @@ class OrderArchiver:
             'archived': 0,
             'duplicates': 0,
             'errors': 0,
-            'incomplete': 0
+            'incomplete': 0,
+            'skipped': 0,
+            'purged': 0
         }
+        
+        # Live metrics (served by start_metrics_server when METRICS_PORT is set)
+        self.metrics = MetricsRegistry()
+        self.metrics.register_stats('archiver', self.stats)
+        self.enrichment_latency = self.metrics.histogram(
+            'archiver_enrichment_seconds', 'Per-order enrichment aggregation latency'
+        )
+        self.batch_enrichment_latency = self.metrics.histogram(
+            'archiver_batch_enrichment_seconds', 'Micro-batch ($in) enrichment aggregation latency'
+        )
+        self.insert_latency = self.metrics.histogram(
+            'archiver_insert_seconds', 'Historique bulk insert latency'
+        )
+        self.queue_depth = self.metrics.gauge(
+            'archiver_queue_depth', 'Enriched batches waiting for a writer thread (pipelined engine)'
+        )
+        self.metrics.gauge(
+            'mongo_pool_in_use', 'Connections checked out from the shared pools'
+        ).set_function(lambda: sum(s['in_use'] for s in pool_stats()))
+        self.metrics.gauge(
+            'mongo_pool_waiting', 'Threads waiting for a pooled connection'
+        ).set_function(lambda: sum(s['waiting'] for s in pool_stats()))
+        self.metrics_server = None
+    
+    def start_metrics_server(self, port_offset: int = 0):
+        """
+        Serve live metrics on config.metrics_host:config.metrics_port (if set)
+        
+        Args:
+            port_offset: Added to the port (one endpoint per watcher partition)
+        """
+        if not self.config.metrics_port or self.metrics_server:
+            return
+        try:
+            self.metrics_server = MetricsServer(
+                self.metrics,
+                self.config.metrics_port + port_offset,
+                self.config.metrics_host,
+                self.logger
+            )
+            self.metrics_server.start()
+        except OSError as e:
+            self.logger.warning(f"⚠️  Could not start metrics endpoint: {e}")
+            self.metrics_server = None
     
     def connect(self) -> bool:
         """
@@ -41,11 +110,8 @@ class OrderArchiver:
         try:
             # Don't log the URI for security
             self.logger.info("Connecting to MongoDB...")
-            self.client = MongoClient(
-                self.config.mongodb_uri,
-                serverSelectionTimeoutMS=5000,
-                connectTimeoutMS=10000
-            )
+            # Pool shared with the watcher/generator of this process
+            self.client = get_client(self.config)
             
             # Test connection
             self.client.admin.command('ping')
@@ -56,40 +122,71 @@ class OrderArchiver:
             
         except ConnectionFailure as e:
             self.logger.error(f"❌ Failed to connect to MongoDB: {e}")
+            self.close()
             return False
         except Exception as e:
             self.logger.error(f"❌ Unexpected error during connection: {e}")
+            self.close()
             return False
     
+    @property
+    def partitions(self) -> HistoriquePartitions:
+        """Historique partition router bound to the current database"""
+        if self._partitions is None or self._partitions.db is not self.db:
+            self._partitions = HistoriquePartitions(self.config, self.db, self.logger)
+        return self._partitions
+    
     def ensure_indexes(self):
-        """Create necessary indexes for performance"""
+        """Reconcile the declared indexes (see indexes.declared_indexes)"""
         try:
             self.logger.info("Ensuring indexes...")
             
-            # Index on Historique for fast duplicate detection
-            self.db[self.config.collection_historique].create_index(
-                [("numero_commande", ASCENDING)],
-                unique=True,
-                name="idx_numero_commande_unique"
-            )
+            if self.partitions.enabled:
+                # Per-partition indexes; uniqueness is held by the registry
+                self.partitions.ensure_indexes()
             
-            # Index on Commande for status queries
-            self.db[self.config.collection_commande].create_index(
-                [("status", ASCENDING)],
-                name="idx_status"
+            # Idempotent: only missing indexes are built, drifted ones are
+            # rebuilt only when INDEX_REBUILD / INDEX_REBUILD_UNIQUE allow it
+            report = IndexManager(self.config, self.db, self.logger).reconcile(
+                prune=self.config.index_prune,
+                rebuild=self.config.index_rebuild,
+                rebuild_unique=self.config.index_rebuild_unique
             )
             
-            # Index on date_commande for date range queries
-            self.db[self.config.collection_commande].create_index(
-                [("date_commande", ASCENDING)],
-                name="idx_date_commande"
-            )
-            
-            self.logger.info("✅ Indexes created/verified")
+            if report.failed:
+                self.logger.warning(f"⚠️  {len(report.failed)} indexes could not be created")
+            else:
+                self.logger.info("✅ Indexes created/verified")
             
         except Exception as e:
             self.logger.warning(f"⚠️  Could not create indexes: {e}")
     
+    def build_delivered_query(
+        self,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None
+    ) -> Dict:
+        """
+        Build the query matching delivered orders
+        
+        Args:
+            date_from: Optional start date filter
+            date_to: Optional end date filter
+            
+        Returns:
+            MongoDB query document
+        """
+        query = {"status": "livrée"}
+        
+        if date_from or date_to:
+            query["date_commande"] = {}
+            if date_from:
+                query["date_commande"]["$gte"] = date_from
+            if date_to:
+                query["date_commande"]["$lte"] = date_to
+        
+        return query
+    
     def get_enrichment_pipeline(self, numero_commande: str) -> List[Dict]:
         """
         Build aggregation pipeline for enriching order data
@@ -97,11 +194,232 @@ class OrderArchiver:
         Args:
             numero_commande: Order number to match
             
+        Returns:
+            Aggregation pipeline
+        """
+        return self.build_enrichment_pipeline({"numero_commande": numero_commande})
+    
+    def get_bulk_enrichment_pipeline(
+        self,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        after: Optional[Dict] = None,
+        ordered: bool = False
+    ) -> List[Dict]:
+        """
+        Build aggregation pipeline enriching every delivered order at once
+        
+        Args:
+            date_from: Optional start date filter
+            date_to: Optional end date filter
+            after: Optional checkpoint ({date_commande, _id}); only orders
+                strictly after it are matched
+            ordered: If True, sort on (date_commande, _id) so the stream
+                can be checkpointed (implied by after)
+            
+        Returns:
+            Aggregation pipeline
+        """
+        match = self.build_delivered_query(date_from, date_to)
+        
+        if after and after.get("date_commande") is None:
+            # Null and missing dates sort first, and $gt: null matches nothing:
+            # the rest of the undated orders, then every dated one
+            match["$or"] = [
+                {"date_commande": None, "_id": {"$gt": after["_id"]}},
+                {"date_commande": {"$ne": None}}
+            ]
+        elif after:
+            # Range pagination: (date_commande, _id) > checkpoint
+            match["$or"] = [
+                {"date_commande": {"$gt": after["date_commande"]}},
+                {
+                    "date_commande": after["date_commande"],
+                    "_id": {"$gt": after["_id"]}
+                }
+            ]
+        
+        pipeline = self.build_enrichment_pipeline(match)
+        
+        prefix = []
+        if ordered or after:
+            prefix.append({"$sort": {"date_commande": ASCENDING, "_id": ASCENDING}})
+        if self.config.prefilter_archived:
+            prefix.extend(self.get_anti_join_stages())
+        pipeline[1:1] = prefix
+        
+        return pipeline
+    
+    def get_anti_join_stages(self, archived: bool = False) -> List[Dict]:
+        """
+        Build stages dropping orders already present in Historique
+        
+        The $lookup probes the unique numero_commande index of Historique
+        (or the _id of the registry when Historique is partitioned) and
+        only brings back _id, so the expensive enrichment lookups run for
+        new orders only (MongoDB 5.0+).
+        
+        Args:
+            archived: If True, keep only the already archived orders instead
+            
+        Returns:
+            Aggregation stages
+        """
+        if self.partitions.enabled:
+            archive, key = self.config.historique_registry_collection, "_id"
+        else:
+            archive, key = self.config.collection_historique, "numero_commande"
+        
+        return [
+            {
+                "$lookup": {
+                    "from": archive,
+                    "localField": "numero_commande",
+                    "foreignField": key,
+                    "pipeline": [{"$project": {"_id": 1}}, {"$limit": 1}],
+                    "as": "_archived"
+                }
+            },
+            {"$match": {"_archived": {"$ne": []} if archived else {"$eq": []}}},
+            {"$project": {"_archived": 0}}
+        ]
+    
+    def count_delivered(
+        self,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        after: Optional[Dict] = None
+    ) -> Optional[int]:
+        """
+        Count the delivered orders matched by a bulk run, before the anti-join
+        
+        Counts the $match of the bulk pipeline only: the
+        (status, date_commande, _id) index covers it and no $lookup runs.
+        
+        Args:
+            date_from: Optional start date filter
+            date_to: Optional end date filter
+            after: Optional checkpoint to count from
+            
+        Returns:
+            Number of matching delivered orders (None if the count failed)
+        """
+        match = self.get_bulk_enrichment_pipeline(date_from, date_to, after)[0]["$match"]
+        try:
+            return self.db[self.config.collection_commande].count_documents(match)
+        except PyMongoError as e:
+            self.logger.warning(f"⚠️  Could not count delivered orders: {e}")
+            return None
+    
+    def record_found(self, delivered: Optional[int], streamed: int, completed: bool = True):
+        """
+        Set stats['found'] and stats['skipped'] once a pre-filtered stream is read
+        
+        found is the number of delivered orders matched by the run, before
+        the pre-filter, like in the lookup/cached/async engines; skipped is
+        the difference with the orders that came out of the anti-join.
+        
+        Args:
+            delivered: count_delivered() taken before streaming (None if
+                not pre-filtering or the count failed)
+            streamed: Orders read from the enrichment stream
+            completed: False if the stream was interrupted (skipped unknown)
+        """
+        if delivered is None or not completed:
+            self.stats['found'] += max(streamed, delivered or 0)
+            return
+        
+        # Orders delivered after the count may come out of the stream too
+        found = max(delivered, streamed)
+        skipped = found - streamed
+        self.stats['found'] += found
+        self.stats['skipped'] += skipped
+        if skipped:
+            self.logger.info(f"⏭️  Skipped {skipped} already archived orders")
+    
+    def count_archived_delivered(
+        self,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        after: Optional[Dict] = None
+    ) -> int:
+        """
+        Count delivered orders already archived with the anti-join
+        
+        Runs a full $lookup over every delivered order: only used by merge
+        dry runs, which have no stream to derive the count from.
+        
+        Args:
+            date_from: Optional start date filter
+            date_to: Optional end date filter
+            after: Optional checkpoint to count from
+            
+        Returns:
+            Number of matching orders already present in Historique
+        """
+        match = self.get_bulk_enrichment_pipeline(date_from, date_to, after)[0]
+        pipeline = [match] + self.get_anti_join_stages(archived=True) + [
+            {"$count": "skipped"}
+        ]
+        
+        try:
+            result = list(self.db[self.config.collection_commande].aggregate(pipeline))
+            skipped = result[0]["skipped"] if result else 0
+        except PyMongoError as e:
+            self.logger.warning(f"⚠️  Could not count already archived orders: {e}")
+            return 0
+        
+        self.stats['skipped'] += skipped
+        if skipped:
+            self.logger.info(f"⏭️  Skipping {skipped} already archived orders")
+        return skipped
+    
+    def filter_unarchived(self, order_numbers: List[str]) -> List[str]:
+        """
+        Remove order numbers already present in Historique
+        
+        Probes the unique numero_commande index in chunks of
+        config.batch_size; the projection is covered by the index.
+        
+        Args:
+            order_numbers: Candidate order numbers
+            
+        Returns:
+            Order numbers not archived yet, in the original order
+        """
+        archived = set()
+        historique = self.db[self.config.collection_historique]
+        chunk_size = max(1, self.config.batch_size)
+        
+        for start in range(0, len(order_numbers), chunk_size):
+            chunk = order_numbers[start:start + chunk_size]
+            if self.partitions.enabled:
+                archived.update(self.partitions.archived_numeros(chunk))
+                continue
+            for doc in historique.find(
+                {"numero_commande": {"$in": chunk}},
+                {"numero_commande": 1, "_id": 0}
+            ):
+                archived.add(doc["numero_commande"])
+        
+        self.stats['skipped'] += len(archived)
+        if archived:
+            self.logger.info(f"⏭️  Skipping {len(archived)} already archived orders")
+        
+        return [numero for numero in order_numbers if numero not in archived]
+    
+    def build_enrichment_pipeline(self, match: Dict) -> List[Dict]:
+        """
+        Build the enrichment pipeline ($lookup + $project) for a given $match
+        
+        Args:
+            match: Query selecting the Commande documents to enrich
+            
         Returns:
             Aggregation pipeline
         """
         return [
-            {"$match": {"numero_commande": numero_commande}},
+            {"$match": match},
             {
                 "$lookup": {
                     "from": self.config.collection_client,
@@ -205,20 +523,96 @@ class OrderArchiver:
             Tuple of (is_complete, missing_fields)
         """
         missing_fields = []
-        required_fields = [
-            'nom_client', 'nom_livreur', 'nom_restaurant', 
-            'nom_menu', 'coût_commande'
-        ]
         
-        for field in required_fields:
+        for field in self.REQUIRED_FIELDS:
             value = order.get(field)
-            if value is None or value == "" or \
-               value in ["Client inconnu", "Livreur non assigné", 
-                        "Restaurant non spécifié", "Menu non spécifié"]:
+            if value is None or value == "" or value in self.PLACEHOLDER_VALUES:
                 missing_fields.append(field)
         
         return len(missing_fields) == 0, missing_fields
     
+    def get_completeness_stages(self, date_archivage: Optional[datetime]) -> List[Dict]:
+        """
+        Build $addFields stages mirroring finalize_order on the server side
+        
+        Args:
+            date_archivage: Archiving timestamp written on every document
+                (None: left out, stamped after the write)
+            
+        Returns:
+            Aggregation stages adding metadata and completeness flags
+        """
+        missing_values = [None, ""] + self.PLACEHOLDER_VALUES
+        missing_fields = {
+            "$concatArrays": [
+                {"$cond": [
+                    {"$in": [{"$ifNull": [f"${field}", None]}, missing_values]},
+                    [field],
+                    []
+                ]}
+                for field in self.REQUIRED_FIELDS
+            ]
+        }
+        
+        metadata = {
+            "archived_by": self.config.get_archived_by_tag(),
+            "missing_fields": missing_fields
+        }
+        if date_archivage is not None:
+            metadata["date_archivage"] = date_archivage
+        
+        return [
+            {"$addFields": metadata},
+            {
+                "$addFields": {
+                    "incomplete": {"$gt": [{"$size": "$missing_fields"}, 0]}
+                }
+            },
+            {
+                # Like check_completeness, only keep missing_fields when non-empty
+                "$addFields": {
+                    "missing_fields": {
+                        "$cond": ["$incomplete", "$missing_fields", "$$REMOVE"]
+                    }
+                }
+            }
+        ]
+    
+    def get_merge_pipeline(
+        self,
+        run_id: ObjectId,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None
+    ) -> List[Dict]:
+        """
+        Build the bulk enrichment pipeline ending with a $merge into Historique
+        
+        Documents are written without date_archivage, tagged with the run id
+        instead: the export cannot see them before the run is stamped.
+        
+        Args:
+            run_id: Marker written on every document of this run
+            date_from: Optional start date filter
+            date_to: Optional end date filter
+            
+        Returns:
+            Aggregation pipeline
+        """
+        pipeline = self.get_bulk_enrichment_pipeline(date_from, date_to)
+        # $merge on numero_commande needs the field on every document
+        pipeline.insert(1, {"$match": {"numero_commande": {"$ne": None}}})
+        pipeline.extend(self.get_completeness_stages(None))
+        pipeline.append({"$addFields": {"archive_run": run_id}})
+        pipeline.append({
+            "$merge": {
+                "into": self.config.collection_historique,
+                "on": "numero_commande",
+                "whenMatched": "keepExisting",
+                "whenNotMatched": "insert"
+            }
+        })
+        return pipeline
+    
     def enrich_order(self, numero_commande: str) -> Optional[Dict]:
         """
         Enrich order with related data
@@ -231,40 +625,218 @@ class OrderArchiver:
         """
         try:
             pipeline = self.get_enrichment_pipeline(numero_commande)
-            result = list(self.db[self.config.collection_commande].aggregate(pipeline))
+            with self.enrichment_latency.time():
+                result = list(self.db[self.config.collection_commande].aggregate(pipeline))
             
             if not result:
                 self.logger.warning(f"⚠️  No data found for order {numero_commande}")
                 return None
             
-            order = result[0]
-            
-            # Add metadata
-            order["date_archivage"] = datetime.now()
-            order["archived_by"] = self.config.get_archived_by_tag()
-            
-            # Check completeness
-            is_complete, missing = self.check_completeness(order)
-            order["incomplete"] = not is_complete
-            if missing:
-                order["missing_fields"] = missing
-                self.stats['incomplete'] += 1
-                self.logger.debug(f"Order {numero_commande} is incomplete: {missing}")
-            
-            return order
+            return self.finalize_order(result[0])
             
         except Exception as e:
             self.logger.error(f"❌ Error enriching order {numero_commande}: {e}")
             self.stats['errors'] += 1
             return None
     
-    def archive_orders_batch(self, orders: List[Dict], dry_run: bool = False) -> int:
+    def enrich_orders(self, numeros: List[str], ids: Optional[List] = None) -> List[Dict]:
+        """
+        Enrich several orders with a single $in aggregation
+        
+        Args:
+            numeros: Order numbers
+            ids: Commande _ids of orders whose number is not known yet
+            
+        Returns:
+            Enriched order documents (orders not found are left out)
+        """
+        if not numeros and not ids:
+            return []
+        
+        clauses = []
+        if numeros:
+            clauses.append({"numero_commande": {"$in": list(numeros)}})
+        if ids:
+            clauses.append({"_id": {"$in": list(ids)}})
+        match = clauses[0] if len(clauses) == 1 else {"$or": clauses}
+        
+        try:
+            pipeline = self.build_enrichment_pipeline(match)
+            with self.batch_enrichment_latency.time():
+                result = list(self.db[self.config.collection_commande].aggregate(pipeline))
+            return [self.finalize_order(order) for order in result]
+            
+        except Exception as e:
+            self.logger.error(f"❌ Error enriching {len(numeros) + len(ids or [])} orders: {e}")
+            self.stats['errors'] += 1
+            return []
+    
+    def finalize_order(self, order: Dict) -> Dict:
+        """
+        Add archiving metadata and completeness flags to an enriched order
+        
+        Args:
+            order: Enriched order document (output of the enrichment pipeline)
+            
+        Returns:
+            The same document, ready to be inserted in Historique
+        """
+        # Add metadata
+        order["date_archivage"] = datetime.now()
+        order["archived_by"] = self.config.get_archived_by_tag()
+        
+        # Check completeness
+        is_complete, missing = self.check_completeness(order)
+        order["incomplete"] = not is_complete
+        if missing:
+            order["missing_fields"] = missing
+            self.stats['incomplete'] += 1
+            self.logger.debug(
+                "Order %s is incomplete: %s", order.get('numero_commande'), missing
+            )
+        
+        return order
+    
+    def stamp_archived(self, orders: List[Dict]):
+        """
+        Set date_archivage to the write time, right before the insert
+        
+        Enrichment can happen long before the batch is written (pipelined
+        queue, slow runs); the incremental export only waits
+        config.export_safety_lag seconds for documents stamped in the past.
+        """
+        now = datetime.now()
+        for order in orders:
+            order["date_archivage"] = now
+    
+    def iter_enriched_orders(
+        self,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        after: Optional[Dict] = None,
+        ordered: bool = False
+    ) -> Iterator[Dict]:
+        """
+        Stream enriched delivered orders from a single server-side aggregation
+        
+        Args:
+            date_from: Optional start date filter
+            date_to: Optional end date filter
+            after: Optional checkpoint to resume from
+            ordered: If True, stream in (date_commande, _id) order
+            
+        Yields:
+            Enriched order documents
+        """
+        pipeline = self.get_bulk_enrichment_pipeline(date_from, date_to, after, ordered)
+        options = {
+            'allowDiskUse': True,
+            'batchSize': self.config.cursor_batch_size
+        }
+        if ordered or after:
+            # Equality on status, then the (date_commande, _id) order (see indexes.py).
+            # Hinted by key pattern: an equivalent index may exist under another
+            # name, and aggregate() only takes a name or a key document
+            options['hint'] = {"status": ASCENDING, "date_commande": ASCENDING, "_id": ASCENDING}
+        
+        cursor = self.db[self.config.collection_commande].aggregate(pipeline, **options)
+        
+        with cursor:
+            for order in cursor:
+                yield self.finalize_order(order)
+    
+    def load_checkpoint(
+        self,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None
+    ) -> Optional[Dict]:
+        """
+        Load the batch high-water mark saved by a previous interrupted run
+        
+        Args:
+            date_from: Start date filter of the current run
+            date_to: End date filter of the current run
+            
+        Returns:
+            Checkpoint ({date_commande, _id}) or None
+        """
+        try:
+            if self.checkpoint_file.exists():
+                with open(self.checkpoint_file, 'r') as f:
+                    checkpoint = json_util.loads(f.read())
+                
+                # A checkpoint only applies to the same date range
+                if checkpoint.get('date_from') != date_from or \
+                   checkpoint.get('date_to') != date_to:
+                    self.logger.warning(
+                        "⚠️  Ignoring batch checkpoint saved for another date range"
+                    )
+                    return None
+                
+                self.logger.info(
+                    f"📋 Resuming after order {checkpoint.get('numero_commande')} "
+                    f"({checkpoint['date_commande']})"
+                )
+                return checkpoint
+        except Exception as e:
+            self.logger.warning(f"⚠️  Could not load batch checkpoint: {e}")
+        return None
+    
+    def save_checkpoint(
+        self,
+        order: Dict,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None
+    ):
+        """
+        Persist the last committed order as the batch high-water mark
+        
+        Args:
+            order: Last order of the committed batch
+            date_from: Start date filter of the current run
+            date_to: End date filter of the current run
+        """
+        checkpoint = {
+            'date_commande': order.get('date_commande'),
+            '_id': order.get('_id'),
+            'numero_commande': order.get('numero_commande'),
+            'date_from': date_from,
+            'date_to': date_to,
+            'saved_at': datetime.now()
+        }
+        try:
+            self.checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.checkpoint_file.with_name(self.checkpoint_file.name + '.tmp')
+            with open(tmp_file, 'w') as f:
+                f.write(json_util.dumps(checkpoint))
+            tmp_file.replace(self.checkpoint_file)
+            self.logger.debug("💾 Saved batch checkpoint")
+        except Exception as e:
+            self.logger.warning(f"⚠️  Could not save batch checkpoint: {e}")
+    
+    def clear_checkpoint(self):
+        """Remove the batch checkpoint once a run has completed"""
+        try:
+            if self.checkpoint_file.exists():
+                self.checkpoint_file.unlink()
+                self.logger.debug("🧹 Cleared batch checkpoint")
+        except Exception as e:
+            self.logger.warning(f"⚠️  Could not clear batch checkpoint: {e}")
+    
+    def archive_orders_batch(
+        self,
+        orders: List[Dict],
+        dry_run: bool = False,
+        stats: Optional[Dict[str, int]] = None
+    ) -> int:
         """
         Archive a batch of orders
         
         Args:
             orders: List of enriched order documents
             dry_run: If True, don't actually insert
+            stats: Counters to update (defaults to self.stats); writer
+                threads pass their own dict to avoid sharing self.stats
             
         Returns:
             Number of orders archived
@@ -272,45 +844,90 @@ class OrderArchiver:
         if not orders:
             return 0
         
+        if stats is None:
+            stats = self.stats
+        
         archived_count = 0
         
         try:
             if dry_run:
                 self.logger.info(f"[DRY-RUN] Would archive {len(orders)} orders")
                 for order in orders:
-                    self.logger.debug(f"[DRY-RUN] {order['numero_commande']}")
+                    self.logger.debug("[DRY-RUN] %s", order.get('numero_commande', order.get('_id')))
                 return len(orders)
             
+            self.stamp_archived(orders)
+            
+            if self.partitions.enabled:
+                # Routed to Historique_YYYY_MM, duplicates checked in the registry
+                with self.insert_latency.time():
+                    archived_count, duplicates = self.partitions.insert(orders)
+                stats['duplicates'] += duplicates
+                self.logger.info(
+                    f"✅ Archived {archived_count} orders, "
+                    f"skipped {duplicates} duplicates"
+                )
+                return archived_count
+            
             # Bulk insert with ordered=False to continue on duplicate key errors
             try:
-                result = self.db[self.config.collection_historique].insert_many(
-                    orders,
-                    ordered=False
-                )
+                with self.insert_latency.time():
+                    result = self.db[self.config.collection_historique].insert_many(
+                        orders,
+                        ordered=False
+                    )
                 archived_count = len(result.inserted_ids)
                 self.logger.info(f"✅ Archived {archived_count} orders")
                 
             except PyMongoError as e:
                 # Handle duplicate key errors
-                if hasattr(e, 'details') and 'writeErrors' in e.details:
-                    write_errors = e.details['writeErrors']
-                    duplicates = sum(1 for err in write_errors if err['code'] == 11000)
-                    archived_count = len(orders) - duplicates
-                    self.stats['duplicates'] += duplicates
-                    self.logger.info(
-                        f"✅ Archived {archived_count} orders, "
-                        f"skipped {duplicates} duplicates"
-                    )
-                else:
-                    raise
+                archived_count = self.count_write_errors(e, len(orders), stats)
             
             return archived_count
             
         except Exception as e:
             self.logger.error(f"❌ Error archiving batch: {e}")
-            self.stats['errors'] += 1
+            stats['errors'] += 1
             return 0
     
+    def count_write_errors(self, error: PyMongoError, total: int, stats: Dict[str, int]) -> int:
+        """
+        Account for an unordered Historique insert_many that raised
+        
+        Shared by the sync and async engines. Duplicate keys go to
+        stats['duplicates'], other write errors (validation, oversized
+        documents...) to stats['errors'].
+        
+        Args:
+            error: Exception raised by insert_many(ordered=False)
+            total: Number of documents in the batch
+            stats: Counters to update
+            
+        Returns:
+            Number of documents inserted
+            
+        Raises:
+            The error itself when it carries no writeErrors (e.g. network)
+        """
+        details = getattr(error, 'details', None) or {}
+        if 'writeErrors' not in details:
+            raise error
+        
+        write_errors = details['writeErrors']
+        duplicates = sum(1 for err in write_errors if err['code'] == 11000)
+        failed = len(write_errors) - duplicates
+        archived_count = total - len(write_errors)
+        stats['duplicates'] += duplicates
+        self.logger.info(
+            f"✅ Archived {archived_count} orders, "
+            f"skipped {duplicates} duplicates"
+        )
+        if failed:
+            # Validation errors, oversized documents...: not archived
+            self.logger.error(f"❌ {failed} orders rejected by Historique")
+            stats['errors'] += failed
+        return archived_count
+    
     def find_delivered_orders(
         self, 
         date_from: Optional[datetime] = None,
@@ -324,16 +941,10 @@ class OrderArchiver:
             date_to: Optional end date filter
             
         Returns:
-            List of order numbers
+            List of order numbers (without already archived ones when
+            config.prefilter_archived is set)
         """
-        query = {"status": "livrée"}
-        
-        if date_from or date_to:
-            query["date_commande"] = {}
-            if date_from:
-                query["date_commande"]["$gte"] = date_from
-            if date_to:
-                query["date_commande"]["$lte"] = date_to
+        query = self.build_delivered_query(date_from, date_to)
         
         try:
             orders = self.db[self.config.collection_commande].find(
@@ -345,6 +956,10 @@ class OrderArchiver:
             self.stats['found'] = len(order_numbers)
             
             self.logger.info(f"📦 Found {len(order_numbers)} delivered orders")
+            
+            if self.config.prefilter_archived:
+                order_numbers = self.filter_unarchived(order_numbers)
+            
             return order_numbers
             
         except Exception as e:
@@ -355,7 +970,10 @@ class OrderArchiver:
         self, 
         dry_run: bool = False,
         date_from: Optional[datetime] = None,
-        date_to: Optional[datetime] = None
+        date_to: Optional[datetime] = None,
+        engine: str = "bulk",
+        resume: bool = False,
+        purge: bool = False
     ) -> Dict[str, int]:
         """
         Archive all delivered orders
@@ -364,21 +982,468 @@ class OrderArchiver:
             dry_run: If True, don't actually insert
             date_from: Optional start date filter
             date_to: Optional end date filter
+            engine: "bulk" (one streamed aggregation), "lookup"
+                (one aggregation per order), "merge" (server-side $merge)
+                "pipelined" (streamed aggregation feeding writer threads)
+                or "cached" (plain find enriched from a dimension cache)
+            resume: If True (bulk engine), checkpoint after each committed
+                batch and restart from the last checkpoint
+            purge: If True (or config.purge_after_archive), delete the
+                archived orders from Commande afterwards
             
         Returns:
             Statistics dictionary
         """
+        if engine not in self.ENGINES:
+            raise ValueError(
+                f"Unknown archiving engine: {engine}. "
+                f"Choose one of {', '.join(self.ENGINES)}"
+            )
+        
         self.logger.info("🚀 Starting batch archiving process...")
+        self.logger.info(f"⚙️  Engine: {engine}")
         
         if dry_run:
             self.logger.info("🔍 DRY-RUN MODE: No changes will be made")
         
+        if engine == "merge" and self.partitions.enabled:
+            # $merge writes into a single, fixed collection
+            self.logger.warning(
+                "⚠️  The merge engine cannot route to Historique partitions, using bulk"
+            )
+            engine = "bulk"
+        
+        if resume and engine != "bulk":
+            self.logger.warning(f"⚠️  Checkpointing is not supported by the {engine} engine")
+        
+        if engine == "bulk":
+            self._archive_all_bulk(dry_run, date_from, date_to, resume)
+        elif engine == "merge":
+            self._archive_all_merge(dry_run, date_from, date_to)
+        elif engine == "pipelined":
+            self._archive_all_pipelined(dry_run, date_from, date_to)
+        elif engine == "cached":
+            self._archive_all_cached(dry_run, date_from, date_to)
+        else:
+            self._archive_all_lookup(dry_run, date_from, date_to)
+        
+        if purge or self.config.purge_after_archive:
+            self.purge_archived(dry_run, date_from, date_to)
+        
+        self.logger.info("✅ Batch archiving completed")
+        return self.stats
+    
+    def purge_archived(
+        self,
+        dry_run: bool = False,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None
+    ) -> int:
+        """
+        Delete delivered orders from Commande once they are in Historique
+        
+        Orders are paged by _id in batches of config.purge_batch_size; each
+        batch is checked against Historique and only verified orders are
+        deleted, with at most config.purge_max_per_second deletions per
+        second so the platform workload keeps its share of the primary.
+        
+        Args:
+            dry_run: If True, only report what would be deleted
+            date_from: Optional start date filter
+            date_to: Optional end date filter
+            
+        Returns:
+            Number of orders purged
+        """
+        commande = self.db[self.config.collection_commande]
+        historique = self.db[self.config.collection_historique]
+        batch_size = max(1, self.config.purge_batch_size)
+        rate = self.config.purge_max_per_second
+        
+        query = self.build_delivered_query(date_from, date_to)
+        purged = 0
+        kept = 0
+        last_id = None
+        
+        self.logger.info("🧹 Purging archived orders from Commande...")
+        
+        try:
+            while True:
+                started = time.monotonic()
+                
+                # Keyset pagination on _id: no cursor stays open across
+                # deletions, and walking the _id index avoids sorting all
+                # delivered orders for every page
+                page_query = dict(query)
+                if last_id is not None:
+                    page_query["_id"] = {"$gt": last_id}
+                batch = list(
+                    commande.find(page_query, {"numero_commande": 1})
+                    .sort("_id", ASCENDING)
+                    .hint([("_id", ASCENDING)])
+                    .limit(batch_size)
+                )
+                if not batch:
+                    break
+                last_id = batch[-1]["_id"]
+                
+                numeros = [o["numero_commande"] for o in batch if "numero_commande" in o]
+                if self.partitions.enabled:
+                    archived = self.partitions.verified_numeros(numeros)
+                else:
+                    archived = {
+                        doc["numero_commande"]
+                        for doc in historique.find(
+                            {"numero_commande": {"$in": numeros}},
+                            {"numero_commande": 1, "_id": 0}
+                        )
+                    }
+                ids = [o["_id"] for o in batch if o.get("numero_commande") in archived]
+                kept += len(batch) - len(ids)
+                
+                if not ids:
+                    continue
+                
+                if dry_run:
+                    self.logger.info(f"[DRY-RUN] Would purge {len(ids)} archived orders")
+                    purged += len(ids)
+                else:
+                    # Re-check the status: the order may have changed since the read
+                    result = commande.delete_many({"_id": {"$in": ids}, **query})
+                    purged += result.deleted_count
+                    self.logger.info(f"🧹 Purged {result.deleted_count} archived orders")
+                
+                # Rate limit: a batch of n deletions lasts at least n / rate seconds
+                if rate > 0:
+                    remaining = len(ids) / rate - (time.monotonic() - started)
+                    if remaining > 0:
+                        time.sleep(remaining)
+        
+        except PyMongoError as e:
+            self.logger.error(f"❌ Error purging archived orders: {e}")
+            self.stats['errors'] += 1
+        
+        self.stats['purged'] += purged
+        if kept:
+            self.logger.info(f"🔒 Kept {kept} delivered orders not found in Historique")
+        return purged
+    
+    def _archive_all_bulk(
+        self,
+        dry_run: bool,
+        date_from: Optional[datetime],
+        date_to: Optional[datetime],
+        resume: bool = False
+    ):
+        """
+        Archive delivered orders from a single streamed aggregation
+        
+        With resume, orders are streamed in (date_commande, _id) order and
+        the last order of each committed batch is saved as a checkpoint.
+        The checkpoint is cleared once the stream is exhausted, since orders
+        delivered later may still carry an older date_commande.
+        """
+        checkpointing = resume and not dry_run
+        after = None
+        if checkpointing:
+            after = self.load_checkpoint(date_from, date_to)
+        elif not dry_run:
+            self.clear_checkpoint()
+        
+        # Skipped orders = delivered orders - orders out of the anti-join
+        delivered = None
+        if self.config.prefilter_archived:
+            delivered = self.count_delivered(date_from, date_to, after)
+        
+        batch = []
+        streamed = 0
+        total_processed = 0
+        completed = False
+        
+        def commit(batch):
+            errors_before = self.stats['errors']
+            archived = self.archive_orders_batch(batch, dry_run)
+            self.stats['archived'] += archived
+            # Only move the high-water mark past batches that were written
+            if checkpointing and self.stats['errors'] == errors_before:
+                self.save_checkpoint(batch[-1], date_from, date_to)
+        
+        try:
+            for enriched in self.iter_enriched_orders(
+                date_from, date_to, after, ordered=checkpointing
+            ):
+                streamed += 1
+                batch.append(enriched)
+                
+                # Archive when batch is full
+                if len(batch) >= self.config.batch_size:
+                    commit(batch)
+                    total_processed += len(batch)
+                    batch = []
+                    
+                    self.logger.info(f"📊 Progress: {total_processed} processed")
+            
+            completed = True
+        
+        except PyMongoError as e:
+            self.logger.error(f"❌ Error streaming enriched orders: {e}")
+            self.stats['errors'] += 1
+        
+        # Archive remaining orders
+        if batch:
+            commit(batch)
+        
+        if checkpointing and completed and self.stats['errors'] == 0:
+            self.clear_checkpoint()
+        
+        self.record_found(delivered, streamed, completed)
+        
+        if self.stats['found'] == 0:
+            self.logger.info("✨ No orders to archive")
+        else:
+            self.logger.info(f"📦 Found {self.stats['found']} delivered orders")
+    
+    def _archive_all_pipelined(
+        self,
+        dry_run: bool,
+        date_from: Optional[datetime],
+        date_to: Optional[datetime]
+    ):
+        """
+        Archive delivered orders with a producer/consumer pipeline
+        
+        The calling thread streams enriched orders and groups them into
+        batches pushed on a bounded queue; writer threads drain the queue
+        with unordered bulk inserts. Each writer keeps its own counters,
+        merged into self.stats once every writer has exited.
+        """
+        workers = max(1, self.config.writer_workers)
+        batches = queue.Queue(maxsize=max(1, self.config.queue_depth))
+        stats_lock = threading.Lock()
+        self.queue_depth.set_function(batches.qsize)
+        
+        def writer():
+            local_stats = {'archived': 0, 'duplicates': 0, 'errors': 0}
+            while True:
+                batch = batches.get()
+                try:
+                    if batch is None:
+                        break
+                    local_stats['archived'] += self.archive_orders_batch(
+                        batch, dry_run, stats=local_stats
+                    )
+                finally:
+                    batches.task_done()
+            
+            with stats_lock:
+                for key, value in local_stats.items():
+                    self.stats[key] += value
+        
+        threads = [
+            threading.Thread(target=writer, name=f"archiver-writer-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        
+        self.logger.info(
+            f"🧵 {workers} writer threads, queue depth {batches.maxsize}"
+        )
+        
+        delivered = None
+        if self.config.prefilter_archived:
+            delivered = self.count_delivered(date_from, date_to)
+        
+        batch = []
+        streamed = 0
+        total_queued = 0
+        completed = False
+        
+        try:
+            for enriched in self.iter_enriched_orders(date_from, date_to):
+                streamed += 1
+                batch.append(enriched)
+                
+                if len(batch) >= self.config.batch_size:
+                    # Blocks while the queue is full (backpressure)
+                    batches.put(batch)
+                    total_queued += len(batch)
+                    batch = []
+                    
+                    self.logger.info(f"📊 Progress: {total_queued} queued")
+            
+            completed = True
+        
+        except PyMongoError as e:
+            self.logger.error(f"❌ Error streaming enriched orders: {e}")
+            with stats_lock:
+                self.stats['errors'] += 1
+        
+        finally:
+            # Flush the partial batch, then one sentinel per writer
+            if batch:
+                batches.put(batch)
+            for _ in threads:
+                batches.put(None)
+            for thread in threads:
+                thread.join()
+            self.queue_depth.set_function(None)
+        
+        self.record_found(delivered, streamed, completed)
+        
+        if self.stats['found'] == 0:
+            self.logger.info("✨ No orders to archive")
+        else:
+            self.logger.info(f"📦 Found {self.stats['found']} delivered orders")
+    
+    def _archive_all_merge(
+        self,
+        dry_run: bool,
+        date_from: Optional[datetime],
+        date_to: Optional[datetime]
+    ):
+        """Archive delivered orders server-side with an aggregation ending in $merge"""
+        commande = self.db[self.config.collection_commande]
+        historique = self.db[self.config.collection_historique]
+        query = self.build_delivered_query(date_from, date_to)
+        query["numero_commande"] = {"$ne": None}
+        
+        try:
+            self.stats['found'] = commande.count_documents(query)
+            self.logger.info(f"📦 Found {self.stats['found']} delivered orders")
+            
+            if not self.stats['found']:
+                self.logger.info("✨ No orders to archive")
+                return
+            
+            if dry_run:
+                skipped = 0
+                if self.config.prefilter_archived:
+                    skipped = self.count_archived_delivered(date_from, date_to)
+                self.logger.info(
+                    f"[DRY-RUN] Would merge {self.stats['found'] - skipped} orders "
+                    f"into {self.config.collection_historique}"
+                )
+                self.stats['archived'] += self.stats['found'] - skipped
+                return
+            
+            # Documents written by this run carry its marker until stamped
+            run_id = ObjectId()
+            run_filter = {"archive_run": run_id}
+            pipeline = self.get_merge_pipeline(run_id, date_from, date_to)
+            try:
+                commande.aggregate(pipeline, allowDiskUse=True)
+                archived = historique.count_documents(run_filter)
+                incomplete = historique.count_documents({**run_filter, "incomplete": True})
+            finally:
+                # One date_archivage for the whole run, taken once every document
+                # is written (also after a failed merge, for the part written)
+                historique.update_many(
+                    run_filter,
+                    {"$set": {"date_archivage": datetime.now()}, "$unset": {"archive_run": ""}}
+                )
+            
+            self.stats['archived'] += archived
+            self.stats['incomplete'] += incomplete
+            
+            # Orders not written were already archived: dropped by the
+            # anti-join (skipped) or kept by whenMatched (duplicates)
+            not_written = self.stats['found'] - archived
+            if self.config.prefilter_archived:
+                self.stats['skipped'] += not_written
+            else:
+                self.stats['duplicates'] += not_written
+            
+            self.logger.info(
+                f"✅ Merged {archived} orders, "
+                f"skipped {not_written} already archived"
+            )
+        
+        except PyMongoError as e:
+            self.logger.error(f"❌ Error running $merge archiving: {e}")
+            self.stats['errors'] += 1
+    
+    def _archive_all_cached(
+        self,
+        dry_run: bool,
+        date_from: Optional[datetime],
+        date_to: Optional[datetime]
+    ):
+        """
+        Archive delivered orders enriched in Python from cached dimensions
+        
+        Orders come from a plain find on Commande; Client, Livreur,
+        Restaurants and Menu documents are served by ClientSideEnricher.
+        """
+        enricher = ClientSideEnricher(self.config, self.db, self.logger)
+        if self.config.dimension_cache_preload:
+            enricher.preload()
+        if self.config.dimension_cache_watch:
+            enricher.start_invalidation()
+        
+        query = self.build_delivered_query(date_from, date_to)
+        batch = []
+        total_processed = 0
+        
+        def commit(orders):
+            if self.config.prefilter_archived:
+                fresh = set(self.filter_unarchived(
+                    [o['numero_commande'] for o in orders if 'numero_commande' in o]
+                ))
+                orders = [o for o in orders if o.get('numero_commande') in fresh]
+            
+            enriched = [self.finalize_order(enricher.enrich(o)) for o in orders]
+            self.stats['archived'] += self.archive_orders_batch(enriched, dry_run)
+        
+        try:
+            cursor = self.db[self.config.collection_commande].find(
+                query, batch_size=self.config.cursor_batch_size
+            )
+            with cursor:
+                for order in cursor:
+                    self.stats['found'] += 1
+                    batch.append(order)
+                    
+                    if len(batch) >= self.config.batch_size:
+                        commit(batch)
+                        total_processed += len(batch)
+                        batch = []
+                        
+                        self.logger.info(f"📊 Progress: {total_processed} processed")
+        
+        except PyMongoError as e:
+            self.logger.error(f"❌ Error streaming delivered orders: {e}")
+            self.stats['errors'] += 1
+        
+        finally:
+            if batch:
+                commit(batch)
+            enricher.stop()
+        
+        for name, cache_stats in enricher.get_stats().items():
+            self.logger.info(
+                f"🗃️  {name} cache: {cache_stats['hits']} hits, "
+                f"{cache_stats['misses']} misses, {cache_stats['evictions']} evictions"
+            )
+        
+        if self.stats['found'] == 0:
+            self.logger.info("✨ No orders to archive")
+        else:
+            self.logger.info(f"📦 Found {self.stats['found']} delivered orders")
+    
+    def _archive_all_lookup(
+        self,
+        dry_run: bool,
+        date_from: Optional[datetime],
+        date_to: Optional[datetime]
+    ):
+        """Archive delivered orders with one enrichment aggregation per order"""
         # Find delivered orders
         order_numbers = self.find_delivered_orders(date_from, date_to)
         
         if not order_numbers:
             self.logger.info("✨ No orders to archive")
-            return self.stats
+            return
         
         # Process in batches
         batch = []
@@ -405,9 +1470,6 @@ class OrderArchiver:
         if batch:
             archived = self.archive_orders_batch(batch, dry_run)
             self.stats['archived'] += archived
-        
-        self.logger.info("✅ Batch archiving completed")
-        return self.stats
     
     def get_stats_summary(self) -> str:
         """Get formatted statistics summary"""
@@ -415,9 +1477,11 @@ class OrderArchiver:
 {'='*70}
 📊 ARCHIVING STATISTICS
 {'='*70}
-Found:       {self.stats['found']} orders
+Found:       {self.stats['found']} orders (delivered, before the pre-filter)
 Archived:    {self.stats['archived']} orders
 Duplicates:  {self.stats['duplicates']} orders
+Skipped:     {self.stats.get('skipped', 0)} orders (already archived, before enrichment)
+Purged:      {self.stats.get('purged', 0)} orders (removed from {self.config.collection_commande})
 Incomplete:  {self.stats['incomplete']} orders
 Errors:      {self.stats['errors']} errors
 {'='*70}
@@ -432,11 +1496,7 @@ Errors:      {self.stats['errors']} errors
             count: Number of samples to export
         """
         try:
-            samples = list(
-                self.db[self.config.collection_historique]
-                .find()
-                .limit(count)
-            )
+            samples = list(self.partitions.find(limit=count))
             
             with open(filename, 'w', encoding='utf-8') as f:
                 json.dump(
@@ -454,6 +1514,11 @@ Errors:      {self.stats['errors']} errors
     
     def close(self):
         """Close MongoDB connection"""
+        if self.metrics_server:
+            self.metrics_server.close()
+            self.metrics_server = None
         if self.client:
-            self.client.close()
+            self.logger.debug(format_pool_stats())
+            release_client(self.client)
+            self.client = None
             self.logger.info("🔌 MongoDB connection closed")
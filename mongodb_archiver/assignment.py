@@ -0,0 +1,251 @@
+"""
+Platform write path - batched delivery requests and single-transaction assignment
+Shared by the threaded (platform_sim_changestreams.py) and asyncio orchestrators
+"""
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from reservations import RESERVED
+
+
+# assign_livreur outcomes
+ASSIGNED = "assigned"
+LIVREUR_TAKEN = "livreur_taken"  # no longer available (assigned to another order)
+ORDER_CANCELLED = "order_cancelled"
+
+# Order statuses that must not be overwritten by an assignment
+CANCELLED_STATUSES = ['cancelled', 'cancel_requested']
+
+
+def delivery_request_documents(
+    numero: str,
+    livreur_ids: List,
+    requested_at: datetime,
+    offered_price: float,
+    city: Optional[str] = None
+) -> List[Dict]:
+    """One DeliveryRequests document per candidate livreur"""
+    return [
+        {
+            'numero_commande': numero,
+            'id_livreur': id_livreur,
+            'status': 'requested',
+            'requested_at': requested_at,
+            'offered_price': offered_price,
+            'city': city
+        }
+        for id_livreur in livreur_ids
+    ]
+
+
+def sent_livreur_ids(livreur_ids: List, error: Optional[BulkWriteError] = None) -> List:
+    """Candidates whose request was written (all of them unless insert_many failed)"""
+    if error is None:
+        return list(livreur_ids)
+    failed = {write_error['index'] for write_error in error.details.get('writeErrors', [])}
+    return [id_livreur for index, id_livreur in enumerate(livreur_ids) if index not in failed]
+
+
+def send_delivery_requests(db, numero: str, livreur_ids: List, requested_at: datetime,
+                           offered_price: float, city: Optional[str] = None) -> List:
+    """
+    Send the requests of every candidate in one insert_many
+
+    Args:
+        db: Database
+        numero: numero_commande
+        livreur_ids: Candidate livreurs
+        requested_at: Request time (kept in memory for the assignment delay)
+        offered_price: Fee offered to the livreurs
+        city: Optional delivery city
+
+    Returns:
+        Ids of the livreurs whose request was written
+    """
+    docs = delivery_request_documents(numero, livreur_ids, requested_at, offered_price, city)
+    if not docs:
+        return []
+    try:
+        db.DeliveryRequests.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        return sent_livreur_ids(livreur_ids, e)
+    return list(livreur_ids)
+
+
+def claim_filter(id_livreur, numero: str) -> Dict:
+    """
+    Livreur reserved by this order (see reservations.py), still available,
+    or already marked for this order by the livreur app
+    """
+    return {
+        'id_livreur': id_livreur,
+        '$or': [
+            {'statut': RESERVED, 'reserved_by': numero},
+            {'statut': 'disponible'},
+            {'statut': 'en_course', 'numero_commande': numero},
+        ]
+    }
+
+
+CLAIM_UNSET = {'reserved_by': '', 'reserved_until': ''}
+
+
+def livreur_display_name(livreur: Dict, id_livreur) -> str:
+    prenom = livreur.get('Prénom') or livreur.get('prenom')
+    nom = livreur.get('Nom') or livreur.get('nom')
+    if prenom and nom:
+        return f"{prenom} {nom}"
+    if prenom or nom:
+        return f"{prenom or nom} ({id_livreur})"
+    return str(id_livreur)
+
+
+def assignment_writes(
+    numero: str,
+    id_livreur,
+    livreur: Dict,
+    id_client,
+    delivery_request_ts: Optional[datetime],
+    assigned_at: datetime
+) -> Tuple[Dict, Dict, Dict]:
+    """
+    Order update, Metrics and Notifications documents of an assignment
+
+    The assignment delay comes from the in-memory request time, not from
+    a re-read of the order.
+
+    Returns:
+        (Commande $set, Metrics document, Notifications document)
+    """
+    order_update = {
+        'status': 'en_cours',
+        'id_livreur': id_livreur,
+        'delivery_request_ts': delivery_request_ts,
+        'assigned_at': assigned_at,
+    }
+    delay_ms = (
+        int((assigned_at - delivery_request_ts).total_seconds() * 1000)
+        if delivery_request_ts else None
+    )
+    metric = {
+        'numero_commande': numero,
+        'delivery_request_ts': delivery_request_ts,
+        'assigned_at': assigned_at,
+        'assignment_delay_ms': delay_ms,
+        'ts': assigned_at
+    }
+    message = (
+        f"Votre commande {numero} a été prise en charge par le livreur "
+        f"{livreur_display_name(livreur, id_livreur)} (id: {id_livreur})"
+    )
+    phone = livreur.get('Téléphone') or livreur.get('telephone')
+    if phone:
+        message += f" - Tel: {phone}"
+    notification = {
+        'numero_commande': numero,
+        'id_client': id_client,
+        'message': message,
+        'sent_at': assigned_at
+    }
+    return order_update, metric, notification
+
+
+def assign_livreur(db, numero: str, id_livreur, id_client=None,
+                   delivery_request_ts: Optional[datetime] = None) -> Tuple[str, Optional[Dict]]:
+    """
+    Claim the livreur and assign the order in one transaction
+
+    The livreur is only claimed if still available (see claim_filter) and
+    the order only updated if not cancelled; otherwise nothing is written.
+    The Metrics and Notifications documents are part of the same commit.
+
+    Args:
+        db: Database (on a replica set, like the change streams)
+        numero: numero_commande
+        id_livreur: Livreur who accepted
+        id_client: Client to notify
+        delivery_request_ts: When the delivery requests were sent
+
+    Returns:
+        (ASSIGNED, livreur document) or (LIVREUR_TAKEN / ORDER_CANCELLED, None)
+    """
+    assigned_at = datetime.now(timezone.utc)
+
+    def transaction(session):
+        livreur = db.Livreur.find_one_and_update(
+            claim_filter(id_livreur, numero),
+            {'$set': {'statut': 'en_course', 'numero_commande': numero}, '$unset': CLAIM_UNSET},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if livreur is None:
+            session.abort_transaction()
+            return LIVREUR_TAKEN, None
+        order_update, metric, notification = assignment_writes(
+            numero, id_livreur, livreur, id_client, delivery_request_ts, assigned_at
+        )
+        result = db.Commande.update_one(
+            {'numero_commande': numero, 'status': {'$nin': CANCELLED_STATUSES}},
+            {'$set': order_update},
+            session=session
+        )
+        if result.matched_count == 0:
+            # Rolls the livreur claim back
+            session.abort_transaction()
+            return ORDER_CANCELLED, None
+        db.Metrics.insert_one(metric, session=session)
+        db.Notifications.insert_one(notification, session=session)
+        return ASSIGNED, livreur
+
+    with db.client.start_session() as session:
+        return session.with_transaction(transaction)
+
+
+async def send_delivery_requests_async(db, numero: str, livreur_ids: List, requested_at: datetime,
+                                       offered_price: float, city: Optional[str] = None) -> List:
+    """send_delivery_requests on the asyncio driver"""
+    docs = delivery_request_documents(numero, livreur_ids, requested_at, offered_price, city)
+    if not docs:
+        return []
+    try:
+        await db.DeliveryRequests.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        return sent_livreur_ids(livreur_ids, e)
+    return list(livreur_ids)
+
+
+async def assign_livreur_async(db, numero: str, id_livreur, id_client=None,
+                               delivery_request_ts: Optional[datetime] = None) -> Tuple[str, Optional[Dict]]:
+    """assign_livreur on the asyncio driver"""
+    assigned_at = datetime.now(timezone.utc)
+
+    async def transaction(session):
+        livreur = await db.Livreur.find_one_and_update(
+            claim_filter(id_livreur, numero),
+            {'$set': {'statut': 'en_course', 'numero_commande': numero}, '$unset': CLAIM_UNSET},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if livreur is None:
+            await session.abort_transaction()
+            return LIVREUR_TAKEN, None
+        order_update, metric, notification = assignment_writes(
+            numero, id_livreur, livreur, id_client, delivery_request_ts, assigned_at
+        )
+        result = await db.Commande.update_one(
+            {'numero_commande': numero, 'status': {'$nin': CANCELLED_STATUSES}},
+            {'$set': order_update},
+            session=session
+        )
+        if result.matched_count == 0:
+            await session.abort_transaction()
+            return ORDER_CANCELLED, None
+        await db.Metrics.insert_one(metric, session=session)
+        await db.Notifications.insert_one(notification, session=session)
+        return ASSIGNED, livreur
+
+    async with db.client.start_session() as session:
+        return await session.with_transaction(transaction)
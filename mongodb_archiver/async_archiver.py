@@ -0,0 +1,229 @@
+"""
+Asyncio archiving engine - concurrent per-order enrichment (main.py batch --async)
+Enrichment aggregations are I/O bound: many of them are kept in flight at once
+"""
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pymongo.errors import PyMongoError
+
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:  # pymongo < 4.9, only needed for --async
+    AsyncMongoClient = None
+
+from config import Config
+from archiver import OrderArchiver
+from connection import client_options
+
+
+class AsyncOrderArchiver(OrderArchiver):
+    """
+    Archive delivered orders with a bounded fan-out of enrichment coroutines
+
+    Orders are listed and pre-filtered with the synchronous client, then up
+    to config.async_concurrency enrichment aggregations (the lookup engine's
+    per-order pipeline) run concurrently on the asyncio client. Enriched
+    orders are inserted in batches of config.batch_size while the next ones
+    are being enriched.
+    """
+
+    def __init__(self, config: Config, logger=None):
+        if AsyncMongoClient is None:
+            raise ImportError(
+                "pymongo>=4.9 is required for the async engine (pip install -U pymongo)"
+            )
+        super().__init__(config, logger)
+        self.async_client = None
+        self.async_db = None
+
+    async def connect_async(self):
+        """Open the asyncio client (must run inside the event loop)"""
+        options = client_options(self.config)
+        options['maxPoolSize'] = max(options['maxPoolSize'], self.config.async_concurrency)
+        self.async_client = AsyncMongoClient(self.config.mongodb_uri, **options)
+        await self.async_client.admin.command('ping')
+        self.async_db = self.async_client[self.config.database_name]
+
+    async def enrich_order_async(self, numero_commande: str) -> Optional[Dict]:
+        """
+        Enrich order with related data (see OrderArchiver.enrich_order)
+
+        Args:
+            numero_commande: Order number
+
+        Returns:
+            Enriched order document or None if error
+        """
+        try:
+            pipeline = self.get_enrichment_pipeline(numero_commande)
+            with self.enrichment_latency.time():
+                cursor = await self.async_db[self.config.collection_commande].aggregate(pipeline)
+                result = await cursor.to_list()
+
+            if not result:
+                self.logger.warning(f"⚠️  No data found for order {numero_commande}")
+                return None
+
+            return self.finalize_order(result[0])
+
+        except Exception as e:
+            self.logger.error(f"❌ Error enriching order {numero_commande}: {e}")
+            self.stats['errors'] += 1
+            return None
+
+    async def archive_orders_batch_async(self, orders: List[Dict], dry_run: bool = False) -> int:
+        """
+        Archive a batch of orders (see OrderArchiver.archive_orders_batch)
+
+        Args:
+            orders: List of enriched order documents
+            dry_run: If True, don't actually insert
+
+        Returns:
+            Number of orders archived
+        """
+        if not orders:
+            return 0
+
+        if dry_run or self.partitions.enabled:
+            # Partition routing and registry claims use the synchronous client
+            stats = {'duplicates': 0, 'errors': 0}
+            archived_count = await asyncio.to_thread(
+                self.archive_orders_batch, orders, dry_run, stats
+            )
+            self.stats['duplicates'] += stats['duplicates']
+            self.stats['errors'] += stats['errors']
+            return archived_count
+
+        self.stamp_archived(orders)
+
+        try:
+            # Bulk insert with ordered=False to continue on duplicate key errors
+            try:
+                with self.insert_latency.time():
+                    result = await self.async_db[self.config.collection_historique].insert_many(
+                        orders,
+                        ordered=False
+                    )
+                archived_count = len(result.inserted_ids)
+                self.logger.info(f"✅ Archived {archived_count} orders")
+
+            except PyMongoError as e:
+                # Same accounting as the sync engine
+                archived_count = self.count_write_errors(e, len(orders), self.stats)
+
+            return archived_count
+
+        except Exception as e:
+            self.logger.error(f"❌ Error archiving batch: {e}")
+            self.stats['errors'] += 1
+            return 0
+
+    def archive_all(
+        self,
+        dry_run: bool = False,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        engine: str = "async",
+        resume: bool = False,
+        purge: bool = False
+    ) -> Dict[str, int]:
+        """
+        Archive all delivered orders with the asyncio engine
+
+        Same arguments as OrderArchiver.archive_all; engine and resume are
+        ignored (no checkpoint: already archived orders are pre-filtered).
+
+        Returns:
+            Statistics dictionary
+        """
+        self.logger.info("🚀 Starting batch archiving process...")
+        self.logger.info(f"⚙️  Engine: async (concurrency {self.config.async_concurrency})")
+
+        if dry_run:
+            self.logger.info("🔍 DRY-RUN MODE: No changes will be made")
+
+        if resume:
+            self.logger.warning("⚠️  Checkpointing is not supported by the async engine")
+
+        asyncio.run(self._archive_all_async(dry_run, date_from, date_to))
+
+        if purge or self.config.purge_after_archive:
+            self.purge_archived(dry_run, date_from, date_to)
+
+        self.logger.info("✅ Batch archiving completed")
+        return self.stats
+
+    async def _archive_all_async(
+        self,
+        dry_run: bool,
+        date_from: Optional[datetime],
+        date_to: Optional[datetime]
+    ):
+        """Enrich orders concurrently, insert full batches in the background"""
+        order_numbers = self.find_delivered_orders(date_from, date_to)
+
+        if not order_numbers:
+            self.logger.info("✨ No orders to archive")
+            return
+
+        semaphore = asyncio.Semaphore(max(1, self.config.async_concurrency))
+        batch_size = max(1, self.config.batch_size)
+        ready: List[Dict] = []
+        in_flight = set()
+        insert_task = None
+        processed = 0
+
+        async def enrich(numero):
+            try:
+                return await self.enrich_order_async(numero)
+            finally:
+                semaphore.release()
+
+        def collect(task):
+            in_flight.discard(task)
+            order = task.result()
+            if order:
+                ready.append(order)
+
+        async def commit(orders):
+            self.stats['archived'] += await self.archive_orders_batch_async(orders, dry_run)
+
+        try:
+            # Inside the try: a failed ping must still close the client
+            await self.connect_async()
+
+            for numero in order_numbers:
+                await semaphore.acquire()
+                task = asyncio.create_task(enrich(numero))
+                in_flight.add(task)
+                task.add_done_callback(collect)
+
+                if len(ready) >= batch_size:
+                    # One insert in flight at a time, overlapping enrichment
+                    if insert_task:
+                        await insert_task
+                    batch = ready[:batch_size]
+                    del ready[:batch_size]
+                    insert_task = asyncio.create_task(commit(batch))
+                    processed += len(batch)
+                    self.logger.info(
+                        f"📊 Progress: {processed}/{len(order_numbers)} processed"
+                    )
+
+            if in_flight:
+                await asyncio.gather(*in_flight)
+            if insert_task:
+                await insert_task
+
+            # Archive remaining orders
+            for start in range(0, len(ready), batch_size):
+                await commit(ready[start:start + batch_size])
+
+        finally:
+            if self.async_client is not None:
+                await self.async_client.close()
+            self.async_client = None
+            self.async_db = None
@@ -66,12 +66,14 @@ def watch_order_status(numero, id_client):
                 print(f"   📦 Commande : {numero}")
                 print(f"   ⏭️  Nouveau  : {status}")
                 
-                if status in ['livrée', 'annulée', 'rejected_by_restaurant']:
+                if status in ['livrée', 'annulée', 'rejected_by_restaurant', 'rejected_overload']:
                     print()
                     if status == 'livrée':
                         print(f"✅ COMMANDE LIVRÉE avec succès!")
                     elif status == 'rejected_by_restaurant':
                         print(f"❌ COMMANDE REFUSÉE par le restaurant")
+                    elif status == 'rejected_overload':
+                        print(f"❌ COMMANDE REFUSÉE : plateforme surchargée")
                     else:
                         print(f"🚫 COMMANDE ANNULÉE")
                     print()
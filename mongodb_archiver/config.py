@@ -19,6 +19,16 @@ class Config:
     mongodb_uri: str
     database_name: str = "Ubereats"
     
+    # Connection pool (shared per process, see connection.get_client)
+    mongo_app_name: str = "mongodb_archiver"
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 0
+    mongo_max_idle_time_ms: int = 60000  # close connections idle for longer
+    mongo_wait_queue_timeout_ms: int = 0  # max wait for a free connection (0: no limit)
+    mongo_compressors: str = "zstd,snappy"  # only those whose module is installed
+    mongo_write_concern: Optional[str] = None  # e.g. "majority" or "1" (None: server default)
+    mongo_read_concern: Optional[str] = None  # e.g. "majority" (None: server default)
+    
     # Collection names
     collection_commande: str = "Commande"
     collection_historique: str = "Historique"
@@ -27,14 +37,73 @@ class Config:
     collection_restaurants: str = "Restaurants"
     collection_menu: str = "Menu"
     
+    # Historique partitioning on date_commande: "none", "monthly"
+    # (Historique_YYYY_MM) or "yearly" (Historique_YYYY)
+    historique_partitioning: str = "none"
+    historique_registry_collection: str = "Historique_registry"  # numero_commande claims
+    
     # Archiving settings
     batch_size: int = 100
     max_retries: int = 3
     retry_delay: int = 2  # seconds
+    cursor_batch_size: int = 1000  # documents per getMore on bulk cursors
+    writer_workers: int = 4  # insert threads for the pipelined engine
+    queue_depth: int = 8  # batches buffered between reader and writers
+    prefilter_archived: bool = True  # skip orders already in Historique before enrichment
+    async_concurrency: int = 64  # enrichment aggregations in flight (batch --async)
+    
+    # Purge of archived orders from Commande (cold/warm tiering)
+    purge_after_archive: bool = False
+    purge_batch_size: int = 500  # orders per delete_many
+    purge_max_per_second: float = 0  # delete rate limit (0: unlimited)
+    
+    # Columnar export of Historique (main.py export)
+    export_dir: str = "exports"
+    export_batch_size: int = 10000  # documents per record batch
+    export_compression: str = "zstd"
+    export_safety_lag: int = 300  # seconds; recent archives wait for the next run
+    
+    # Dimension cache (cached engine)
+    dimension_cache_size: int = 10000  # entries per dimension collection
+    dimension_cache_ttl: float = 300.0  # seconds
+    dimension_cache_preload: bool = False
+    dimension_cache_watch: bool = True  # invalidate entries from change streams
     
     # Change Stream settings
     watch_enabled: bool = True
     watch_resume_token_file: str = ".resume_token.json"
+    watch_batch_size: int = 100  # flush after N buffered events...
+    watch_flush_interval_ms: int = 200  # ...or when the oldest is T ms old
+    watch_token_store: str = "file"  # "file" or "mongodb"
+    watch_state_collection: str = "_watcher_state"
+    watch_state_id: str = "order_watcher"
+    watch_token_flush_every: int = 100  # save the token every N commits...
+    watch_token_flush_ms: int = 1000  # ...or every T ms
+    watch_partitions: int = 1  # number of watchers splitting the stream
+    watch_partition_id: int = 0  # partition owned by this watcher
+    watch_partition_field: Optional[str] = None  # precomputed integer shard key
+    watch_stream_mode: str = "full"  # "full" (updateLookup) or "lean" (projected events)
+    watch_max_replays: int = 5  # failed commits of one batch before dead-lettering its orders
+    watch_dead_letter_collection: str = "_watcher_dead_letter"
+    
+    # Logging (see logger.setup_logger)
+    log_queue: bool = False  # format and write records in a background thread
+    log_format: str = "text"  # "text" or "json" (one object per line)
+    log_sampling: str = ""  # e.g. "INFO:100": keep 1 in 100 per message template
+    
+    # Live metrics endpoint (Prometheus text format, 0: disabled)
+    metrics_port: int = 0  # partitioned watchers listen on port + partition id
+    metrics_host: str = "127.0.0.1"
+    
+    # Index management (see indexes.IndexManager)
+    index_prune: bool = False  # drop undeclared indexes when reconciling
+    index_rebuild: bool = False  # drop and recreate drifted indexes (unique ones excluded)
+    index_rebuild_unique: bool = False  # ...unique ones included
+    slow_query_ms: int = 100  # explain checks: execution time reported as slow
+    slow_query_examined_ratio: float = 10.0  # ...or docs examined per doc returned
+    
+    # Batch checkpoint (high-water mark of the last committed batch)
+    batch_checkpoint_file: str = ".batch_checkpoint.json"
     
     # Script metadata
     script_name: str = "archive_commandes.py"
@@ -54,10 +123,55 @@ class Config:
         return cls(
             mongodb_uri=mongodb_uri,
             database_name=os.getenv('MONGODB_DATABASE', 'Ubereats'),
+            mongo_app_name=os.getenv('MONGO_APP_NAME', 'mongodb_archiver'),
+            mongo_max_pool_size=int(os.getenv('MONGO_MAX_POOL_SIZE', '100')),
+            mongo_min_pool_size=int(os.getenv('MONGO_MIN_POOL_SIZE', '0')),
+            mongo_max_idle_time_ms=int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '60000')),
+            mongo_wait_queue_timeout_ms=int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '0')),
+            mongo_compressors=os.getenv('MONGO_COMPRESSORS', 'zstd,snappy'),
+            mongo_write_concern=os.getenv('MONGO_WRITE_CONCERN') or None,
+            mongo_read_concern=os.getenv('MONGO_READ_CONCERN') or None,
+            historique_partitioning=os.getenv('HISTORIQUE_PARTITIONING', 'none'),
             batch_size=int(os.getenv('BATCH_SIZE', '100')),
             max_retries=int(os.getenv('MAX_RETRIES', '3')),
             retry_delay=int(os.getenv('RETRY_DELAY', '2')),
-            watch_enabled=os.getenv('WATCH_ENABLED', 'true').lower() == 'true'
+            cursor_batch_size=int(os.getenv('CURSOR_BATCH_SIZE', '1000')),
+            writer_workers=int(os.getenv('WRITER_WORKERS', '4')),
+            queue_depth=int(os.getenv('QUEUE_DEPTH', '8')),
+            prefilter_archived=os.getenv('PREFILTER_ARCHIVED', 'true').lower() == 'true',
+            async_concurrency=int(os.getenv('ASYNC_CONCURRENCY', '64')),
+            purge_after_archive=os.getenv('PURGE_AFTER_ARCHIVE', 'false').lower() == 'true',
+            purge_batch_size=int(os.getenv('PURGE_BATCH_SIZE', '500')),
+            purge_max_per_second=float(os.getenv('PURGE_MAX_PER_SECOND', '0')),
+            export_dir=os.getenv('EXPORT_DIR', 'exports'),
+            export_batch_size=int(os.getenv('EXPORT_BATCH_SIZE', '10000')),
+            export_compression=os.getenv('EXPORT_COMPRESSION', 'zstd'),
+            export_safety_lag=int(os.getenv('EXPORT_SAFETY_LAG', '300')),
+            dimension_cache_size=int(os.getenv('DIMENSION_CACHE_SIZE', '10000')),
+            dimension_cache_ttl=float(os.getenv('DIMENSION_CACHE_TTL', '300')),
+            dimension_cache_preload=os.getenv('DIMENSION_CACHE_PRELOAD', 'false').lower() == 'true',
+            dimension_cache_watch=os.getenv('DIMENSION_CACHE_WATCH', 'true').lower() == 'true',
+            watch_enabled=os.getenv('WATCH_ENABLED', 'true').lower() == 'true',
+            watch_batch_size=int(os.getenv('WATCH_BATCH_SIZE', '100')),
+            watch_flush_interval_ms=int(os.getenv('WATCH_FLUSH_MS', '200')),
+            watch_token_store=os.getenv('WATCH_TOKEN_STORE', 'file'),
+            watch_state_id=os.getenv('WATCH_STATE_ID', 'order_watcher'),
+            watch_token_flush_every=int(os.getenv('WATCH_TOKEN_FLUSH_EVERY', '100')),
+            watch_token_flush_ms=int(os.getenv('WATCH_TOKEN_FLUSH_MS', '1000')),
+            watch_partition_field=os.getenv('WATCH_PARTITION_FIELD') or None,
+            watch_stream_mode=os.getenv('WATCH_STREAM_MODE', 'full'),
+            watch_max_replays=int(os.getenv('WATCH_MAX_REPLAYS', '5')),
+            log_queue=os.getenv('LOG_QUEUE', 'false').lower() == 'true',
+            log_format=os.getenv('LOG_FORMAT', 'text'),
+            log_sampling=os.getenv('LOG_SAMPLING', ''),
+            metrics_port=int(os.getenv('METRICS_PORT', '0')),
+            metrics_host=os.getenv('METRICS_HOST', '127.0.0.1'),
+            index_prune=os.getenv('INDEX_PRUNE', 'false').lower() == 'true',
+            index_rebuild=os.getenv('INDEX_REBUILD', 'false').lower() == 'true',
+            index_rebuild_unique=os.getenv('INDEX_REBUILD_UNIQUE', 'false').lower() == 'true',
+            slow_query_ms=int(os.getenv('SLOW_QUERY_MS', '100')),
+            slow_query_examined_ratio=float(os.getenv('SLOW_QUERY_EXAMINED_RATIO', '10')),
+            batch_checkpoint_file=os.getenv('BATCH_CHECKPOINT_FILE', '.batch_checkpoint.json')
         )
     
     @classmethod
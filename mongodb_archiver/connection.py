@@ -0,0 +1,204 @@
+"""
+Shared MongoDB connection pools - one MongoClient per URI and options per process
+Explicit pool sizing, compression, concerns and app name, with pool utilisation stats
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import importlib.util
+import threading
+
+from pymongo import MongoClient
+from pymongo import monitoring
+
+from config import Config
+
+
+# Wire compressors and the module pymongo needs for each
+COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Count connections per server from pymongo's pool events"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.servers: Dict[str, Dict[str, int]] = {}
+
+    def _server(self, address) -> Dict[str, int]:
+        key = f"{address[0]}:{address[1]}"
+        if key not in self.servers:
+            self.servers[key] = {
+                'open': 0, 'in_use': 0, 'waiting': 0, 'peak_in_use': 0,
+                'checkouts': 0, 'checkout_failures': 0,
+            }
+        return self.servers[key]
+
+    def _update(self, address, **deltas):
+        with self.lock:
+            server = self._server(address)
+            for field, delta in deltas.items():
+                server[field] += delta
+            server['peak_in_use'] = max(server['peak_in_use'], server['in_use'])
+
+    def connection_created(self, event):
+        self._update(event.address, open=1)
+
+    def connection_closed(self, event):
+        self._update(event.address, open=-1)
+
+    def connection_check_out_started(self, event):
+        self._update(event.address, waiting=1)
+
+    def connection_checked_out(self, event):
+        self._update(event.address, waiting=-1, in_use=1, checkouts=1)
+
+    def connection_check_out_failed(self, event):
+        self._update(event.address, waiting=-1, checkout_failures=1)
+
+    def connection_checked_in(self, event):
+        self._update(event.address, in_use=-1)
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            return {address: dict(counts) for address, counts in self.servers.items()}
+
+
+def supported_compressors(requested: str) -> List[str]:
+    """Requested compressors whose Python module is installed, in order"""
+    names = [name.strip() for name in (requested or "").split(",") if name.strip()]
+    return [
+        name for name in names
+        if name in COMPRESSOR_MODULES and importlib.util.find_spec(COMPRESSOR_MODULES[name])
+    ]
+
+
+def client_options(config: Config) -> Dict[str, Any]:
+    """MongoClient keyword arguments built from config"""
+    options: Dict[str, Any] = {
+        'maxPoolSize': config.mongo_max_pool_size,
+        'minPoolSize': config.mongo_min_pool_size,
+        'maxIdleTimeMS': config.mongo_max_idle_time_ms,
+        'waitQueueTimeoutMS': config.mongo_wait_queue_timeout_ms or None,
+        'serverSelectionTimeoutMS': 5000,
+        'connectTimeoutMS': 10000,
+        'appname': config.mongo_app_name,
+    }
+    compressors = supported_compressors(config.mongo_compressors)
+    if compressors:
+        options['compressors'] = ",".join(compressors)
+    if config.mongo_write_concern:
+        w = config.mongo_write_concern
+        options['w'] = int(w) if w.isdigit() else w
+    if config.mongo_read_concern:
+        options['readConcernLevel'] = config.mongo_read_concern
+    return options
+
+
+class _PooledClient:
+    def __init__(self, client: MongoClient, listener: PoolStatsListener, options: Dict[str, Any]):
+        self.client = client
+        self.listener = listener
+        self.options = options
+        self.users = 0
+
+
+_clients: Dict[Tuple, _PooledClient] = {}
+_lock = threading.Lock()
+
+
+def _key(uri: str, options: Dict[str, Any]) -> Tuple:
+    return (uri, tuple(sorted((name, str(value)) for name, value in options.items())))
+
+
+def get_client(config: Config) -> MongoClient:
+    """
+    MongoClient shared by every component of this process using the same
+    URI and pool settings (archiver, watcher, generator, simulators)
+
+    Each call must be paired with release_client(); the client is closed
+    when its last user releases it.
+
+    Args:
+        config: Configuration (mongodb_uri and mongo_* pool settings)
+
+    Returns:
+        Connected (lazily) MongoClient
+    """
+    options = client_options(config)
+    key = _key(config.mongodb_uri, options)
+    with _lock:
+        pooled = _clients.get(key)
+        if pooled is None:
+            listener = PoolStatsListener()
+            client = MongoClient(config.mongodb_uri, event_listeners=[listener], **options)
+            pooled = _clients[key] = _PooledClient(client, listener, options)
+        pooled.users += 1
+        return pooled.client
+
+
+def release_client(client: Optional[MongoClient]):
+    """Give back a client from get_client(); close it with its last user"""
+    if client is None:
+        return
+    with _lock:
+        for key, pooled in list(_clients.items()):
+            if pooled.client is client:
+                pooled.users -= 1
+                if pooled.users <= 0:
+                    del _clients[key]
+                    client.close()
+                return
+    # Not from the factory
+    client.close()
+
+
+def pool_stats() -> List[Dict[str, Any]]:
+    """
+    Utilisation of every shared pool of this process
+
+    Returns:
+        One entry per client and server: app name, users, maxPoolSize,
+        open / in_use / waiting / peak_in_use connections, checkouts,
+        checkout failures and utilisation (in_use / maxPoolSize)
+    """
+    with _lock:
+        pooled_clients = list(_clients.values())
+
+    stats = []
+    for pooled in pooled_clients:
+        max_pool_size = pooled.options['maxPoolSize']
+        for address, counts in pooled.listener.snapshot().items():
+            stats.append({
+                'app_name': pooled.options['appname'],
+                'address': address,
+                'users': pooled.users,
+                'max_pool_size': max_pool_size,
+                **counts,
+                'utilisation': counts['in_use'] / max_pool_size if max_pool_size else 0.0,
+            })
+    return stats
+
+
+def format_pool_stats() -> str:
+    """One line per pool, for logs"""
+    lines = [
+        f"🔌 {s['app_name']}@{s['address']}: {s['in_use']}/{s['max_pool_size']} in use "
+        f"(peak {s['peak_in_use']}, {s['open']} open, {s['waiting']} waiting, "
+        f"{s['checkout_failures']} checkout failures)"
+        for s in pool_stats()
+    ]
+    return "\n".join(lines) or "🔌 No open connection pool"
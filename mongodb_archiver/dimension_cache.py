@@ -0,0 +1,280 @@
+"""
+Client-side enrichment engine - Dimension cache for Client/Livreur/Restaurants/Menu
+Enriches Commande documents in Python instead of running the $lookup pipeline
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import threading
+import time
+
+from pymongo.errors import PyMongoError
+
+from config import Config
+from logger import setup_logger
+
+
+# Marker for "field not present", which aggregation expressions treat
+# differently from an explicit null
+MISSING = object()
+
+
+class DimensionCache:
+    """Thread-safe LRU cache with per-entry TTL"""
+
+    def __init__(self, loader: Callable[[Any], Optional[Dict]],
+                 max_size: int = 10000, ttl: float = 300.0):
+        self.loader = loader
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Any, Tuple[float, Optional[Dict]]]" = OrderedDict()
+        self._keys_by_id: Dict[Any, Any] = {}
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key: Any) -> Optional[Dict]:
+        """
+        Return the dimension document for key, loading it on a miss
+
+        Negative results (no document) are cached as well.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[1]
+            self.stats['misses'] += 1
+
+        doc = self.loader(key)
+        self.put(key, doc)
+        return doc
+
+    def put(self, key: Any, doc: Optional[Dict]):
+        """Insert or refresh an entry, evicting the least recently used ones"""
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (time.monotonic(), doc)
+            if doc is not None and '_id' in doc:
+                self._keys_by_id[doc['_id']] = key
+
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, key: Any = MISSING, doc_id: Any = MISSING):
+        """Drop the entry cached under key and/or holding the document doc_id"""
+        with self._lock:
+            if doc_id is not MISSING and doc_id in self._keys_by_id:
+                self._discard(self._keys_by_id[doc_id])
+                self.stats['invalidations'] += 1
+            if key is not MISSING and key in self._entries:
+                self._discard(key)
+                self.stats['invalidations'] += 1
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_id.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _discard(self, key: Any):
+        """Remove an entry (caller holds the lock)"""
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry[1] is not None:
+            self._keys_by_id.pop(entry[1].get('_id'), None)
+
+
+class ClientSideEnricher:
+    """
+    Enrich orders in Python from cached dimension documents
+
+    enrich() reproduces the $lookup/$arrayElemAt/$project stages of
+    OrderArchiver.build_enrichment_pipeline, including the aggregation
+    rules for missing fields, so both engines produce the same BSON.
+    """
+
+    # Commande fields kept as-is by the $project stage (inclusion)
+    INCLUDED_FIELDS = {
+        '_id', 'numero_commande', 'id_commande', 'adresse_livraison',
+        'adresse_commande', 'coût_commande', 'rémunération_livreur',
+        'moyen_de_payement', 'status', 'date_commande', 'temps_estimee'
+    }
+
+    def __init__(self, config: Config, db, logger=None):
+        self.config = config
+        self.db = db
+        self.logger = logger or setup_logger(__name__)
+
+        # dimension name -> (collection, local field, foreign field)
+        self.dimensions = {
+            'client': (config.collection_client, 'id_client', 'id_client'),
+            'livreur': (config.collection_livreur, 'id_livreur', 'id_livreur'),
+            'restaurant': (config.collection_restaurants, 'id_restaurant', 'id_restaurant'),
+            'menu': (config.collection_menu, 'id_menu', 'id_menu'),
+        }
+        self.caches = {
+            name: DimensionCache(
+                self._make_loader(collection, foreign_field),
+                max_size=config.dimension_cache_size,
+                ttl=config.dimension_cache_ttl
+            )
+            for name, (collection, _, foreign_field) in self.dimensions.items()
+        }
+
+        self._stop_event = threading.Event()
+        self._watchers: List[threading.Thread] = []
+
+    def _make_loader(self, collection: str, foreign_field: str) -> Callable:
+        """Build the cache loader for one dimension collection"""
+        def loader(key):
+            # Same matching as $lookup: a null key matches null or missing fields,
+            # and $arrayElemAt 0 keeps the first document
+            return self.db[collection].find_one({foreign_field: key})
+        return loader
+
+    def preload(self):
+        """Load every dimension document that fits in the caches"""
+        for name, (collection, _, foreign_field) in self.dimensions.items():
+            cache = self.caches[name]
+            count = 0
+            seen = set()
+            for doc in self.db[collection].find():
+                key = doc.get(foreign_field)
+                # Keep the first document per key, like find_one/$arrayElemAt
+                if key in seen:
+                    continue
+                seen.add(key)
+                cache.put(key, doc)
+                count += 1
+                if count >= cache.max_size:
+                    break
+            self.logger.info(f"📥 Preloaded {count} {collection} documents")
+
+    def start_invalidation(self):
+        """Watch each dimension collection and drop changed entries"""
+        for name, (collection, _, foreign_field) in self.dimensions.items():
+            thread = threading.Thread(
+                target=self._watch_dimension,
+                args=(collection, foreign_field, self.caches[name]),
+                name=f"cache-invalidation-{collection}",
+                daemon=True
+            )
+            thread.start()
+            self._watchers.append(thread)
+
+    def _watch_dimension(self, collection: str, foreign_field: str, cache: DimensionCache):
+        """Invalidate cache entries from a change stream on one collection"""
+        try:
+            with self.db[collection].watch(
+                full_document='updateLookup',
+                max_await_time_ms=1000
+            ) as stream:
+                while not self._stop_event.is_set():
+                    change = stream.try_next()
+                    if change is None:
+                        continue
+
+                    doc_id = change.get('documentKey', {}).get('_id', MISSING)
+                    full_document = change.get('fullDocument') or {}
+                    key = full_document.get(foreign_field, MISSING)
+                    cache.invalidate(key=key, doc_id=doc_id)
+
+                    if change.get('operationType') in ('drop', 'rename', 'invalidate'):
+                        cache.clear()
+
+        except PyMongoError as e:
+            # Change streams need a replica set; fall back to TTL expiry only
+            self.logger.warning(
+                f"⚠️  Cache invalidation disabled for {collection} "
+                f"(entries expire after {cache.ttl}s): {e}"
+            )
+
+    def stop(self):
+        """Stop the invalidation watchers"""
+        self._stop_event.set()
+        for thread in self._watchers:
+            thread.join(timeout=2)
+        self._watchers = []
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-dimension cache statistics"""
+        return {name: dict(cache.stats) for name, cache in self.caches.items()}
+
+    def enrich(self, order: Dict) -> Dict:
+        """
+        Enrich a raw Commande document
+
+        Args:
+            order: Commande document (plain find)
+
+        Returns:
+            Document identical to the output of the enrichment pipeline
+        """
+        lookups = {
+            name: self.caches[name].get(order.get(local_field))
+            for name, (_, local_field, _) in self.dimensions.items()
+        }
+        # $arrayElemAt on an empty $lookup result yields a missing field
+        client = lookups['client'] if lookups['client'] is not None else MISSING
+        livreur = lookups['livreur'] if lookups['livreur'] is not None else MISSING
+        restaurant = lookups['restaurant'] if lookups['restaurant'] is not None else MISSING
+        menu = lookups['menu'] if lookups['menu'] is not None else MISSING
+
+        # Inclusion projection keeps the input field order
+        result = {
+            field: value for field, value in order.items()
+            if field in self.INCLUDED_FIELDS
+        }
+
+        # Computed fields follow, in the order of the $project specification
+        computed = [
+            ('nom_client', self._full_name(client, else_value=_if_null(_get(order, 'Nom'), "Client inconnu"))),
+            ('email_client', _get(client, 'Email')),
+            ('telephone_client', _get(client, 'Téléphone')),
+            ('nom_livreur', self._full_name(livreur, else_value="Livreur non assigné")),
+            ('nom_restaurant', _if_null(_get(restaurant, 'name'), "Restaurant non spécifié")),
+            ('adresse_restaurant', _get(restaurant, 'address')),
+            ('nom_menu', _get(menu, 'name') if _ne_null(menu)
+                else _if_null(_get(order, 'Produit'), "Menu non spécifié")),
+            ('prix_menu', _if_null(_get(menu, 'price'), 0)),
+        ]
+        for field, value in computed:
+            # A computed expression evaluating to missing adds no field
+            if value is not MISSING:
+                result[field] = value
+
+        return result
+
+    @staticmethod
+    def _full_name(person: Any, else_value: Any) -> Any:
+        """$cond {$ne: [person, null]} -> $concat Prénom + " " + Nom"""
+        if not _ne_null(person):
+            return else_value
+        return (
+            f"{_if_null(_get(person, 'Prénom'), '')} "
+            f"{_if_null(_get(person, 'Nom'), '')}"
+        )
+
+
+def _get(doc: Any, field: str) -> Any:
+    """Field path lookup returning MISSING like "$doc.field" would"""
+    if not isinstance(doc, dict):
+        return MISSING
+    return doc.get(field, MISSING)
+
+
+def _if_null(value: Any, replacement: Any) -> Any:
+    """$ifNull: replace null and missing values"""
+    return replacement if value is None or value is MISSING else value
+
+
+def _ne_null(value: Any) -> bool:
+    """{$ne: [value, null]}: a missing value is not equal to null"""
+    return value is not None
@@ -0,0 +1,148 @@
+"""
+Bounded worker pool - fixed worker threads fed by a bounded admission queue
+Used by the platform orchestrator to run one order flow per worker with backpressure
+"""
+from typing import Any, Callable, Dict, List, Optional
+import queue
+import threading
+import time
+
+from logger import setup_logger
+from metrics import MetricsRegistry
+
+
+# Queue wait buckets in seconds (orders may wait for a worker for minutes)
+QUEUE_WAIT_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class BoundedExecutor:
+    """
+    Run tasks on max_workers threads, at most queue_size of them waiting
+
+    submit() blocks while the admission queue is full, so a fast producer
+    (e.g. a change stream) is slowed down to the workers' pace instead of
+    starting an unbounded number of threads. With a timeout, submit()
+    gives up and the task is counted as rejected.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        queue_size: int,
+        registry: Optional[MetricsRegistry] = None,
+        prefix: str = "executor",
+        logger=None
+    ):
+        self.max_workers = max(1, max_workers)
+        self.queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self.logger = logger or setup_logger(__name__)
+        self.threads: List[threading.Thread] = []
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.in_flight = 0
+
+        self.stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'completed': 0,
+            'failed': 0,
+        }
+
+        self.metrics = registry or MetricsRegistry()
+        self.metrics.register_stats(prefix, self.stats)
+        self.queue_wait = self.metrics.histogram(
+            f'{prefix}_queue_wait_seconds', 'Time spent in the admission queue before a worker',
+            QUEUE_WAIT_BUCKETS
+        )
+        self.metrics.gauge(
+            f'{prefix}_in_flight', 'Tasks running on a worker'
+        ).set_function(lambda: self.in_flight)
+        self.metrics.gauge(
+            f'{prefix}_queued', 'Tasks waiting in the admission queue'
+        ).set_function(self.queue.qsize)
+
+    def start(self):
+        """Start the worker threads"""
+        for index in range(self.max_workers):
+            thread = threading.Thread(target=self._work, name=f"worker-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, fn: Callable, *args: Any, timeout: Optional[float] = None) -> bool:
+        """
+        Queue fn(*args) for a worker, waiting while the queue is full
+
+        Args:
+            fn: Task function
+            *args: Task arguments
+            timeout: Max seconds to wait for room in the queue (None: no limit)
+
+        Returns:
+            True if queued, False if rejected after timeout
+        """
+        try:
+            self.queue.put((time.perf_counter(), fn, args), timeout=timeout)
+        except queue.Full:
+            self.stats['rejected'] += 1
+            return False
+        self.stats['submitted'] += 1
+        return True
+
+    def _work(self):
+        while True:
+            try:
+                enqueued, fn, args = self.queue.get(timeout=0.2)
+            except queue.Empty:
+                if self.stopping.is_set():
+                    return
+                continue
+            self.queue_wait.observe(time.perf_counter() - enqueued)
+            with self.lock:
+                self.in_flight += 1
+            outcome = 'completed'
+            try:
+                fn(*args)
+            except Exception as e:
+                outcome = 'failed'
+                self.logger.error("❌ Task %s failed: %s", getattr(fn, '__name__', fn), e)
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                    self.stats[outcome] += 1
+
+    def shutdown(self, wait: bool = True, cancel_pending: bool = False) -> List[tuple]:
+        """
+        Stop the workers once the queue is drained
+
+        Args:
+            wait: If True, wait for queued and running tasks to finish
+            cancel_pending: If True, drop the tasks still in the queue
+
+        Returns:
+            Arguments of the tasks dropped from the queue, so the caller can
+            give them a terminal state
+        """
+        dropped = []
+        if cancel_pending:
+            while True:
+                try:
+                    _, _, args = self.queue.get_nowait()
+                    dropped.append(args)
+                except queue.Empty:
+                    break
+        self.stopping.set()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+        self.threads = []
+        return dropped
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters plus current queue depth, in-flight tasks and mean queue wait"""
+        count = self.queue_wait.count
+        return {
+            **self.stats,
+            'queued': self.queue.qsize(),
+            'in_flight': self.in_flight,
+            'mean_queue_wait': self.queue_wait.sum / count if count else 0.0,
+        }
@@ -0,0 +1,241 @@
+"""
+Columnar export of Historique - Parquet / Arrow IPC files for analytics
+Streams archived orders batch by batch into compressed, partitioned files
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import json
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, only needed for main.py export
+    pa = None
+    pq = None
+
+from config import Config
+from logger import setup_logger
+
+
+def historique_schema() -> "pa.Schema":
+    """Arrow schema of an archived order (fields of the enrichment pipeline)"""
+    string = pa.string()
+    return pa.schema([
+        ("_id", string),
+        ("numero_commande", string),
+        ("id_commande", string),
+        ("adresse_livraison", string),
+        ("adresse_commande", string),
+        ("coût_commande", pa.float64()),
+        ("rémunération_livreur", pa.float64()),
+        ("moyen_de_payement", string),
+        ("status", string),
+        ("date_commande", pa.timestamp("ms")),
+        ("temps_estimee", pa.int64()),
+        ("nom_client", string),
+        ("email_client", string),
+        ("telephone_client", string),
+        ("nom_livreur", string),
+        ("nom_restaurant", string),
+        ("adresse_restaurant", string),
+        ("nom_menu", string),
+        ("prix_menu", pa.float64()),
+        ("date_archivage", pa.timestamp("ms")),
+        ("archived_by", string),
+        ("incomplete", pa.bool_()),
+        ("missing_fields", pa.list_(string)),
+    ])
+
+
+class HistoriqueExporter:
+    """
+    Export Historique to Parquet (or Arrow IPC) files, one batch in memory
+
+    Files are laid out as <output>/annee=YYYY/mois=MM/part-<run>.<ext>
+    (hive partitioning on date_commande). Each run only exports orders
+    archived since the previous run's watermark, kept in
+    <output>/_export_state.json.
+    """
+
+    FORMATS = ("parquet", "arrow")
+    STATE_FILE = "_export_state.json"
+
+    def __init__(self, config: Config, archiver, logger=None):
+        if pa is None:
+            raise ImportError("pyarrow is required for the export command (pip install pyarrow)")
+
+        self.config = config
+        self.archiver = archiver
+        self.logger = logger or setup_logger(__name__)
+        self.schema = historique_schema()
+        self.output_dir = Path(config.export_dir)
+        self.state_file = self.output_dir / self.STATE_FILE
+
+        # Statistics
+        self.stats = {'documents': 0, 'batches': 0, 'files': 0, 'bytes': 0, 'seconds': 0.0}
+
+    def load_watermark(self) -> Optional[datetime]:
+        """date_archivage up to which the previous runs exported"""
+        if not self.state_file.exists():
+            return None
+        with open(self.state_file, 'r') as f:
+            return datetime.fromisoformat(json.load(f)['last_date_archivage'])
+
+    def save_watermark(self, watermark: datetime):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_file.with_name(self.state_file.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'last_date_archivage': watermark.isoformat()}, f)
+        tmp_path.replace(self.state_file)
+
+    def to_record_batch(self, docs: List[Dict]) -> "pa.RecordBatch":
+        """Convert archived orders to an Arrow record batch (column by column)"""
+        columns = []
+        for field in self.schema:
+            values = [doc.get(field.name) for doc in docs]
+            if pa.types.is_string(field.type):
+                # ObjectIds and numbers stored in text fields
+                values = [v if v is None or isinstance(v, str) else str(v) for v in values]
+            elif pa.types.is_floating(field.type):
+                values = [float(v) if isinstance(v, (int, float)) else None for v in values]
+            elif pa.types.is_integer(field.type):
+                values = [int(v) if isinstance(v, (int, float)) else None for v in values]
+            elif pa.types.is_timestamp(field.type):
+                values = [v if isinstance(v, datetime) else None for v in values]
+            columns.append(pa.array(values, type=field.type))
+        return pa.RecordBatch.from_arrays(columns, schema=self.schema)
+
+    @staticmethod
+    def partition_key(doc: Dict) -> str:
+        """Hive partition directory of an order"""
+        date_commande = doc.get('date_commande')
+        if not isinstance(date_commande, datetime):
+            return "annee=inconnue"
+        return f"annee={date_commande.year:04d}/mois={date_commande.month:02d}"
+
+    def iter_batches(self, docs: Iterable[Dict], batch_size: int) -> Iterator[List[Dict]]:
+        batch = []
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def write(self, docs: Iterable[Dict], run_id: str, fmt: str = "parquet") -> Optional[datetime]:
+        """
+        Write documents to partitioned files
+
+        Args:
+            docs: Archived orders (any iterable, consumed batch by batch)
+            run_id: Identifier used in file names
+            fmt: "parquet" or "arrow" (IPC file)
+
+        Returns:
+            Highest date_archivage written, or None
+        """
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}. Choose one of {', '.join(self.FORMATS)}")
+
+        writers: Dict[str, Tuple[object, Path]] = {}
+        latest = None
+        started = time.perf_counter()
+
+        try:
+            for batch in self.iter_batches(docs, max(1, self.config.export_batch_size)):
+                groups: Dict[str, List[Dict]] = {}
+                for doc in batch:
+                    groups.setdefault(self.partition_key(doc), []).append(doc)
+                    archived_at = doc.get('date_archivage')
+                    if isinstance(archived_at, datetime) and (latest is None or archived_at > latest):
+                        latest = archived_at
+
+                for key, group in groups.items():
+                    if key not in writers:
+                        writers[key] = self.open_writer(key, run_id, fmt)
+                    writer, _ = writers[key]
+                    record_batch = self.to_record_batch(group)
+                    if fmt == "parquet":
+                        writer.write_table(pa.Table.from_batches([record_batch]))
+                    else:
+                        writer.write_batch(record_batch)
+
+                self.stats['documents'] += len(batch)
+                self.stats['batches'] += 1
+                self.logger.info(f"📤 Exported {self.stats['documents']} orders")
+
+        finally:
+            for writer, path in writers.values():
+                writer.close()
+                self.stats['files'] += 1
+                self.stats['bytes'] += path.stat().st_size
+            self.stats['seconds'] += time.perf_counter() - started
+
+        return latest
+
+    def open_writer(self, key: str, run_id: str, fmt: str) -> Tuple[object, Path]:
+        """Open the file of one partition for this run"""
+        directory = self.output_dir / key
+        directory.mkdir(parents=True, exist_ok=True)
+        compression = self.config.export_compression
+        path = directory / f"part-{run_id}.{fmt}"
+
+        if fmt == "parquet":
+            return pq.ParquetWriter(str(path), self.schema, compression=compression), path
+
+        options = pa.ipc.IpcWriteOptions(
+            compression=None if compression == "none" else compression
+        )
+        return pa.ipc.new_file(str(path), self.schema, options=options), path
+
+    def export(self, full: bool = False, fmt: str = "parquet") -> Dict:
+        """
+        Export the orders archived since the last run
+
+        Orders archived within config.export_safety_lag seconds are left
+        for the next run: date_archivage is set right before the insert, so
+        a batch still in flight could otherwise land behind the watermark.
+        The watermark is the highest date_archivage actually exported, not
+        the cutoff, so late documents stamped below the cutoff are picked up
+        by the next run.
+
+        Args:
+            full: If True, ignore the watermark and export everything
+            fmt: "parquet" or "arrow"
+
+        Returns:
+            Export statistics
+        """
+        since = None if full else self.load_watermark()
+        cutoff = datetime.now() - timedelta(seconds=self.config.export_safety_lag)
+        cutoff = cutoff.replace(microsecond=cutoff.microsecond // 1000 * 1000)
+
+        query = {'date_archivage': {'$lte': cutoff}}
+        if since:
+            query['date_archivage']['$gt'] = since
+            self.logger.info(f"🔁 Incremental export since {since}")
+
+        projection = {field.name: 1 for field in self.schema}
+        docs = self.archiver.partitions.find(
+            query, projection=projection, batch_size=self.config.export_batch_size
+        )
+
+        run_id = cutoff.strftime("%Y%m%dT%H%M%S")
+        latest = self.write(docs, run_id, fmt)
+
+        # Everything archived up to the last exported document is now exported
+        if latest is not None:
+            self.save_watermark(latest)
+        self.logger.info(self.get_stats_summary())
+        return self.stats
+
+    def get_stats_summary(self) -> str:
+        seconds = self.stats['seconds'] or 1e-9
+        return (
+            f"📦 {self.stats['documents']} orders in {self.stats['files']} files, "
+            f"{self.stats['bytes'] / 1024 / 1024:.1f} MiB, "
+            f"{self.stats['documents'] / seconds:,.0f} orders/s"
+        )
@@ -0,0 +1,224 @@
+"""
+Vectorized test data generator - Faker-free fast path (simulate.py --fast)
+Faker vocabularies are sampled once, then whole chunks are built with NumPy
+"""
+import hashlib
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Sequence
+
+from faker import Faker
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency, only needed for --fast
+    np = None
+
+from config import Config
+from generator import DataGenerator
+
+
+class FastDataGenerator(DataGenerator):
+    """
+    Same documents layout as DataGenerator, built column by column
+
+    Text fields are drawn from vocabularies sampled once from Faker, numbers
+    and dates come from NumPy arrays covering the whole chunk.
+    """
+
+    VOCABULARY_SIZE = 5000
+
+    def __init__(self, config: Config, seed: int = None, logger=None,
+                 reference_time: Optional[datetime] = None):
+        if np is None:
+            raise ImportError("numpy is required for the fast generator (pip install numpy)")
+
+        super().__init__(config, seed=seed, logger=logger, reference_time=reference_time)
+        self.rng = np.random.default_rng(seed)
+        self.vocabulary = self.sample_vocabulary(seed)
+        self._id_arrays = {}
+
+    def sample_vocabulary(self, seed: int = None) -> Dict[str, "np.ndarray"]:
+        """Draw VOCABULARY_SIZE values of every Faker field used by the documents"""
+        fake = Faker(['fr_FR'])
+        if seed is not None:
+            fake.seed_instance(f"{seed}:vocabulary")
+
+        size = self.VOCABULARY_SIZE
+        fields = {
+            'last_name': fake.last_name,
+            'first_name': fake.first_name,
+            'name': fake.name,
+            'email': fake.email,
+            'phone_number': fake.phone_number,
+            'address': lambda: fake.address().replace('\n', ', '),
+            'company': lambda: f"{fake.company()} Restaurant",
+            'catch_phrase': fake.catch_phrase,
+            'sentence': fake.sentence,
+            'word': fake.word,
+        }
+        return {
+            field: np.array([make() for _ in range(size)], dtype=object)
+            for field, make in fields.items()
+        }
+
+    def seed_chunk(self, chunk_seed: str):
+        """Reseed the NumPy generator for one chunk (see DataGenerator.seed_chunk)"""
+        super().seed_chunk(chunk_seed)
+        digest = hashlib.sha256(chunk_seed.encode()).digest()
+        self.rng = np.random.default_rng(int.from_bytes(digest[:8], 'big'))
+
+    # Column builders
+
+    def words(self, field: str, count: int) -> "np.ndarray":
+        """count values drawn from one vocabulary"""
+        vocabulary = self.vocabulary[field]
+        return vocabulary[self.rng.integers(0, len(vocabulary), count)]
+
+    def choices(self, values: Sequence, count: int) -> "np.ndarray":
+        """count values drawn uniformly from values"""
+        return np.array(values, dtype=object)[self.rng.integers(0, len(values), count)]
+
+    def uniform(self, low: float, high: float, count: int, decimals: int) -> "np.ndarray":
+        return np.round(self.rng.uniform(low, high, count), decimals)
+
+    def randint(self, low: int, high: int, count: int) -> "np.ndarray":
+        """Integers in [low, high], bounds included like random.randint"""
+        return self.rng.integers(low, high + 1, count)
+
+    def datetimes(self, start: datetime, end: datetime, count: int) -> List[datetime]:
+        """count datetimes between start and end (second resolution)"""
+        span = max(1, int((end - start).total_seconds()))
+        offsets = self.rng.integers(0, span + 1, count).astype('timedelta64[s]')
+        return (np.datetime64(start.replace(microsecond=0), 's') + offsets).tolist()
+
+    def past_datetimes(self, years: int, count: int) -> List[datetime]:
+        now = self.reference_time or self.pin_reference_time()
+        return self.datetimes(now - timedelta(days=365 * years), now, count)
+
+    def object_ids(self, count: int) -> List[str]:
+        """String ObjectIds (24 hex digits) drawn from the chunk generator"""
+        raw = self.rng.bytes(12 * count)
+        return [raw[i:i + 12].hex() for i in range(0, 12 * count, 12)]
+
+    def foreign_ids(self, ids: Sequence[str], count: int, p_null: float) -> "np.ndarray":
+        """count ids drawn from ids, None with probability p_null"""
+        key = id(ids)
+        if key not in self._id_arrays:
+            # Keep a reference to ids so its id() cannot be reused
+            self._id_arrays[key] = (ids, np.array(list(ids), dtype=object))
+        column = self._id_arrays[key][1][self.rng.integers(0, len(ids), count)]
+        column[self.rng.random(count) < p_null] = None
+        return column
+
+    @staticmethod
+    def assemble(columns: Dict[str, Sequence]) -> List[Dict]:
+        """Turn columns into documents"""
+        fields = list(columns)
+        values = [
+            column.tolist() if hasattr(column, 'tolist') else column
+            for column in columns.values()
+        ]
+        return [dict(zip(fields, row)) for row in zip(*values)]
+
+    # Collections
+
+    def generate_clients(self, count: int, start: int = 0) -> List[Dict]:
+        """Generate random clients"""
+        return self.assemble({
+            "id_client": [f"CLI-{i+1:05d}" for i in range(start, start + count)],
+            "Nom": self.words('last_name', count),
+            "Prénom": self.words('first_name', count),
+            "Email": self.words('email', count),
+            "Téléphone": self.words('phone_number', count),
+            "Adresse": self.words('address', count),
+            "date_inscription": self.past_datetimes(2, count),
+        })
+
+    def generate_livreurs(self, count: int, start: int = 0) -> List[Dict]:
+        """Generate random delivery drivers"""
+        return self.assemble({
+            "id_livreur": [f"LIV-{i+1:05d}" for i in range(start, start + count)],
+            "Nom": self.words('last_name', count),
+            "Prénom": self.words('first_name', count),
+            "Téléphone": self.words('phone_number', count),
+            "Email": self.words('email', count),
+            "vehicule": self.choices(self.VEHICULES, count),
+            "statut": self.choices(self.LIVREUR_STATUTS, count),
+            "note_moyenne": self.uniform(3.5, 5.0, count, 1),
+            "date_embauche": self.past_datetimes(1, count),
+        })
+
+    def generate_restaurants(self, count: int, start: int = 0) -> List[Dict]:
+        """Generate random restaurants"""
+        return self.assemble({
+            "id_restaurant": [f"RES-{i+1:05d}" for i in range(start, start + count)],
+            "name": self.words('company', count),
+            "address": self.words('address', count),
+            "cuisine": self.choices(self.CUISINES, count),
+            "note_moyenne": self.uniform(3.0, 5.0, count, 1),
+            "temps_preparation_moyen": self.randint(15, 45, count),
+            "telephone": self.words('phone_number', count),
+            "horaires": ["11:00-23:00"] * count,
+        })
+
+    def generate_menus(self, count: int, start: int = 0) -> List[Dict]:
+        """Generate random menu items"""
+        return self.assemble({
+            "id_menu": [f"MEN-{i+1:05d}" for i in range(start, start + count)],
+            "name": np.where(
+                self.rng.random(count) > 0.3,
+                self.choices(self.PLATS, count),
+                self.words('catch_phrase', count)
+            ),
+            "category": self.choices(self.MENU_CATEGORIES, count),
+            "price": self.uniform(5.0, 35.0, count, 2),
+            "description": self.words('sentence', count),
+            "disponible": self.rng.random(count) < 0.75,
+            "temps_preparation": self.randint(10, 40, count),
+        })
+
+    def generate_commandes(
+        self,
+        count: int,
+        client_ids: List[str],
+        livreur_ids: List[str],
+        restaurant_ids: List[str],
+        menu_ids: List[str],
+        p_delivered: float = 0.3,
+        p_null_ids: float = 0.05,
+        days_back: int = 30,
+        start: int = 0
+    ) -> List[Dict]:
+        """Generate random orders (see DataGenerator.generate_commandes)"""
+        end_date = self.reference_time or self.pin_reference_time()
+
+        status = np.where(
+            self.rng.random(count) < p_delivered,
+            'livrée',
+            self.choices(self.STATUSES, count)
+        )
+        id_client = self.foreign_ids(client_ids, count, p_null_ids)
+        id_menu = self.foreign_ids(menu_ids, count, p_null_ids)
+
+        prix_menu = self.uniform(8.0, 40.0, count, 2)
+        frais_livraison = self.uniform(1.5, 5.0, count, 2)
+
+        return self.assemble({
+            "numero_commande": [f"CMD-2025-{i+1:06d}" for i in range(start, start + count)],
+            "id_commande": self.object_ids(count),
+            "id_client": id_client,
+            "id_livreur": self.foreign_ids(livreur_ids, count, p_null_ids),
+            "id_restaurant": self.foreign_ids(restaurant_ids, count, p_null_ids),
+            "id_menu": id_menu,
+            # Fallback name/product when the reference is missing
+            "Nom": np.where(id_client == None, self.words('name', count), None),  # noqa: E711
+            "Produit": np.where(id_menu == None, self.words('word', count), None),  # noqa: E711
+            "adresse_livraison": self.words('address', count),
+            "adresse_commande": self.words('address', count),
+            "coût_commande": np.round(prix_menu + frais_livraison, 2),
+            "rémunération_livreur": np.round(frais_livraison * 0.7, 2),
+            "moyen_de_payement": self.choices(self.MOYENS_PAIEMENT, count),
+            "status": status,
+            "date_commande": self.datetimes(end_date - timedelta(days=days_back), end_date, count),
+            "temps_estimee": self.randint(20, 60, count),
+        })
@@ -2,8 +2,9 @@
 Test data generator - Creates random orders for testing
 """
 import random
+import multiprocessing
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from bson import ObjectId
 from faker import Faker
 
@@ -11,13 +12,57 @@ from config import Config
 from logger import setup_logger
 
 
+# Collections generated in streaming mode, in insertion order
+STREAM_KINDS = ('clients', 'livreurs', 'restaurants', 'menus', 'commandes')
+
+
+class IdSequence:
+    """Lazy list of generated ids (CLI-00001, ...) usable with random.choice"""
+    
+    def __init__(self, prefix: str, count: int):
+        self.prefix = prefix
+        self.count = count
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    def __getitem__(self, index: int) -> str:
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return f"{self.prefix}-{index+1:05d}"
+
+
 class DataGenerator:
     """Generate realistic test data for MongoDB"""
     
-    def __init__(self, config: Config, seed: int = None, logger=None):
+    VEHICULES = ['Vélo', 'Scooter', 'Voiture', 'Moto']
+    LIVREUR_STATUTS = ['disponible', 'en_course', 'hors_ligne']
+    CUISINES = [
+        'Française', 'Italienne', 'Japonaise', 'Chinoise', 
+        'Indienne', 'Mexicaine', 'Burger', 'Pizza', 'Sushi', 'Kebab'
+    ]
+    MENU_CATEGORIES = ['Entrée', 'Plat', 'Dessert', 'Boisson', 'Menu']
+    PLATS = [
+        'Salade César', 'Pizza Margherita', 'Burger Classic', 
+        'Sushi Mix', 'Pad Thai', 'Couscous', 'Tacos', 
+        'Pasta Carbonara', 'Poke Bowl', 'Ramen'
+    ]
+    STATUSES = ['en_attente', 'en_preparation', 'en_cours', 'livrée', 'annulée']
+    MOYENS_PAIEMENT = ['CB', 'Espèces', 'Paypal', 'Apple Pay', 'Google Pay']
+    
+    def __init__(self, config: Config, seed: int = None, logger=None,
+                 reference_time: Optional[datetime] = None):
         self.config = config
         self.logger = logger or setup_logger(__name__)
         self.fake = Faker(['fr_FR'])
+        self.seed = seed
+        
+        # Source of randomness: the global generator, or a per-chunk one
+        # when generating in streaming mode (see seed_chunk)
+        self.random = random
+        self.deterministic_ids = False
+        # Fixed "now" every date is drawn against (None: pinned by populate_database)
+        self.reference_time: Optional[datetime] = reference_time
         
         if seed is not None:
             random.seed(seed)
@@ -29,17 +74,55 @@ class DataGenerator:
     
     def connect(self):
         """Connect to MongoDB"""
-        from pymongo import MongoClient
+        from connection import get_client
         
         self.logger.info("Connecting to MongoDB...")
-        self.client = MongoClient(self.config.mongodb_uri)
+        self.client = get_client(self.config)
         self.db = self.client[self.config.database_name]
         self.logger.info(f"✅ Connected to: {self.config.database_name}")
     
-    def generate_clients(self, count: int) -> List[Dict]:
+    def seed_chunk(self, chunk_seed: str):
+        """
+        Reseed Faker and the random generator for one chunk
+        
+        Every chunk is generated from its own seed, so its content does not
+        depend on which worker generates it, nor in which order.
+        """
+        self.random = random.Random(chunk_seed)
+        self.fake.seed_instance(chunk_seed)
+        self.deterministic_ids = True
+    
+    def new_object_id(self) -> ObjectId:
+        """ObjectId drawn from the chunk generator when seeded, else a fresh one"""
+        if self.deterministic_ids:
+            return ObjectId(self.random.getrandbits(96).to_bytes(12, 'big'))
+        return ObjectId()
+    
+    def pin_reference_time(self) -> datetime:
+        """
+        Fix the reference time of this run and log it next to the seed
+        
+        Dates are drawn relative to it, so replaying a run needs both the seed
+        and this value (--reference-time).
+        """
+        if self.reference_time is None:
+            self.reference_time = datetime.now().replace(microsecond=0)
+        stamp = self.reference_time.isoformat()
+        self.logger.info(f"🕒 Reference time: {stamp} (pass --reference-time {stamp} to replay)")
+        return self.reference_time
+    
+    def past_datetime(self, years: int) -> datetime:
+        """Random datetime within the last N years (relative to reference_time)"""
+        reference = self.reference_time or self.pin_reference_time()
+        return self.fake.date_time_between(
+            start_date=reference - timedelta(days=365 * years),
+            end_date=reference
+        )
+    
+    def generate_clients(self, count: int, start: int = 0) -> List[Dict]:
         """Generate random clients"""
         clients = []
-        for i in range(count):
+        for i in range(start, start + count):
             client = {
                 "id_client": f"CLI-{i+1:05d}",
                 "Nom": self.fake.last_name(),
@@ -47,78 +130,61 @@ class DataGenerator:
                 "Email": self.fake.email(),
                 "Téléphone": self.fake.phone_number(),
                 "Adresse": self.fake.address().replace('\n', ', '),
-                "date_inscription": self.fake.date_time_between(
-                    start_date='-2y',
-                    end_date='now'
-                )
+                "date_inscription": self.past_datetime(years=2)
             }
             clients.append(client)
         return clients
     
-    def generate_livreurs(self, count: int) -> List[Dict]:
+    def generate_livreurs(self, count: int, start: int = 0) -> List[Dict]:
         """Generate random delivery drivers"""
         livreurs = []
-        vehicules = ['Vélo', 'Scooter', 'Voiture', 'Moto']
         
-        for i in range(count):
+        for i in range(start, start + count):
             livreur = {
                 "id_livreur": f"LIV-{i+1:05d}",
                 "Nom": self.fake.last_name(),
                 "Prénom": self.fake.first_name(),
                 "Téléphone": self.fake.phone_number(),
                 "Email": self.fake.email(),
-                "vehicule": random.choice(vehicules),
-                "statut": random.choice(['disponible', 'en_course', 'hors_ligne']),
-                "note_moyenne": round(random.uniform(3.5, 5.0), 1),
-                "date_embauche": self.fake.date_time_between(
-                    start_date='-1y',
-                    end_date='now'
-                )
+                "vehicule": self.random.choice(self.VEHICULES),
+                "statut": self.random.choice(self.LIVREUR_STATUTS),
+                "note_moyenne": round(self.random.uniform(3.5, 5.0), 1),
+                "date_embauche": self.past_datetime(years=1)
             }
             livreurs.append(livreur)
         return livreurs
     
-    def generate_restaurants(self, count: int) -> List[Dict]:
+    def generate_restaurants(self, count: int, start: int = 0) -> List[Dict]:
         """Generate random restaurants"""
         restaurants = []
-        cuisines = [
-            'Française', 'Italienne', 'Japonaise', 'Chinoise', 
-            'Indienne', 'Mexicaine', 'Burger', 'Pizza', 'Sushi', 'Kebab'
-        ]
         
-        for i in range(count):
+        for i in range(start, start + count):
             restaurant = {
                 "id_restaurant": f"RES-{i+1:05d}",
                 "name": f"{self.fake.company()} Restaurant",
                 "address": self.fake.address().replace('\n', ', '),
-                "cuisine": random.choice(cuisines),
-                "note_moyenne": round(random.uniform(3.0, 5.0), 1),
-                "temps_preparation_moyen": random.randint(15, 45),
+                "cuisine": self.random.choice(self.CUISINES),
+                "note_moyenne": round(self.random.uniform(3.0, 5.0), 1),
+                "temps_preparation_moyen": self.random.randint(15, 45),
                 "telephone": self.fake.phone_number(),
                 "horaires": "11:00-23:00"
             }
             restaurants.append(restaurant)
         return restaurants
     
-    def generate_menus(self, count: int) -> List[Dict]:
+    def generate_menus(self, count: int, start: int = 0) -> List[Dict]:
         """Generate random menu items"""
         menus = []
-        categories = ['Entrée', 'Plat', 'Dessert', 'Boisson', 'Menu']
-        plats = [
-            'Salade César', 'Pizza Margherita', 'Burger Classic', 
-            'Sushi Mix', 'Pad Thai', 'Couscous', 'Tacos', 
-            'Pasta Carbonara', 'Poke Bowl', 'Ramen'
-        ]
         
-        for i in range(count):
+        for i in range(start, start + count):
             menu = {
                 "id_menu": f"MEN-{i+1:05d}",
-                "name": random.choice(plats) if random.random() > 0.3 else self.fake.catch_phrase(),
-                "category": random.choice(categories),
-                "price": round(random.uniform(5.0, 35.0), 2),
+                "name": self.random.choice(self.PLATS) if self.random.random() > 0.3 else self.fake.catch_phrase(),
+                "category": self.random.choice(self.MENU_CATEGORIES),
+                "price": round(self.random.uniform(5.0, 35.0), 2),
                 "description": self.fake.sentence(),
-                "disponible": random.choice([True, True, True, False]),
-                "temps_preparation": random.randint(10, 40)
+                "disponible": self.random.choice([True, True, True, False]),
+                "temps_preparation": self.random.randint(10, 40)
             }
             menus.append(menu)
         return menus
@@ -132,7 +198,8 @@ class DataGenerator:
         menu_ids: List[str],
         p_delivered: float = 0.3,
         p_null_ids: float = 0.05,
-        days_back: int = 30
+        days_back: int = 30,
+        start: int = 0
     ) -> List[Dict]:
         """
         Generate random orders
@@ -146,39 +213,38 @@ class DataGenerator:
             p_delivered: Probability of status being "livrée" (0-1)
             p_null_ids: Probability of missing related IDs (0-1)
             days_back: Number of days to spread orders over
+            start: Index of the first order (numero_commande offset)
         """
         commandes = []
-        statuses = ['en_attente', 'en_preparation', 'en_cours', 'livrée', 'annulée']
-        moyens_paiement = ['CB', 'Espèces', 'Paypal', 'Apple Pay', 'Google Pay']
         
-        start_date = datetime.now() - timedelta(days=days_back)
+        start_date = (self.reference_time or self.pin_reference_time()) - timedelta(days=days_back)
         
-        for i in range(count):
+        for i in range(start, start + count):
             # Determine status with weighted probability
-            if random.random() < p_delivered:
+            if self.random.random() < p_delivered:
                 status = 'livrée'
             else:
-                status = random.choice(statuses)
+                status = self.random.choice(self.STATUSES)
             
             # Randomly assign or null IDs based on p_null_ids
-            id_client = None if random.random() < p_null_ids else random.choice(client_ids)
-            id_livreur = None if random.random() < p_null_ids else random.choice(livreur_ids)
-            id_restaurant = None if random.random() < p_null_ids else random.choice(restaurant_ids)
-            id_menu = None if random.random() < p_null_ids else random.choice(menu_ids)
+            id_client = None if self.random.random() < p_null_ids else self.random.choice(client_ids)
+            id_livreur = None if self.random.random() < p_null_ids else self.random.choice(livreur_ids)
+            id_restaurant = None if self.random.random() < p_null_ids else self.random.choice(restaurant_ids)
+            id_menu = None if self.random.random() < p_null_ids else self.random.choice(menu_ids)
             
             # Generate dates
             date_commande = start_date + timedelta(
-                seconds=random.randint(0, days_back * 24 * 3600)
+                seconds=self.random.randint(0, days_back * 24 * 3600)
             )
             
-            prix_menu = round(random.uniform(8.0, 40.0), 2)
-            frais_livraison = round(random.uniform(1.5, 5.0), 2)
+            prix_menu = round(self.random.uniform(8.0, 40.0), 2)
+            frais_livraison = round(self.random.uniform(1.5, 5.0), 2)
             cout_total = round(prix_menu + frais_livraison, 2)
             remuneration = round(frais_livraison * 0.7, 2)
             
             commande = {
                 "numero_commande": f"CMD-2025-{i+1:06d}",
-                "id_commande": str(ObjectId()),
+                "id_commande": str(self.new_object_id()),
                 "id_client": id_client,
                 "id_livreur": id_livreur,
                 "id_restaurant": id_restaurant,
@@ -189,10 +255,10 @@ class DataGenerator:
                 "adresse_commande": self.fake.address().replace('\n', ', '),
                 "coût_commande": cout_total,
                 "rémunération_livreur": remuneration,
-                "moyen_de_payement": random.choice(moyens_paiement),
+                "moyen_de_payement": self.random.choice(self.MOYENS_PAIEMENT),
                 "status": status,
                 "date_commande": date_commande,
-                "temps_estimee": random.randint(20, 60)
+                "temps_estimee": self.random.randint(20, 60)
             }
             
             commandes.append(commande)
@@ -208,7 +274,9 @@ class DataGenerator:
         n_commandes: int = 1000,
         p_delivered: float = 0.3,
         p_null_ids: float = 0.05,
-        clear_existing: bool = False
+        clear_existing: bool = False,
+        workers: int = 0,
+        chunk_size: int = 10000
     ):
         """
         Populate database with test data
@@ -222,11 +290,15 @@ class DataGenerator:
             p_delivered: Probability of order being delivered
             p_null_ids: Probability of missing related IDs
             clear_existing: If True, clear existing data first
+            workers: Streaming mode with N processes generating and inserting
+                chunks (0: build every collection in memory)
+            chunk_size: Documents per chunk in streaming mode
         """
         if not self.client:
             self.connect()
         
         self.logger.info("🏗️  Starting database population...")
+        self.pin_reference_time()
         
         # Clear existing data if requested
         if clear_existing:
@@ -241,6 +313,20 @@ class DataGenerator:
                 self.db[collection].delete_many({})
             self.logger.info("✅ Existing data cleared")
         
+        if workers:
+            counts = {
+                'clients': n_clients,
+                'livreurs': n_livreurs,
+                'restaurants': n_restaurants,
+                'menus': n_menus,
+                'commandes': n_commandes,
+            }
+            n_delivered = self.populate_streaming(
+                counts, p_delivered, p_null_ids, workers, chunk_size
+            )
+            self.log_summary(n_clients, n_livreurs, n_restaurants, n_menus, n_commandes, n_delivered)
+            return
+        
         # Generate and insert clients
         self.logger.info(f"👥 Generating {n_clients} clients...")
         clients = self.generate_clients(n_clients)
@@ -281,6 +367,91 @@ class DataGenerator:
         # Count delivered orders
         n_delivered = sum(1 for c in commandes if c['status'] == 'livrée')
         
+        self.log_summary(n_clients, n_livreurs, n_restaurants, n_menus, n_commandes, n_delivered)
+    
+    def populate_streaming(
+        self,
+        counts: Dict[str, int],
+        p_delivered: float,
+        p_null_ids: float,
+        workers: int,
+        chunk_size: int
+    ) -> int:
+        """
+        Generate and insert every collection chunk by chunk in worker processes
+        
+        Each chunk is seeded from (seed, collection, first index), so a given
+        seed and chunk size produce the same documents whatever the number of
+        workers. Only one chunk per worker is held in memory.
+        
+        Args:
+            counts: Number of documents per kind (see STREAM_KINDS)
+            p_delivered: Probability of order being delivered
+            p_null_ids: Probability of missing related IDs
+            workers: Number of processes (1: generate in this process)
+            chunk_size: Documents per chunk
+            
+        Returns:
+            Number of delivered orders generated
+        """
+        base_seed = self.seed
+        if base_seed is None:
+            base_seed = random.SystemRandom().randrange(2**32)
+            self.logger.info(f"🎲 Streaming seed: {base_seed} (pass --seed {base_seed} to replay)")
+        
+        tasks = [
+            (kind, start, min(chunk_size, counts[kind] - start))
+            for kind in STREAM_KINDS
+            for start in range(0, counts[kind], chunk_size)
+        ]
+        initargs = (
+            self.config,
+            base_seed,
+            counts,
+            {'p_delivered': p_delivered, 'p_null_ids': p_null_ids},
+            self.reference_time or self.pin_reference_time(),
+            type(self)
+        )
+        total = sum(counts.values())
+        self.logger.info(
+            f"🏭 Streaming {total:,} documents in {len(tasks)} chunks "
+            f"of {chunk_size:,} with {workers} worker(s)..."
+        )
+        
+        pool = None
+        writer = None
+        if workers == 1:
+            writer = ChunkWriter(*initargs)
+            results = (writer.write_chunk(*task) for task in tasks)
+        else:
+            # spawn: no MongoClient is inherited through fork
+            pool = multiprocessing.get_context('spawn').Pool(
+                workers, initializer=_init_chunk_worker, initargs=initargs
+            )
+            results = pool.imap_unordered(_write_chunk, tasks)
+        
+        inserted = 0
+        n_delivered = 0
+        next_report = total / 10
+        try:
+            for _, count, delivered in results:
+                inserted += count
+                n_delivered += delivered
+                if inserted >= next_report or inserted == total:
+                    self.logger.info(f"📦 {inserted:,}/{total:,} documents inserted")
+                    next_report += total / 10
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+            if writer:
+                writer.close()
+        
+        return n_delivered
+    
+    def log_summary(self, n_clients: int, n_livreurs: int, n_restaurants: int,
+                    n_menus: int, n_commandes: int, n_delivered: int):
+        """Log the generated data summary"""
         self.logger.info("✅ Database population complete!")
         self.logger.info(f"""
 {'='*70}
@@ -291,7 +462,7 @@ Delivery Drivers: {n_livreurs}
 Restaurants:     {n_restaurants}
 Menu Items:      {n_menus}
 Orders:          {n_commandes}
-  - Delivered:   {n_delivered} ({n_delivered/n_commandes*100:.1f}%)
+  - Delivered:   {n_delivered} ({n_delivered/max(n_commandes, 1)*100:.1f}%)
   - Other:       {n_commandes - n_delivered}
 {'='*70}
 """)
@@ -299,5 +470,82 @@ Orders:          {n_commandes}
     def close(self):
         """Close MongoDB connection"""
         if self.client:
-            self.client.close()
+            from connection import release_client
+            
+            release_client(self.client)
+            self.client = None
             self.logger.info("🔌 Connection closed")
+
+
+class ChunkWriter:
+    """Generate chunks from their own seeds and insert them (one per process)"""
+    
+    def __init__(self, config: Config, base_seed: int, counts: Dict[str, int],
+                 order_options: Dict, reference_time: datetime,
+                 generator_class: type = DataGenerator):
+        from connection import get_client
+        
+        self.base_seed = base_seed
+        self.order_options = order_options
+        self.generator = generator_class(
+            config, seed=base_seed, logger=setup_logger('generator_worker')
+        )
+        self.generator.reference_time = reference_time
+        
+        # One connection pool per process, shared by all its chunks
+        self.client = get_client(config)
+        self.db = self.client[config.database_name]
+        self.collections = {
+            'clients': config.collection_client,
+            'livreurs': config.collection_livreur,
+            'restaurants': config.collection_restaurants,
+            'menus': config.collection_menu,
+            'commandes': config.collection_commande,
+        }
+        
+        # Foreign keys of the orders, without materializing the id lists
+        self.foreign_ids = {
+            'client_ids': IdSequence('CLI', counts['clients']),
+            'livreur_ids': IdSequence('LIV', counts['livreurs']),
+            'restaurant_ids': IdSequence('RES', counts['restaurants']),
+            'menu_ids': IdSequence('MEN', counts['menus']),
+        }
+    
+    def generate_chunk(self, kind: str, start: int, count: int) -> List[Dict]:
+        """Generate documents [start, start + count) of one collection"""
+        self.generator.seed_chunk(f"{self.base_seed}:{kind}:{start}")
+        if kind == 'commandes':
+            return self.generator.generate_commandes(
+                count, start=start, **self.foreign_ids, **self.order_options
+            )
+        return getattr(self.generator, f"generate_{kind}")(count, start=start)
+    
+    def write_chunk(self, kind: str, start: int, count: int) -> Tuple[str, int, int]:
+        """
+        Generate and insert one chunk
+        
+        Returns:
+            (kind, documents inserted, delivered orders)
+        """
+        docs = self.generate_chunk(kind, start, count)
+        self.db[self.collections[kind]].insert_many(docs, ordered=False)
+        delivered = sum(1 for doc in docs if doc.get('status') == 'livrée')
+        return kind, len(docs), delivered
+    
+    def close(self):
+        from connection import release_client
+        
+        release_client(self.client)
+
+
+# Per-process writer of the streaming generator pool
+_chunk_writer: Optional[ChunkWriter] = None
+
+
+def _init_chunk_worker(*args):
+    global _chunk_writer
+    _chunk_writer = ChunkWriter(*args)
+
+
+def _write_chunk(task: Tuple[str, int, int]) -> Tuple[str, int, int]:
+    return _chunk_writer.write_chunk(*task)
@@ -0,0 +1,408 @@
+"""
+Index management - declared index set of the delivery schema, reconciled at startup
+Covers the archiver and the platform simulator, with explain()-based slow query checks
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, GEOSPHERE
+from pymongo.errors import OperationFailure, PyMongoError
+
+from config import Config
+from logger import setup_logger
+
+
+# Collections written and read by plateforme/platform_sim_changestreams.py
+COLLECTION_DELIVERY_REQUESTS = "DeliveryRequests"
+COLLECTION_RESTAURANT_REQUESTS = "RestaurantRequests"
+
+
+@dataclass
+class IndexSpec:
+    """One declared index"""
+    collection: str
+    keys: List[Tuple[str, Any]]
+    name: str
+    unique: bool = False
+    sparse: bool = False
+    partial: Optional[Dict] = None
+    comment: str = ""
+
+    def options(self) -> Dict[str, Any]:
+        """create_index keyword arguments"""
+        options: Dict[str, Any] = {'name': self.name}
+        if self.unique:
+            options['unique'] = True
+        if self.sparse:
+            options['sparse'] = True
+        if self.partial:
+            options['partialFilterExpression'] = self.partial
+        return options
+
+    def matches(self, existing: Dict) -> bool:
+        """True if an index from list_indexes() has the same keys and options"""
+        keys = [(name, direction) for name, direction in existing['key'].items()]
+        return (
+            keys == list(self.keys)
+            and bool(existing.get('unique')) == self.unique
+            and bool(existing.get('sparse')) == self.sparse
+            and (existing.get('partialFilterExpression') or None) == self.partial
+        )
+
+
+@dataclass
+class QueryShape:
+    """A query the applications run, checked with explain()"""
+    collection: str
+    description: str
+    filter: Dict
+    sort: Optional[Dict] = None
+    limit: int = 0
+    hint: Optional[str] = None
+
+
+def declared_indexes(config: Config) -> List[IndexSpec]:
+    """
+    Full index set of the delivery schema
+
+    Args:
+        config: Configuration (collection names, Historique partitioning)
+
+    Returns:
+        Declared indexes, grouped by collection
+    """
+    specs = [
+        # Commande: platform lookups by order, archiver scans of delivered orders
+        IndexSpec(config.collection_commande, [("numero_commande", ASCENDING)],
+                  "idx_numero_commande", comment="platform find/update by order"),
+        IndexSpec(config.collection_commande,
+                  [("status", ASCENDING), ("date_commande", ASCENDING), ("_id", ASCENDING)],
+                  "idx_status_date_commande",
+                  comment="delivered orders by date, in checkpoint order"),
+        IndexSpec(config.collection_commande, [("date_commande", ASCENDING)],
+                  "idx_date_commande", comment="date range queries on every status"),
+
+        # Dimensions joined by the enrichment pipeline and the dimension cache
+        IndexSpec(config.collection_client, [("id_client", ASCENDING)], "idx_id_client"),
+        IndexSpec(config.collection_livreur, [("id_livreur", ASCENDING)], "idx_id_livreur"),
+        IndexSpec(config.collection_restaurants, [("id_restaurant", ASCENDING)], "idx_id_restaurant"),
+        IndexSpec(config.collection_menu, [("id_menu", ASCENDING)], "idx_id_menu"),
+
+        # Livreur: available couriers by city, then by distance
+        IndexSpec(config.collection_livreur, [("statut", ASCENDING), ("city", ASCENDING)],
+                  "idx_statut_city", comment="top-K candidates in the order's city"),
+        IndexSpec(config.collection_livreur, [("location", GEOSPHERE), ("statut", ASCENDING)],
+                  "idx_location_2dsphere_statut", comment="$near candidates"),
+
+        # Platform requests, answered by the restaurant and livreur simulators
+        IndexSpec(COLLECTION_DELIVERY_REQUESTS,
+                  [("numero_commande", ASCENDING), ("id_livreur", ASCENDING)],
+                  "idx_numero_commande_id_livreur"),
+        IndexSpec(COLLECTION_RESTAURANT_REQUESTS,
+                  [("numero_commande", ASCENDING), ("id_restaurant", ASCENDING)],
+                  "idx_numero_commande_id_restaurant"),
+    ]
+
+    if config.historique_partitioning == "none":
+        # Partitioned Historique indexes are managed by HistoriquePartitions
+        specs += [
+            IndexSpec(config.collection_historique, [("numero_commande", ASCENDING)],
+                      "idx_numero_commande_unique", unique=True,
+                      comment="duplicate detection"),
+            IndexSpec(config.collection_historique, [("date_archivage", ASCENDING)],
+                      "idx_date_archivage", comment="incremental export"),
+            IndexSpec(config.collection_historique, [("archive_run", ASCENDING)],
+                      "idx_archive_run", sparse=True,
+                      comment="merge run counts and stamp (only unstamped documents)"),
+        ]
+
+    return specs
+
+
+def declared_queries(config: Config) -> List[QueryShape]:
+    """Representative queries of the archiver and the platform, for check_queries"""
+    now = datetime.now()
+    return [
+        QueryShape(config.collection_commande, "delivered orders by date (batch engines)",
+                   {"status": "livrée", "date_commande": {"$gte": now - timedelta(days=30)}},
+                   sort={"date_commande": 1, "_id": 1}, limit=1000),
+        QueryShape(config.collection_commande, "order by numero_commande (platform)",
+                   {"numero_commande": "CMD-0"}, limit=1),
+        QueryShape(config.collection_historique, "archived numeros (pre-filter)",
+                   {"numero_commande": {"$in": ["CMD-0", "CMD-1"]}}),
+        QueryShape(config.collection_historique, "archived since watermark (export)",
+                   {"date_archivage": {"$gt": now - timedelta(days=1), "$lte": now}}),
+        QueryShape(config.collection_livreur, "available livreurs in a city (platform)",
+                   {"statut": "disponible", "city": "Paris"}, limit=5),
+        QueryShape(config.collection_livreur, "nearest available livreurs (platform)",
+                   {"statut": "disponible", "location": {"$near": {
+                       "$geometry": {"type": "Point", "coordinates": [2.3522, 48.8566]},
+                       "$maxDistance": 5000}}}, limit=5),
+        QueryShape(config.collection_livreur, "livreur by id",
+                   {"id_livreur": "LIV-0"}, limit=1),
+        QueryShape(COLLECTION_DELIVERY_REQUESTS, "delivery request of an order",
+                   {"numero_commande": "CMD-0", "id_livreur": "LIV-0"}, limit=1),
+        QueryShape(COLLECTION_RESTAURANT_REQUESTS, "restaurant request of an order",
+                   {"numero_commande": "CMD-0", "id_restaurant": "RES-0"}, limit=1),
+    ]
+
+
+def plan_stages(plan: Dict) -> List[str]:
+    """Stage names of a (winning) query plan, outermost first"""
+    stages = []
+    pending = [plan]
+    while pending:
+        node = pending.pop(0)
+        if not isinstance(node, dict):
+            continue
+        if 'stage' in node:
+            stages.append(node['stage'])
+        # Classic plans nest inputStage(s); SBE plans wrap them in queryPlan
+        for key in ('queryPlan', 'inputStage'):
+            if key in node:
+                pending.append(node[key])
+        pending.extend(node.get('inputStages', []))
+    return stages
+
+
+def analyze_explain(explain: Dict, slow_ms: int, max_ratio: float) -> Dict[str, Any]:
+    """
+    Summarize an explain (executionStats) and list its problems
+
+    Args:
+        explain: Output of the explain command
+        slow_ms: Execution time above which the query is reported
+        max_ratio: Max documents examined per document returned
+
+    Returns:
+        {stages, n_returned, docs_examined, keys_examined, millis, problems}
+    """
+    if 'stages' in explain and explain['stages']:
+        # Aggregations: the first stage holds the query plan
+        explain = explain['stages'][0].get('$cursor', explain)
+
+    winning = explain.get('queryPlanner', {}).get('winningPlan', {})
+    stats = explain.get('executionStats', {})
+    stages = plan_stages(winning)
+
+    summary = {
+        'stages': stages,
+        'n_returned': stats.get('nReturned', 0),
+        'docs_examined': stats.get('totalDocsExamined', 0),
+        'keys_examined': stats.get('totalKeysExamined', 0),
+        'millis': stats.get('executionTimeMillis', 0),
+        'problems': [],
+    }
+
+    problems = summary['problems']
+    if 'COLLSCAN' in stages:
+        problems.append("collection scan")
+    if 'SORT' in stages:
+        problems.append("in-memory sort")
+    examined = summary['docs_examined']
+    if examined and examined / max(summary['n_returned'], 1) > max_ratio:
+        problems.append(
+            f"{examined} documents examined for {summary['n_returned']} returned"
+        )
+    if summary['millis'] >= slow_ms:
+        problems.append(f"{summary['millis']} ms")
+    return summary
+
+
+@dataclass
+class ReconcileReport:
+    """Outcome of IndexManager.reconcile"""
+    created: List[str] = field(default_factory=list)
+    rebuilt: List[str] = field(default_factory=list)
+    drifted: List[str] = field(default_factory=list)  # left as is (rebuild not allowed)
+    unchanged: List[str] = field(default_factory=list)
+    extra: List[str] = field(default_factory=list)
+    dropped: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict)
+
+
+class IndexManager:
+    """
+    Bring the database in line with declared_indexes()
+
+    Reconciling is idempotent: matching indexes are left alone, missing
+    ones are created, and drifted indexes (declared name or keys with
+    other options) and undeclared ones are only reported. Rebuilding a
+    drifted index is opt-in (rebuild=True), and a unique index is never
+    dropped without rebuild_unique=True: until it is recreated, nothing
+    stops concurrent writers from inserting duplicates.
+    """
+
+    def __init__(self, config: Config, db, logger=None):
+        self.config = config
+        self.db = db
+        self.logger = logger or setup_logger(__name__)
+        self.specs = declared_indexes(config)
+
+    def reconcile(
+        self,
+        prune: bool = False,
+        rebuild: bool = False,
+        rebuild_unique: bool = False
+    ) -> ReconcileReport:
+        """
+        Create missing indexes and report (or rebuild) the ones that drifted
+
+        Args:
+            prune: If True, drop indexes of managed collections that are
+                not declared
+            rebuild: If True, drop and recreate drifted non-unique indexes
+            rebuild_unique: If True, rebuild drifted indexes, unique ones included
+
+        Returns:
+            ReconcileReport (collection.index names)
+        """
+        report = ReconcileReport()
+        by_collection: Dict[str, List[IndexSpec]] = {}
+        for spec in self.specs:
+            by_collection.setdefault(spec.collection, []).append(spec)
+
+        for collection_name, specs in by_collection.items():
+            collection = self.db[collection_name]
+            try:
+                existing = {index['name']: index for index in collection.list_indexes()}
+            except PyMongoError as e:
+                for spec in specs:
+                    report.failed[f"{collection_name}.{spec.name}"] = str(e)
+                continue
+
+            for spec in specs:
+                label = f"{collection_name}.{spec.name}"
+                try:
+                    self._reconcile_index(
+                        collection, spec, existing, report, label, rebuild, rebuild_unique
+                    )
+                except PyMongoError as e:
+                    # e.g. 2dsphere on documents without a GeoJSON location
+                    report.failed[label] = str(e)
+                    self.logger.warning(f"⚠️  Could not create index {label}: {e}")
+
+            declared = {spec.name for spec in specs}
+            for name in existing:
+                if name == "_id_" or name in declared:
+                    continue
+                label = f"{collection_name}.{name}"
+                if not prune:
+                    report.extra.append(label)
+                    continue
+                try:
+                    collection.drop_index(name)
+                    report.dropped.append(label)
+                except PyMongoError as e:
+                    report.failed[label] = str(e)
+
+        self.logger.info(
+            f"🗂️  Indexes: {len(report.created)} created, {len(report.rebuilt)} rebuilt, "
+            f"{len(report.drifted)} drifted, {len(report.unchanged)} unchanged, "
+            f"{len(report.failed)} failed"
+        )
+        for label in report.drifted:
+            self.logger.warning(
+                f"⚠️  Index {label} differs from its declaration "
+                "(rebuild with: indexes --rebuild, --rebuild-unique for unique indexes)"
+            )
+        for label in report.extra:
+            self.logger.info(f"ℹ️  Undeclared index {label} (drop with: indexes --prune)")
+        for label in report.dropped:
+            self.logger.info(f"🗑️  Dropped undeclared index {label}")
+        return report
+
+    def _reconcile_index(self, collection, spec: IndexSpec, existing: Dict[str, Dict],
+                         report: ReconcileReport, label: str,
+                         rebuild: bool = False, rebuild_unique: bool = False):
+        current = existing.get(spec.name)
+        if current is not None:
+            if spec.matches(current):
+                report.unchanged.append(label)
+                return
+            # Same name, other keys/options: create_index would fail
+            self._rebuild_index(collection, spec, spec.name, current, report, label,
+                                rebuild, rebuild_unique)
+            return
+
+        same_keys = [
+            name for name, index in existing.items()
+            if list(index['key'].items()) == list(spec.keys)
+        ]
+        if same_keys:
+            if spec.matches(existing[same_keys[0]]):
+                # Equivalent index under another name: the server refuses a second one
+                report.unchanged.append(f"{label} (as {same_keys[0]})")
+                existing[spec.name] = existing.pop(same_keys[0])
+                return
+            self._rebuild_index(collection, spec, same_keys[0], existing[same_keys[0]],
+                                report, label, rebuild, rebuild_unique)
+            return
+
+        collection.create_index(spec.keys, **spec.options())
+        report.created.append(label)
+
+    def _rebuild_index(self, collection, spec: IndexSpec, name: str, current: Dict,
+                       report: ReconcileReport, label: str,
+                       rebuild: bool, rebuild_unique: bool):
+        """Drop and recreate a drifted index if allowed, otherwise only report it"""
+        unique = spec.unique or bool(current.get('unique'))
+        if not (rebuild_unique or (rebuild and not unique)):
+            report.drifted.append(label)
+            return
+        collection.drop_index(name)
+        collection.create_index(spec.keys, **spec.options())
+        report.rebuilt.append(label)
+        self.logger.info(f"🔧 Rebuilt index {label}")
+
+    def explain(self, shape: QueryShape) -> Dict:
+        """Run explain (executionStats) for a query shape"""
+        command: Dict[str, Any] = {'find': shape.collection, 'filter': shape.filter}
+        if shape.sort:
+            command['sort'] = shape.sort
+        if shape.limit:
+            command['limit'] = shape.limit
+        if shape.hint:
+            command['hint'] = shape.hint
+        return self.db.command('explain', command, verbosity='executionStats')
+
+    def check_queries(
+        self,
+        shapes: Optional[List[QueryShape]] = None,
+        slow_ms: Optional[int] = None,
+        max_ratio: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Explain each query shape and report the slow or unindexed ones
+
+        Args:
+            shapes: Queries to check (default: declared_queries)
+            slow_ms: Slow threshold (default: config.slow_query_ms)
+            max_ratio: Max docs examined per doc returned
+                (default: config.slow_query_examined_ratio)
+
+        Returns:
+            One analyze_explain summary per shape, with collection,
+            description and error (if explain failed)
+        """
+        shapes = shapes if shapes is not None else declared_queries(self.config)
+        slow_ms = self.config.slow_query_ms if slow_ms is None else slow_ms
+        max_ratio = self.config.slow_query_examined_ratio if max_ratio is None else max_ratio
+
+        results = []
+        for shape in shapes:
+            entry: Dict[str, Any] = {'collection': shape.collection, 'description': shape.description}
+            try:
+                entry.update(analyze_explain(self.explain(shape), slow_ms, max_ratio))
+            except OperationFailure as e:
+                # e.g. $near without its 2dsphere index
+                entry.update({'stages': [], 'problems': [f"explain failed: {e}"]})
+            results.append(entry)
+
+            label = f"{shape.collection}: {shape.description}"
+            if entry['problems']:
+                self.logger.warning(f"🐢 {label} - {', '.join(entry['problems'])}")
+            else:
+                self.logger.info(f"✅ {label} ({' <- '.join(entry['stages'])})")
+        return results
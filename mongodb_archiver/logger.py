@@ -1,31 +1,173 @@
 """
 Logging configuration for the archiver
 """
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import queue
 import sys
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from datetime import datetime
+from typing import Dict, List, Optional
 
 
-def setup_logger(name: str, log_file: str = None, level: int = logging.INFO) -> logging.Logger:
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line (time, level, logger, message, exception)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Rendered by DroppingQueueHandler.prepare on the caller's thread
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep 1 record out of N per message template, for the sampled levels
+
+    Records are grouped by their unformatted message (record.msg), so a
+    high-frequency "%s" template is thinned out while rare messages of the
+    same level still go through (the first occurrence is always kept).
+    Counters are kept for the max_templates most recently seen templates
+    (LRU), so messages built with f-strings do not grow them without bound.
+    """
+
+    def __init__(self, rates: Dict[int, int], max_templates: int = 1000):
+        super().__init__()
+        self.rates = {level: max(1, rate) for level, rate in rates.items()}
+        self.max_templates = max(1, max_templates)
+        self.seen: "OrderedDict[tuple, int]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno, 1)
+        if rate == 1:
+            return True
+        key = (record.levelno, record.msg)
+        with self.lock:
+            count = self.seen.get(key, 0)
+            self.seen[key] = count + 1
+            self.seen.move_to_end(key)
+            if len(self.seen) > self.max_templates:
+                self.seen.popitem(last=False)
+        return count % rate == 0
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueue records with their message merged, drop them when the queue is full
+
+    Like the stdlib QueueHandler, prepare() merges msg % args on the
+    caller's thread (the arguments may be mutated before the listener gets
+    to them) and renders the exception into exc_text; the formatters
+    (timestamp, layout, JSON) run in the listener thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Copy: other handlers of the record still see the original
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            # Traceback objects keep the caller's frames alive: keep the text
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# Background listeners started by setup_logger (stopped at exit)
+_listeners: List[logging.handlers.QueueListener] = []
+
+
+def shutdown_logging():
+    """Drain the log queues and stop their listener threads"""
+    while _listeners:
+        _listeners.pop().stop()
+
+
+atexit.register(shutdown_logging)
+
+
+def parse_sampling(spec: str) -> Dict[int, int]:
+    """
+    Parse a sampling spec such as "INFO:100,DEBUG:1000"
+
+    Args:
+        spec: Comma separated LEVEL:N pairs (keep 1 record out of N)
+
+    Returns:
+        {level number: N}
+    """
+    rates = {}
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        level_name, _, rate = item.partition(':')
+        level = logging.getLevelName(level_name.strip().upper())
+        if not isinstance(level, int) or not rate.strip().isdigit():
+            raise ValueError(f"Invalid log sampling: {item}. Use LEVEL:N, e.g. INFO:100")
+        rates[level] = int(rate)
+    return rates
+
+
+def setup_logger(
+    name: str,
+    log_file: str = None,
+    level: int = logging.INFO,
+    use_queue: bool = False,
+    json_lines: bool = False,
+    sampling: Optional[Dict[int, int]] = None,
+    queue_size: int = 10000
+) -> logging.Logger:
     """
     Setup logger with console and file handlers
-    
+
     Args:
         name: Logger name
         log_file: Optional log file path
         level: Logging level
-        
+        use_queue: If True, records go through a bounded queue to a
+            background thread that formats and writes them (records are
+            dropped rather than blocking when the queue is full)
+        json_lines: If True, write one JSON object per record
+        sampling: Optional {level: N}, keep 1 record out of N per message
+            template for these levels (see parse_sampling)
+        queue_size: Max records waiting in the queue
+
     Returns:
         Configured logger
     """
     logger = logging.getLogger(name)
     logger.setLevel(level)
-    
+
     # Avoid duplicate handlers
     if logger.handlers:
         return logger
-    
+
+    handlers = []
+
     # Console handler with color-friendly format
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(level)
@@ -34,13 +176,13 @@ def setup_logger(name: str, log_file: str = None, level: int = logging.INFO) ->
         datefmt='%Y-%m-%d %H:%M:%S'
     )
     console_handler.setFormatter(console_format)
-    logger.addHandler(console_handler)
-    
+    handlers.append(console_handler)
+
     # File handler if log_file specified
     if log_file:
         log_path = Path(log_file)
         log_path.parent.mkdir(parents=True, exist_ok=True)
-        
+
         file_handler = logging.FileHandler(log_file, encoding='utf-8')
         file_handler.setLevel(logging.DEBUG)  # Always log DEBUG to file
         file_format = logging.Formatter(
@@ -48,8 +190,28 @@ def setup_logger(name: str, log_file: str = None, level: int = logging.INFO) ->
             datefmt='%Y-%m-%d %H:%M:%S'
         )
         file_handler.setFormatter(file_format)
-        logger.addHandler(file_handler)
-    
+        handlers.append(file_handler)
+
+    if json_lines:
+        for handler in handlers:
+            handler.setFormatter(JsonFormatter())
+
+    if sampling:
+        logger.addFilter(SamplingFilter(sampling))
+
+    if use_queue:
+        # The listener thread owns the real handlers
+        log_queue = queue.Queue(maxsize=queue_size)
+        listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
+        )
+        listener.start()
+        _listeners.append(listener)
+        logger.addHandler(DroppingQueueHandler(log_queue))
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+
     return logger
 
 
@@ -5,11 +5,16 @@ import argparse
 import sys
 from datetime import datetime, timedelta
 import logging
+from typing import Optional
 
 from config import Config
-from logger import setup_logger, get_log_filename
+from logger import setup_logger, get_log_filename, parse_sampling
 from archiver import OrderArchiver
+from async_archiver import AsyncOrderArchiver
 from watcher import OrderWatcher
+from supervisor import WatcherSupervisor
+from exporter import HistoriqueExporter
+from indexes import IndexManager
 
 
 def parse_date(date_str: str) -> datetime:
@@ -30,6 +35,22 @@ def parse_date(date_str: str) -> datetime:
     raise ValueError(f"Invalid date format: {date_str}. Use YYYY-MM-DD or DD/MM/YYYY")
 
 
+def create_logger(args, config: Optional[Config], name: str, prefix: str) -> logging.Logger:
+    """Setup the command logger from the CLI flags and LOG_* settings (if config)"""
+    log_level = logging.DEBUG if args.verbose else logging.INFO
+    log_file = get_log_filename(prefix) if not args.no_log else None
+    log_format = args.log_format or (config.log_format if config else 'text')
+    log_sampling = args.log_sampling or (config.log_sampling if config else '')
+    return setup_logger(
+        name,
+        log_file,
+        log_level,
+        use_queue=args.log_queue or bool(config and config.log_queue),
+        json_lines=log_format == 'json',
+        sampling=parse_sampling(log_sampling)
+    )
+
+
 def run_batch_archive(args):
     """Run batch archiving"""
     # Setup config and logger
@@ -39,9 +60,7 @@ def run_batch_archive(args):
     else:
         config = Config.from_env()
     
-    log_level = logging.DEBUG if args.verbose else logging.INFO
-    log_file = get_log_filename('batch') if not args.no_log else None
-    logger = setup_logger('batch_archiver', log_file, log_level)
+    logger = create_logger(args, config, 'batch_archiver', 'batch')
     
     # Parse date filters
     date_from = parse_date(args.date_from) if args.date_from else None
@@ -57,14 +76,43 @@ def run_batch_archive(args):
         config.batch_size = args.batch_size
         logger.info(f"📦 Batch size: {args.batch_size}")
     
+    if args.cursor_batch_size:
+        config.cursor_batch_size = args.cursor_batch_size
+    
+    if args.workers:
+        config.writer_workers = args.workers
+    
+    if args.queue_depth:
+        config.queue_depth = args.queue_depth
+    
+    if args.no_prefilter:
+        config.prefilter_archived = False
+    
+    if args.purge_batch_size:
+        config.purge_batch_size = args.purge_batch_size
+    
+    if args.purge_rate is not None:
+        config.purge_max_per_second = args.purge_rate
+    
+    if args.concurrency:
+        config.async_concurrency = args.concurrency
+    
+    if args.metrics_port is not None:
+        config.metrics_port = args.metrics_port
+    
     # Create archiver
-    archiver = OrderArchiver(config, logger)
+    if args.use_async:
+        archiver = AsyncOrderArchiver(config, logger)
+    else:
+        archiver = OrderArchiver(config, logger)
     
     # Connect to database
     if not archiver.connect():
         logger.error("❌ Failed to connect to database")
         sys.exit(1)
     
+    archiver.start_metrics_server()
+    
     # Ensure indexes
     archiver.ensure_indexes()
     
@@ -72,7 +120,10 @@ def run_batch_archive(args):
     stats = archiver.archive_all(
         dry_run=args.dry_run,
         date_from=date_from,
-        date_to=date_to
+        date_to=date_to,
+        engine=args.engine,
+        resume=not args.no_resume,
+        purge=args.purge
     )
     
     # Print summary
@@ -90,8 +141,91 @@ def run_batch_archive(args):
         sys.exit(1)
 
 
+def run_export(args):
+    """Run columnar export of Historique"""
+    # Setup config and logger
+    if args.simulation:
+        config = Config.for_simulation()
+        print("🧪 Running in SIMULATION mode (local database)")
+    else:
+        config = Config.from_env()
+    
+    logger = create_logger(args, config, 'exporter', 'export')
+    
+    if args.output:
+        config.export_dir = args.output
+    if args.batch_size:
+        config.export_batch_size = args.batch_size
+    if args.compression:
+        config.export_compression = args.compression
+    
+    archiver = OrderArchiver(config, logger)
+    if not archiver.connect():
+        logger.error("❌ Failed to connect to database")
+        sys.exit(1)
+    
+    exporter = HistoriqueExporter(config, archiver, logger)
+    exporter.export(full=args.full, fmt=args.format)
+    print(exporter.get_stats_summary())
+    
+    archiver.close()
+
+
+def run_indexes(args):
+    """Reconcile the declared indexes, optionally check queries with explain()"""
+    # Setup config and logger
+    if args.simulation:
+        config = Config.for_simulation()
+        print("🧪 Running in SIMULATION mode (local database)")
+    else:
+        config = Config.from_env()
+    
+    logger = create_logger(args, config, 'indexes', 'indexes')
+    
+    archiver = OrderArchiver(config, logger)
+    if not archiver.connect():
+        logger.error("❌ Failed to connect to database")
+        sys.exit(1)
+    
+    if archiver.partitions.enabled:
+        archiver.partitions.ensure_indexes()
+    
+    manager = IndexManager(config, archiver.db, logger)
+    report = manager.reconcile(
+        prune=args.prune or config.index_prune,
+        rebuild=args.rebuild or config.index_rebuild,
+        rebuild_unique=args.rebuild_unique or config.index_rebuild_unique
+    )
+    
+    slow = []
+    if args.check:
+        if args.slow_ms is not None:
+            config.slow_query_ms = args.slow_ms
+        slow = [result for result in manager.check_queries() if result['problems']]
+        print(f"🐢 {len(slow)} slow or unindexed queries")
+    
+    archiver.close()
+    
+    if report.failed or slow:
+        sys.exit(1)
+
+
+def run_supervisor(args):
+    """Spawn one watcher per partition and restart crashed ones"""
+    logger = create_logger(args, None, 'supervisor', 'supervisor')
+    
+    # Workers get the same command line plus their --partition-id
+    worker_args = sys.argv[1:]
+    supervisor = WatcherSupervisor(args.partitions, worker_args, logger)
+    supervisor.run()
+
+
 def run_watch_mode(args):
     """Run watch mode with Change Streams"""
+    if args.partitions > 1 and args.partition_id is None:
+        run_supervisor(args)
+        return
+    
     # Setup config and logger
     if args.simulation:
         config = Config.for_simulation()
@@ -99,9 +233,26 @@ def run_watch_mode(args):
     else:
         config = Config.from_env()
     
-    log_level = logging.DEBUG if args.verbose else logging.INFO
-    log_file = get_log_filename('watcher') if not args.no_log else None
-    logger = setup_logger('watcher', log_file, log_level)
+    # Partition owned by this watcher
+    config.watch_partitions = args.partitions
+    config.watch_partition_id = args.partition_id or 0
+    
+    log_prefix = 'watcher'
+    if args.partitions > 1:
+        log_prefix = f'watcher_p{config.watch_partition_id}'
+    logger = create_logger(args, config, 'watcher', log_prefix)
+    
+    # Micro-batching flush policy
+    if args.flush_size:
+        config.watch_batch_size = args.flush_size
+    if args.flush_ms:
+        config.watch_flush_interval_ms = args.flush_ms
+    if args.token_store:
+        config.watch_token_store = args.token_store
+    if args.stream_mode:
+        config.watch_stream_mode = args.stream_mode
+    if args.metrics_port is not None:
+        config.metrics_port = args.metrics_port
     
     # Create watcher
     watcher = OrderWatcher(config, logger)
@@ -129,12 +280,60 @@ Examples:
   # Archive orders from specific date range
   python main.py batch --run --date-from 2025-01-01 --date-to 2025-01-31
   
+  # Legacy engine: one enrichment aggregation per order
+  python main.py batch --run --engine lookup
+  
+  # Server-side catch-up: documents never leave MongoDB ($merge)
+  python main.py batch --run --engine merge
+  
+  # Overlap reads and writes with 8 insert threads
+  python main.py batch --run --engine pipelined --workers 8
+  
+  # 128 concurrent enrichment aggregations on the asyncio driver
+  python main.py batch --run --async --concurrency 128
+  
+  # Enrich in Python from cached Client/Livreur/Restaurants/Menu documents
+  python main.py batch --run --engine cached
+  
+  # Restart from scratch instead of the last batch checkpoint
+  python main.py batch --run --no-resume
+  
+  # Then delete archived orders from Commande, at most 200 per second
+  python main.py batch --run --purge --purge-rate 200
+  
   # Export sample of archived orders
   python main.py batch --run --export-sample samples.json
   
+  # Export orders archived since the last export to zstd Parquet files
+  python main.py export --output exports/
+  
+  # Re-export all of Historique as Arrow IPC files
+  python main.py export --full --format arrow
+  
   # Watch for changes in real-time
   python main.py watch
   
+  # Watch with micro-batches of up to 500 events or 100 ms
+  python main.py watch --flush-size 500 --flush-ms 100
+  
+  # Split the stream between 4 supervised watcher processes
+  python main.py watch --partitions 4
+  
+  # Run only partition 2 of 4 (e.g. on another host)
+  python main.py watch --partitions 4 --partition-id 2
+  
+  # Keep the resume token in MongoDB (_watcher_state) instead of a file
+  python main.py watch --token-store mongodb
+  
+  # Under heavy load: background log thread, JSON lines, 1 in 100 INFO lines per message
+  python main.py --log-queue --log-format json --log-sampling INFO:100 watch
+  
+  # Live counters and latency histograms for Prometheus
+  python main.py --metrics-port 9108 watch
+  
+  # Projected change events, no full document lookup per update
+  python main.py watch --stream-mode lean
+  
   # Watch in simple mode (no resume token)
   python main.py watch --simple
   
@@ -145,6 +344,37 @@ Environment Variables:
   MONGODB_URI       MongoDB connection string (required in production)
   MONGODB_DATABASE  Database name (default: Ubereats)
   BATCH_SIZE        Batch size for archiving (default: 100)
+  CURSOR_BATCH_SIZE Cursor batch size for the bulk engine (default: 1000)
+  WRITER_WORKERS    Insert threads for the pipelined engine (default: 4)
+  QUEUE_DEPTH       Batches buffered for the pipelined engine (default: 8)
+  ASYNC_CONCURRENCY Enrichment aggregations in flight with --async (default: 64)
+  PREFILTER_ARCHIVED Skip already archived orders before enrichment (default: true)
+  HISTORIQUE_PARTITIONING Historique per period: none, monthly, yearly (default: none)
+  PURGE_AFTER_ARCHIVE Delete archived orders from Commande after batch (default: false)
+  PURGE_BATCH_SIZE / PURGE_MAX_PER_SECOND
+                    Purge batch size and rate limit (default: 500 / 0 = unlimited)
+  EXPORT_DIR / EXPORT_BATCH_SIZE / EXPORT_COMPRESSION
+                    Export directory, documents per record batch and codec
+                    (default: exports / 10000 / zstd)
+  EXPORT_SAFETY_LAG Seconds of recent archives left for the next export (default: 300)
+  WATCH_BATCH_SIZE  Watcher micro-batch size (default: 100)
+  WATCH_FLUSH_MS    Watcher micro-batch max age in ms (default: 200)
+  WATCH_TOKEN_STORE Resume token backend: file or mongodb (default: file)
+  WATCH_STREAM_MODE Change events: full (updateLookup) or lean (default: full)
+  WATCH_PARTITION_FIELD Precomputed integer shard key for --partitions
+                    (default: hash of numero_commande, MongoDB 7.0+)
+  WATCH_TOKEN_FLUSH_EVERY / WATCH_TOKEN_FLUSH_MS
+                    Save the resume token every N commits or T ms (default: 100 / 1000)
+  DIMENSION_CACHE_SIZE / DIMENSION_CACHE_TTL / DIMENSION_CACHE_PRELOAD / DIMENSION_CACHE_WATCH
+                    Dimension cache settings for the cached engine
+  LOG_QUEUE / LOG_FORMAT / LOG_SAMPLING
+                    Background log thread, text or json, per-level sampling
+                    (default: false / text / none)
+  METRICS_PORT / METRICS_HOST
+                    Live metrics endpoint (default: 0 = disabled / 127.0.0.1)
+  INDEX_PRUNE       Drop undeclared indexes when reconciling (default: false)
+  SLOW_QUERY_MS / SLOW_QUERY_EXAMINED_RATIO
+                    Thresholds of indexes --check (default: 100 / 10)
   MAX_RETRIES       Max retries on error (default: 3)
         """
     )
@@ -156,6 +386,15 @@ Environment Variables:
                        help='Disable file logging (stdout only)')
     parser.add_argument('--simulation', action='store_true',
                        help='Use local MongoDB for testing')
+    parser.add_argument('--log-queue', action='store_true',
+                       help='Format and write log records in a background thread (default: LOG_QUEUE)')
+    parser.add_argument('--log-format', choices=['text', 'json'],
+                       help='Log line format, json: one object per line (default: LOG_FORMAT)')
+    parser.add_argument('--log-sampling', type=str,
+                       help='Keep 1 record out of N per message, e.g. INFO:100 (default: LOG_SAMPLING)')
+    parser.add_argument('--metrics-port', type=int,
+                       help='Serve live metrics on http://127.0.0.1:PORT/metrics '
+                            '(partitioned watchers: PORT + partition id; default: METRICS_PORT)')
     
     # Subcommands
     subparsers = parser.add_subparsers(dest='command', help='Command to run')
@@ -172,11 +411,70 @@ Environment Variables:
                              help='End date filter (YYYY-MM-DD or DD/MM/YYYY)')
     batch_parser.add_argument('--batch-size', type=int,
                              help='Number of orders to process in each batch')
+    batch_parser.add_argument('--engine', choices=OrderArchiver.ENGINES, default='bulk',
+                             help='Enrichment engine: bulk (single streamed aggregation), '
+                                  'lookup (one aggregation per order), merge '
+                                  '(server-side $merge into Historique), pipelined '
+                                  '(streamed aggregation feeding writer threads) or cached '
+                                  '(enrichment in Python from a dimension cache) (default: bulk)')
+    batch_parser.add_argument('--async', dest='use_async', action='store_true',
+                             help='Concurrent per-order enrichment on the asyncio driver '
+                                  '(replaces --engine)')
+    batch_parser.add_argument('--concurrency', type=int,
+                             help='Enrichment aggregations in flight with --async '
+                                  '(default: ASYNC_CONCURRENCY)')
+    batch_parser.add_argument('--cursor-batch-size', type=int,
+                             help='Documents fetched per cursor round trip (bulk engine)')
+    batch_parser.add_argument('--workers', type=int,
+                             help='Insert threads for the pipelined engine')
+    batch_parser.add_argument('--queue-depth', type=int,
+                             help='Batches buffered between reader and writers (pipelined engine)')
+    batch_parser.add_argument('--no-resume', action='store_true',
+                             help='Ignore and clear the saved batch checkpoint (bulk engine)')
+    batch_parser.add_argument('--no-prefilter', action='store_true',
+                             help='Enrich already archived orders too (rely on duplicate-key errors)')
+    batch_parser.add_argument('--purge', action='store_true',
+                             help='Delete orders verified in Historique from Commande after archiving')
+    batch_parser.add_argument('--purge-batch-size', type=int,
+                             help='Orders per delete_many when purging (default: PURGE_BATCH_SIZE)')
+    batch_parser.add_argument('--purge-rate', type=float,
+                             help='Max deletions per second when purging, 0 = unlimited '
+                                  '(default: PURGE_MAX_PER_SECOND)')
     batch_parser.add_argument('--export-sample', type=str,
                              help='Export sample archived orders to JSON file')
     batch_parser.add_argument('--sample-count', type=int, default=5,
                              help='Number of samples to export (default: 5)')
     
+    # Export command
+    export_parser = subparsers.add_parser('export',
+                                          help='Export Historique to compressed Parquet/Arrow files')
+    export_parser.add_argument('--output', type=str,
+                              help='Output directory (default: EXPORT_DIR)')
+    export_parser.add_argument('--full', action='store_true',
+                              help='Export everything, not only orders archived since the last export')
+    export_parser.add_argument('--format', choices=HistoriqueExporter.FORMATS, default='parquet',
+                              help='parquet (analytics) or arrow (IPC file) (default: parquet)')
+    export_parser.add_argument('--compression', choices=['zstd', 'lz4', 'snappy', 'none'],
+                              help='Compression codec (default: EXPORT_COMPRESSION; '
+                                   'snappy is Parquet only)')
+    export_parser.add_argument('--batch-size', type=int,
+                              help='Documents per record batch (default: EXPORT_BATCH_SIZE)')
+    
+    # Indexes command
+    indexes_parser = subparsers.add_parser('indexes',
+                                           help='Create/rebuild the declared indexes, check queries')
+    indexes_parser.add_argument('--check', action='store_true',
+                               help='Explain the application queries and report slow or unindexed ones')
+    indexes_parser.add_argument('--prune', action='store_true',
+                               help='Drop indexes that are not declared (default: INDEX_PRUNE)')
+    indexes_parser.add_argument('--rebuild', action='store_true',
+                               help='Drop and recreate drifted non-unique indexes (default: INDEX_REBUILD)')
+    indexes_parser.add_argument('--rebuild-unique', action='store_true',
+                               help='Also rebuild drifted unique indexes: no duplicate protection '
+                                    'until recreated (default: INDEX_REBUILD_UNIQUE)')
+    indexes_parser.add_argument('--slow-ms', type=int,
+                               help='Execution time reported as slow (default: SLOW_QUERY_MS)')
+    
     # Watch command
     watch_parser = subparsers.add_parser('watch', 
                                          help='Watch for changes in real-time')
@@ -184,6 +482,23 @@ Environment Variables:
                              help='Simple watch mode without resume token')
     watch_parser.add_argument('--no-resume', action='store_true',
                              help='Do not resume from saved position')
+    watch_parser.add_argument('--flush-size', type=int,
+                             help='Archive after N buffered events (default: WATCH_BATCH_SIZE)')
+    watch_parser.add_argument('--flush-ms', type=int,
+                             help='Archive when the oldest buffered event is T ms old '
+                                  '(default: WATCH_FLUSH_MS)')
+    watch_parser.add_argument('--token-store', choices=['file', 'mongodb'],
+                             help='Where to persist the resume token '
+                                  '(mongodb: _watcher_state collection, for multi-host setups)')
+    watch_parser.add_argument('--stream-mode', choices=['full', 'lean'],
+                             help='full: fullDocument lookup on every update; lean: projected '
+                                  'events, orders fetched by _id in the micro-batch '
+                                  '(default: WATCH_STREAM_MODE)')
+    watch_parser.add_argument('--partitions', type=int, default=1,
+                             help='Split the stream between N watchers '
+                                  '(without --partition-id: spawn and supervise all of them)')
+    watch_parser.add_argument('--partition-id', type=int,
+                             help='Partition owned by this watcher (0..N-1)')
     
     # Parse arguments
     args = parser.parse_args()
@@ -192,6 +507,15 @@ Environment Variables:
         parser.print_help()
         sys.exit(1)
     
+    # Validate watch partitions
+    if args.command == 'watch':
+        if args.partitions < 1:
+            print("❌ Error: --partitions must be at least 1")
+            sys.exit(1)
+        if args.partition_id is not None and not 0 <= args.partition_id < args.partitions:
+            print("❌ Error: --partition-id must be between 0 and --partitions - 1")
+            sys.exit(1)
+    
     # Validate batch command
     if args.command == 'batch':
         if not args.run and not args.dry_run:
@@ -201,6 +525,10 @@ Environment Variables:
     try:
         if args.command == 'batch':
             run_batch_archive(args)
+        elif args.command == 'export':
+            run_export(args)
+        elif args.command == 'indexes':
+            run_indexes(args)
         elif args.command == 'watch':
             run_watch_mode(args)
     
@@ -0,0 +1,208 @@
+"""
+Live metrics - counters, gauges and histograms in the Prometheus text format
+Served over a local HTTP endpoint (METRICS_PORT) by the archiver and the watcher
+"""
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence
+import threading
+import time
+
+from logger import setup_logger
+
+
+# Latency buckets in seconds (1 ms to 10 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Gauge:
+    """Value that goes up and down, or read from a function at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self._value = value
+
+    def set_function(self, function: Optional[Callable[[], float]]):
+        """Read the value from function on every scrape (None: back to set())"""
+        self._function = function
+
+    @property
+    def value(self) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {self.value}"]
+
+
+class Histogram:
+    """Distribution of observed values (cumulative buckets, sum and count)"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot: +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self) -> "_Timer":
+        """Context manager observing the duration of its block"""
+        return _Timer(self)
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class StatsCounters:
+    """Counters read from a stats dictionary (e.g. OrderArchiver.stats)"""
+
+    def __init__(self, prefix: str, stats: Dict[str, int]):
+        self.prefix = prefix
+        self.stats = stats
+
+    def families(self) -> List[tuple]:
+        return [
+            (f"{self.prefix}_{key}_total", f"Total {key} since the process started",
+             [f"{self.prefix}_{key}_total {value}"])
+            for key, value in list(self.stats.items())
+        ]
+
+
+class MetricsRegistry:
+    """Named metrics of one process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._stats: List[StatsCounters] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric):
+                    raise ValueError(f"Metric {metric.name} already registered as a {existing.kind}")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def register_stats(self, prefix: str, stats: Dict[str, int]):
+        """Expose every key of stats as a <prefix>_<key>_total counter"""
+        self._stats.append(StatsCounters(prefix, stats))
+
+    def render(self) -> str:
+        families = []
+        for counters in self._stats:
+            families.extend((name, doc, "counter", lines) for name, doc, lines in counters.families())
+        with self._lock:
+            metrics = list(self._metrics.values())
+        families.extend((m.name, m.documentation, m.kind, m.samples()) for m in metrics)
+
+        output = []
+        for name, documentation, kind, lines in families:
+            output.append(f"# HELP {name} {documentation}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(lines)
+        return "\n".join(output) + "\n"
+
+
+class MetricsServer:
+    """Serve a registry on http://<host>:<port>/metrics from a daemon thread"""
+
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = "127.0.0.1", logger=None):
+        self.registry = registry
+        self.port = port
+        self.host = host
+        self.logger = logger or setup_logger(__name__)
+        self.httpd: Optional[ThreadingHTTPServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # scrapes would flood the logs
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, name="metrics-server", daemon=True
+        )
+        self.thread.start()
+        self.logger.info(f"📈 Metrics on http://{self.host}:{self.port}/metrics")
+
+    def close(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
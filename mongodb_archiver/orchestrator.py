@@ -0,0 +1,526 @@
+"""
+Asyncio platform orchestrator - every order is an explicit state machine
+Driven by change events (new orders, restaurant/livreur responses, cancellations) and timers
+"""
+from datetime import datetime, timezone
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from logger import setup_logger
+from metrics import MetricsRegistry
+from reservations import AsyncLivreurReservations
+from assignment import (
+    send_delivery_requests_async, assign_livreur_async, CANCELLED_STATUSES,
+    ASSIGNED as ASSIGNMENT_DONE, LIVREUR_TAKEN
+)
+
+
+# Order states
+NEW = "new"
+RESTAURANT_PENDING = "restaurant_pending"  # request sent, waiting for the restaurant
+DELIVERY_PENDING = "delivery_pending"  # accepted, requests sent to candidate livreurs
+ASSIGNED = "assigned"
+REJECTED_BY_RESTAURANT = "rejected_by_restaurant"
+WAITING_FOR_LIVREUR = "waiting_for_livreur"
+CANCELLED = "cancelled"
+FAILED = "failed"  # a transition raised, the order is left as is
+
+TERMINAL_STATES = (ASSIGNED, REJECTED_BY_RESTAURANT, WAITING_FOR_LIVREUR, CANCELLED, FAILED)
+
+# Events
+START = "start"
+RESTAURANT_RESPONSE = "restaurant_response"
+DELIVERY_RESPONSE = "delivery_response"
+CANCEL_REQUESTED = "cancel_requested"
+TIMEOUT = "timeout"
+
+
+def extract_order_price(doc: Optional[Dict]) -> float:
+    """Price of an order-like document (first known price field), 0.0 if none"""
+    if not doc:
+        return 0.0
+    for key in ('prix_total', 'coût_commande', 'coût_total', 'coût', 'price', 'cout_total'):
+        if doc.get(key) is not None:
+            try:
+                return float(doc[key])
+            except (TypeError, ValueError):
+                continue
+    return 0.0
+
+
+class OrderFlow:
+    """State of one order; transitions are serialized by its lock"""
+
+    __slots__ = (
+        'numero', 'order', 'state', 'lock', 'timer', 'generation',
+        'candidates', 'rejected', 'delivery_request_ts', 'started_at', 'reserved',
+    )
+
+    def __init__(self, order: Dict):
+        self.numero = order['numero_commande']
+        self.order = order
+        self.state = NEW
+        self.lock = asyncio.Lock()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.generation = 0  # bumped on each timer, stale timeouts are ignored
+        self.candidates: List = []
+        self.rejected: set = set()
+        self.delivery_request_ts: Optional[datetime] = None
+        self.started_at = datetime.now(timezone.utc)
+        self.reserved = False  # livreurs held for this order (released when it ends)
+
+    @property
+    def rest_id(self):
+        return self.order.get('id_restaurant')
+
+
+class AsyncOrchestrator:
+    """
+    Run the platform flow of every new order in one event loop
+
+    One change stream per source feeds events to the order flows:
+    Commande inserts (pending_request) start a flow, Commande updates to
+    cancel_requested, RestaurantRequests and DeliveryRequests responses
+    are dispatched to the flow of their numero_commande. Response
+    deadlines are loop timers, so a waiting order costs an OrderFlow
+    object rather than a thread or a cursor.
+    """
+
+    def __init__(
+        self,
+        db,
+        logger=None,
+        registry: Optional[MetricsRegistry] = None,
+        max_active: int = 10000,
+        restaurant_timeout: float = 60,
+        delivery_timeout: float = 30,
+        candidates_k: int = 5,
+        max_distance_m: int = 2000,
+        lease_seconds: float = 45
+    ):
+        self.db = db
+        self.logger = logger or setup_logger(__name__)
+        self.flows: Dict[str, OrderFlow] = {}
+        self.max_active = max(1, max_active)
+        self.restaurant_timeout = restaurant_timeout
+        self.delivery_timeout = delivery_timeout
+        self.candidates_k = candidates_k
+        self.max_distance_m = max_distance_m
+        # Leases outlive delivery_timeout, the flow releases them when it ends
+        self.reservations = AsyncLivreurReservations(db, max(lease_seconds, delivery_timeout))
+        self.admission = asyncio.Semaphore(self.max_active)
+        self.tasks: set = set()
+        self.resume_tokens: Dict[str, Any] = {}
+
+        self.stats = {
+            'started': 0,
+            'assigned': 0,
+            'rejected_by_restaurant': 0,
+            'waiting_for_livreur': 0,
+            'cancelled': 0,
+            'errors': 0,
+            'leases_expired': 0,
+        }
+        self.metrics = registry or MetricsRegistry()
+        self.metrics.register_stats('platform_async_orders', self.stats)
+        self.metrics.gauge(
+            'platform_async_orders_active', 'Orders with a running state machine'
+        ).set_function(lambda: len(self.flows))
+        self.assignment_latency = self.metrics.histogram(
+            'platform_async_assignment_seconds', 'From order detection to livreur assignment',
+            (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+        )
+
+    # ------------------------------------------------------------------
+    # Event sources
+    # ------------------------------------------------------------------
+
+    async def run(self):
+        """Watch every source until cancelled"""
+        response_stream = [{'$match': {
+            'operationType': 'update',
+            'fullDocument.status': {'$in': ['accepted', 'rejected']}
+        }}]
+        sources = [
+            (self.db.Commande, 'cancellations', [{'$match': {
+                'operationType': 'update',
+                'updateDescription.updatedFields.status': 'cancel_requested'
+            }}], self.on_cancel_requested),
+            (self.db.RestaurantRequests, 'restaurant_responses', response_stream,
+             partial(self.on_response, RESTAURANT_RESPONSE)),
+            (self.db.DeliveryRequests, 'delivery_responses', response_stream,
+             partial(self.on_response, DELIVERY_RESPONSE)),
+        ]
+        opened = [asyncio.Event() for _ in sources]
+        watchers = [
+            asyncio.create_task(self.watch(collection, name, pipeline, handler, opened=event))
+            for (collection, name, pipeline, handler), event in zip(sources, opened)
+        ]
+        try:
+            # Responses written before their stream is open would be missed
+            await asyncio.gather(*(event.wait() for event in opened))
+            watchers.append(asyncio.create_task(self.release_expired_leases()))
+            self.logger.info("🔄 Écoute des nouvelles commandes via Change Streams...")
+            watchers.append(asyncio.create_task(self.watch(
+                self.db.Commande, 'orders', [{'$match': {
+                    'operationType': 'insert', 'fullDocument.status': 'pending_request'
+                }}], self.on_new_order, full_document=None
+            )))
+            await asyncio.gather(*watchers)
+        finally:
+            for flow in self.flows.values():
+                if flow.timer:
+                    flow.timer.cancel()
+            for task in watchers + list(self.tasks):
+                task.cancel()
+
+    async def watch(
+        self,
+        collection,
+        name: str,
+        pipeline: List[Dict],
+        handler: Callable,
+        full_document: Optional[str] = 'updateLookup',
+        opened: Optional[asyncio.Event] = None
+    ):
+        """Feed the documents of a change stream to handler, resuming on errors"""
+        while True:
+            try:
+                options = {'resume_after': self.resume_tokens.get(name)}
+                if full_document:
+                    options['full_document'] = full_document
+                async with await collection.watch(pipeline, **options) as stream:
+                    if opened:
+                        opened.set()
+                    async for change in stream:
+                        self.resume_tokens[name] = stream.resume_token
+                        doc = change.get('fullDocument')
+                        if doc:
+                            await handler(doc)
+            except PyMongoError as e:
+                if isinstance(e, OperationFailure) and e.code == 286:
+                    # ChangeStreamHistoryLost: the token left the oplog
+                    self.resume_tokens.pop(name, None)
+                self.logger.warning(f"⚠️  Change stream {name}: {e}, reconnexion...")
+                await asyncio.sleep(1)
+
+    async def release_expired_leases(self):
+        """Make livreurs held by orders that never ended (crash) available again"""
+        interval = self.reservations.lease.total_seconds() / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.stats['leases_expired'] += await self.reservations.release_expired()
+            except PyMongoError as e:
+                self.logger.warning(f"⚠️  Libération des réservations expirées: {e}")
+
+    def spawn(self, coroutine):
+        """Run a transition in the background (the stream keeps being read)"""
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def on_new_order(self, order: Dict):
+        numero = order.get('numero_commande')
+        if not numero or numero in self.flows:
+            return
+        # Backpressure: stop reading new orders while max_active are running
+        await self.admission.acquire()
+        self.flows[numero] = OrderFlow(order)
+        self.stats['started'] += 1
+        self.spawn(self.dispatch(numero, START))
+
+    async def on_response(self, event: str, doc: Dict):
+        # Responses of orders not orchestrated here (or finished) are ignored
+        numero = doc.get('numero_commande')
+        if numero in self.flows:
+            self.spawn(self.dispatch(numero, event, doc))
+
+    async def on_cancel_requested(self, doc: Dict):
+        numero = doc.get('numero_commande')
+        self.logger.info(f"🔔 Annulation demandée pour {numero}")
+        if numero in self.flows:
+            self.spawn(self.dispatch(numero, CANCEL_REQUESTED, doc))
+        else:
+            # Not (or no longer) orchestrated here: cancel right away
+            self.spawn(self.cancel_immediate(numero))
+
+    # ------------------------------------------------------------------
+    # State machine
+    # ------------------------------------------------------------------
+
+    async def dispatch(self, numero: str, event: str, payload: Any = None) -> bool:
+        """
+        Deliver an event to the flow of an order
+
+        Args:
+            numero: numero_commande
+            event: START, RESTAURANT_RESPONSE, DELIVERY_RESPONSE,
+                CANCEL_REQUESTED or TIMEOUT
+            payload: Request document, or timer generation for TIMEOUT
+
+        Returns:
+            True if the order has a flow (the event may still be ignored)
+        """
+        flow = self.flows.get(numero)
+        if flow is None:
+            return False
+        async with flow.lock:
+            if flow.state in TERMINAL_STATES:
+                return True
+            try:
+                await self.transition(flow, event, payload)
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.logger.error(f"❌ Commande {numero} ({flow.state}, {event}): {e}")
+                self.finish(flow, FAILED, count=False)
+            if flow.reserved and flow.state in TERMINAL_STATES:
+                await self.release_livreurs(flow)
+        return True
+
+    async def transition(self, flow: OrderFlow, event: str, payload: Any):
+        if event == TIMEOUT and payload != flow.generation:
+            return  # timer of an earlier state
+
+        if event == CANCEL_REQUESTED:
+            if flow.state == DELIVERY_PENDING:
+                await self.cancel_after_preparation(flow)
+            else:
+                await self.cancel_immediate(flow.numero)
+            self.finish(flow, CANCELLED)
+            return
+
+        if flow.state == NEW and event == START:
+            await self.request_restaurant(flow)
+
+        elif flow.state == RESTAURANT_PENDING:
+            if event == TIMEOUT:
+                await self.reject_by_restaurant(flow)
+            elif event == RESTAURANT_RESPONSE and payload.get('id_restaurant') == flow.rest_id:
+                if payload.get('status') == 'accepted':
+                    self.logger.info(f"🍽️  Commande {flow.numero} acceptée par le restaurant {flow.rest_id}")
+                    await self.request_livreurs(flow)
+                else:
+                    await self.reject_by_restaurant(flow)
+
+        elif flow.state == DELIVERY_PENDING:
+            if event == TIMEOUT:
+                await self.no_livreur(flow, "aucune réponse")
+            elif event == DELIVERY_RESPONSE and payload.get('id_livreur') in flow.candidates:
+                if payload.get('status') == 'accepted':
+                    await self.assign(flow, payload.get('id_livreur'))
+                else:
+                    flow.rejected.add(payload.get('id_livreur'))
+                    if flow.rejected >= set(flow.candidates):
+                        await self.no_livreur(flow, "tous les livreurs ont refusé")
+
+    def set_timer(self, flow: OrderFlow, delay: float):
+        if flow.timer:
+            flow.timer.cancel()
+        flow.generation += 1
+        generation = flow.generation
+        flow.timer = asyncio.get_running_loop().call_later(
+            delay, lambda: self.spawn(self.dispatch(flow.numero, TIMEOUT, generation))
+        )
+
+    def finish(self, flow: OrderFlow, state: str, count: bool = True):
+        """Enter a terminal state and free the order's admission slot"""
+        flow.state = state
+        if flow.timer:
+            flow.timer.cancel()
+            flow.timer = None
+        if count:
+            self.stats[state] += 1
+        if self.flows.pop(flow.numero, None) is not None:
+            self.admission.release()
+
+    # ------------------------------------------------------------------
+    # Actions
+    # ------------------------------------------------------------------
+
+    async def release_livreurs(self, flow: OrderFlow):
+        """Give back the livreurs still reserved by an ended order"""
+        try:
+            await self.reservations.release(flow.numero)
+            flow.reserved = False
+        except PyMongoError as e:
+            # Left to the lease expiry
+            self.logger.warning(f"⚠️  Commande {flow.numero}: réservations non libérées ({e})")
+
+    async def request_restaurant(self, flow: OrderFlow):
+        current = await self.db.Commande.find_one({'numero_commande': flow.numero})
+        if current and current.get('status') == 'cancel_requested':
+            await self.cancel_immediate(flow.numero)
+            self.finish(flow, CANCELLED)
+            return
+
+        await self.db.RestaurantRequests.insert_one({
+            'numero_commande': flow.numero,
+            'id_restaurant': flow.rest_id,
+            'status': 'requested',
+            'requested_at': datetime.now(timezone.utc)
+        })
+        flow.state = RESTAURANT_PENDING
+        self.set_timer(flow, self.restaurant_timeout)
+        self.logger.info(f"📤 Commande {flow.numero}: requête envoyée au restaurant {flow.rest_id}")
+
+    async def reject_by_restaurant(self, flow: OrderFlow):
+        await self.db.Commande.update_one(
+            {'numero_commande': flow.numero, 'status': {'$nin': CANCELLED_STATUSES}},
+            {'$set': {'status': 'rejected_by_restaurant'}}
+        )
+        self.logger.info(f"❌ Commande {flow.numero}: refus / pas de réponse du restaurant")
+        self.finish(flow, REJECTED_BY_RESTAURANT)
+
+    async def select_candidates(self, order: Dict) -> List[Dict]:
+        """Up to candidates_k available livreurs: same city, then nearest, then any"""
+        snapshot = order.get('client_snapshot') or {}
+        city = snapshot.get('city') or order.get('adresse_livraison_city')
+        coords = snapshot.get('coords') or order.get('coords')
+        k = self.candidates_k
+        livreurs = self.db.Livreur
+        try:
+            if city:
+                candidates = await livreurs.find({'statut': 'disponible', 'city': city}).limit(k).to_list()
+                if len(candidates) >= k:
+                    return candidates
+            if isinstance(coords, (list, tuple)) and len(coords) == 2:
+                candidates = await livreurs.find({
+                    'statut': 'disponible',
+                    'location': {'$near': {
+                        '$geometry': {'type': 'Point', 'coordinates': list(coords)},
+                        '$maxDistance': self.max_distance_m
+                    }}
+                }).limit(k).to_list()
+                if candidates:
+                    return candidates
+        except PyMongoError:
+            pass
+        return await livreurs.find({'statut': 'disponible'}).limit(k).to_list()
+
+    async def request_livreurs(self, flow: OrderFlow):
+        candidates = await self.select_candidates(flow.order)
+        if not candidates:
+            await self.no_livreur(flow, "aucun livreur disponible")
+            return
+
+        # Hold the candidates: a livreur is only offered to one order at a time
+        flow.reserved = True
+        livreur_ids = await self.reservations.reserve_candidates(
+            flow.numero, [livreur['id_livreur'] for livreur in candidates]
+        )
+        if not livreur_ids:
+            await self.no_livreur(flow, "livreurs déjà réservés")
+            return
+
+        # Kept in memory for the assignment delay, written with the assignment
+        flow.delivery_request_ts = datetime.now(timezone.utc)
+        offered_fee = max(1.0, round(extract_order_price(flow.order) * 0.15, 2))
+        # One insert_many for every candidate
+        flow.candidates = await send_delivery_requests_async(
+            self.db, flow.numero, livreur_ids,
+            flow.delivery_request_ts, offered_fee,
+            (flow.order.get('client_snapshot') or {}).get('city')
+        )
+
+        if not flow.candidates:
+            await self.no_livreur(flow, "requêtes livreurs non envoyées")
+            return
+        flow.state = DELIVERY_PENDING
+        self.set_timer(flow, self.delivery_timeout)
+        self.logger.info(
+            f"📤 Commande {flow.numero}: requêtes envoyées à {len(flow.candidates)} livreurs "
+            f"(fee={offered_fee})"
+        )
+
+    async def no_livreur(self, flow: OrderFlow, reason: str):
+        await self.db.Commande.update_one(
+            {'numero_commande': flow.numero, 'status': {'$nin': CANCELLED_STATUSES}},
+            {'$set': {'status': 'waiting_for_livreur'}}
+        )
+        self.logger.info(f"⚠️  Commande {flow.numero}: en attente de livreur ({reason})")
+        self.finish(flow, WAITING_FOR_LIVREUR)
+
+    async def assign(self, flow: OrderFlow, id_livreur):
+        """Claim the livreur and assign the order in one transaction"""
+        outcome, _ = await assign_livreur_async(
+            self.db, flow.numero, id_livreur, flow.order.get('id_client'), flow.delivery_request_ts
+        )
+        if outcome == ASSIGNMENT_DONE:
+            self.assignment_latency.observe(
+                (datetime.now(timezone.utc) - flow.started_at).total_seconds()
+            )
+            self.logger.info(f"🚀 Commande {flow.numero} assignée au livreur {id_livreur}")
+            self.finish(flow, ASSIGNED)
+        elif outcome == LIVREUR_TAKEN:
+            # Taken by another order meanwhile: counts as a refusal
+            self.logger.info(f"⚠️  Livreur {id_livreur} déjà pris, commande {flow.numero} en attente")
+            flow.rejected.add(id_livreur)
+            if flow.rejected >= set(flow.candidates):
+                await self.no_livreur(flow, "livreurs déjà pris")
+        else:
+            # Cancel requested meanwhile (its event may not be processed yet)
+            await self.cancel_after_preparation(flow)
+            self.finish(flow, CANCELLED)
+
+    async def notify_client_cancel(self, numero: str, id_client, reason: str):
+        await self.db.Notifications.insert_one({
+            'numero_commande': numero,
+            'id_client': id_client,
+            'message': f"Votre commande {numero} a été annulée : {reason}",
+            'sent_at': datetime.now(timezone.utc)
+        })
+
+    async def record_refund(self, numero: str, beneficiary, amount: float, kind: str):
+        await self.db.Refunds.insert_one({
+            'numero_commande': numero,
+            'beneficiary': beneficiary,
+            'amount': amount,
+            'kind': kind,
+            'ts': datetime.now(timezone.utc)
+        })
+
+    async def cancel_immediate(self, numero: str):
+        """Cancel before preparation: full refund to the client"""
+        updated = await self.db.Commande.find_one_and_update(
+            {'numero_commande': numero, 'status': {'$ne': 'cancelled'}},
+            {'$set': {'status': 'cancelled', 'cancel_reason': 'immediate',
+                      'cancelled_at': datetime.now(timezone.utc)}}
+        )
+        if updated:
+            client_id = updated.get('id_client')
+            await self.record_refund(numero, client_id, extract_order_price(updated), 'full_refund_client')
+            await self.notify_client_cancel(numero, client_id, 'Annulation immédiate, remboursement effectué.')
+            self.logger.info(f"🛑 Commande {numero} annulée (remboursement intégral)")
+
+    async def cancel_after_preparation(self, flow: OrderFlow):
+        """Cancel once the restaurant accepted: it is paid for the preparation"""
+        updated = await self.db.Commande.find_one_and_update(
+            {'numero_commande': flow.numero, 'status': {'$ne': 'cancelled'}},
+            {'$set': {'status': 'cancelled', 'cancel_reason': 'cancel_after_preparation',
+                      'cancelled_at': datetime.now(timezone.utc)}}
+        )
+        if not updated:
+            return  # already cancelled (and refunded)
+        prix_total = extract_order_price(updated) or extract_order_price(flow.order)
+        client_id = updated.get('id_client')
+        await self.record_refund(flow.numero, flow.rest_id, prix_total * 0.6, 'refund_restaurant_preparation')
+        await self.record_refund(flow.numero, client_id, prix_total, 'full_refund_client')
+        await self.notify_client_cancel(
+            flow.numero, client_id, 'Annulation après préparation, remboursements effectués.'
+        )
+        self.logger.info(f"🛑 Commande {flow.numero} annulée après préparation")
+
+    def get_stats_summary(self) -> str:
+        s = self.stats
+        return (
+            f"📊 {s['started']} commandes : {s['assigned']} assignées, "
+            f"{s['rejected_by_restaurant']} refusées par le restaurant, "
+            f"{s['waiting_for_livreur']} sans livreur, {s['cancelled']} annulées, "
+            f"{s['errors']} erreurs, {len(self.flows)} en cours, "
+            f"{s['leases_expired']} réservations expirées"
+        )
@@ -0,0 +1,293 @@
+"""
+Time-partitioned Historique - Historique_YYYY_MM collections keyed on date_commande
+Routing, per-partition indexes, cross-partition reads and numero_commande registry
+"""
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+import re
+
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+
+from config import Config
+from logger import setup_logger
+
+
+class HistoriquePartitions:
+    """
+    Route archived orders to one Historique collection per period
+
+    Unique indexes only hold within a collection, so every archived
+    numero_commande is also claimed in a registry collection
+    (_id: numero_commande, partition: collection name). An order is only
+    written to its partition once its claim points to that partition.
+    """
+
+    SCHEMES = ("none", "monthly", "yearly")
+
+    def __init__(self, config: Config, db, logger=None):
+        if config.historique_partitioning not in self.SCHEMES:
+            raise ValueError(
+                f"Unknown Historique partitioning: {config.historique_partitioning}. "
+                f"Choose one of {', '.join(self.SCHEMES)}"
+            )
+        self.config = config
+        self.db = db
+        self.logger = logger or setup_logger(__name__)
+        self.base = config.collection_historique
+        self._indexed: Set[str] = set()
+
+        # Historique_2025_01 (monthly), Historique_2025 (yearly), Historique_undated
+        self.name_pattern = re.compile(
+            rf"^{re.escape(self.base)}_(\d{{4}})(?:_(\d{{2}}))?$"
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.historique_partitioning != "none"
+
+    @property
+    def registry(self):
+        return self.db[self.config.historique_registry_collection]
+
+    @property
+    def undated(self) -> str:
+        """Partition of orders without a usable date_commande"""
+        return f"{self.base}_undated"
+
+    def partition_name(self, date_commande: Any) -> str:
+        """
+        Collection holding the orders of date_commande's period
+
+        Args:
+            date_commande: Order date (anything else goes to the undated partition)
+
+        Returns:
+            Collection name (the base collection when partitioning is off)
+        """
+        if not self.enabled:
+            return self.base
+        if not isinstance(date_commande, datetime):
+            return self.undated
+        if self.config.historique_partitioning == "yearly":
+            return f"{self.base}_{date_commande.year:04d}"
+        return f"{self.base}_{date_commande.year:04d}_{date_commande.month:02d}"
+
+    def route(self, orders: List[Dict]) -> Dict[str, List[Dict]]:
+        """Group orders by destination collection"""
+        routed: Dict[str, List[Dict]] = {}
+        for order in orders:
+            routed.setdefault(self.partition_name(order.get("date_commande")), []).append(order)
+        return routed
+
+    def list_partitions(self) -> List[str]:
+        """Existing partitions, oldest first (undated last)"""
+        existing = self.db.list_collection_names()
+        names = sorted(name for name in existing if self.name_pattern.match(name))
+        if self.undated in existing:
+            names.append(self.undated)
+        return names
+
+    def partitions_between(
+        self,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None
+    ) -> List[str]:
+        """
+        Partitions that may hold orders dated within [date_from, date_to]
+
+        The undated partition is only included for unbounded reads.
+        """
+        if not self.enabled:
+            return [self.base]
+
+        selected = []
+        for name in self.list_partitions():
+            if name == self.undated:
+                if date_from is None and date_to is None:
+                    selected.append(name)
+                continue
+
+            year, month = self.name_pattern.match(name).groups()
+            start = (int(year), int(month or 1))
+            end = (int(year), int(month or 12))
+            if date_from and end < (date_from.year, date_from.month):
+                continue
+            if date_to and start > (date_to.year, date_to.month):
+                continue
+            selected.append(name)
+        return selected
+
+    def ensure_partition_indexes(self, name: str):
+        """Create the indexes of one partition (once per process)"""
+        if name in self._indexed:
+            return
+        collection = self.db[name]
+        collection.create_index(
+            [("numero_commande", ASCENDING)],
+            unique=True,
+            name="idx_numero_commande_unique"
+        )
+        collection.create_index(
+            [("date_commande", ASCENDING)],
+            name="idx_date_commande"
+        )
+        collection.create_index(
+            [("date_archivage", ASCENDING)],
+            name="idx_date_archivage"
+        )
+        self._indexed.add(name)
+
+    def ensure_indexes(self):
+        """Create the indexes of every existing partition"""
+        for name in self.list_partitions():
+            self.ensure_partition_indexes(name)
+        self.registry.create_index([("partition", ASCENDING)], name="idx_partition")
+
+    def insert(self, orders: List[Dict]) -> Tuple[int, int]:
+        """
+        Claim each numero_commande in the registry, then insert into its partition
+
+        A claim already pointing to the same partition is a retry (for
+        instance after a crash between both writes): the insert is attempted
+        and the partition's unique index decides. A claim pointing to
+        another partition is a duplicate across partitions. Orders without
+        a numero_commande (the watcher buffers them by _id) cannot be
+        claimed: they go straight to their date partition.
+
+        Args:
+            orders: Enriched orders
+
+        Returns:
+            (orders inserted, duplicates)
+
+        Raises:
+            BulkWriteError: On write errors other than duplicate keys
+        """
+        targets = {}
+        for order in orders:
+            numero = order.get("numero_commande")
+            if numero is not None:
+                targets.setdefault(numero, self.partition_name(order.get("date_commande")))
+
+        claims = [
+            {"_id": numero, "partition": partition, "claimed_at": datetime.now()}
+            for numero, partition in targets.items()
+        ]
+        claimed_elsewhere: Set[str] = set()
+        try:
+            if claims:
+                self.registry.insert_many(claims, ordered=False)
+        except BulkWriteError as e:
+            conflicts = self._duplicate_indexes(e)
+            existing = {
+                doc["_id"]: doc["partition"]
+                for doc in self.registry.find(
+                    {"_id": {"$in": [claims[i]["_id"] for i in conflicts]}}
+                )
+            }
+            claimed_elsewhere = {
+                numero for numero, partition in existing.items()
+                if partition != targets[numero]
+            }
+
+        duplicates = 0
+        routed: Dict[str, List[Dict]] = {}
+        for order in orders:
+            numero = order.get("numero_commande")
+            if numero is None:
+                routed.setdefault(self.partition_name(order.get("date_commande")), []).append(order)
+            elif numero in claimed_elsewhere:
+                duplicates += 1
+            else:
+                routed.setdefault(targets[numero], []).append(order)
+
+        inserted = 0
+        for partition, docs in routed.items():
+            self.ensure_partition_indexes(partition)
+            try:
+                inserted += len(self.db[partition].insert_many(docs, ordered=False).inserted_ids)
+            except BulkWriteError as e:
+                partition_duplicates = len(self._duplicate_indexes(e))
+                inserted += len(docs) - partition_duplicates
+                duplicates += partition_duplicates
+
+        return inserted, duplicates
+
+    @staticmethod
+    def _duplicate_indexes(error: BulkWriteError) -> List[int]:
+        """Indexes of the duplicate-key failures; re-raise on any other error"""
+        write_errors = error.details.get("writeErrors", [])
+        if any(err["code"] != 11000 for err in write_errors) or error.details.get("writeConcernErrors"):
+            raise error
+        return [err["index"] for err in write_errors]
+
+    def archived_numeros(self, numeros: List[str]) -> Set[str]:
+        """Order numbers claimed in the registry"""
+        return {
+            doc["_id"]
+            for doc in self.registry.find({"_id": {"$in": numeros}}, {"_id": 1})
+        }
+
+    def verified_numeros(self, numeros: List[str]) -> Set[str]:
+        """Order numbers whose document is actually stored in its partition"""
+        by_partition: Dict[str, List[str]] = {}
+        for doc in self.registry.find({"_id": {"$in": numeros}}):
+            by_partition.setdefault(doc["partition"], []).append(doc["_id"])
+
+        verified = set()
+        for partition, claimed in by_partition.items():
+            verified.update(
+                doc["numero_commande"]
+                for doc in self.db[partition].find(
+                    {"numero_commande": {"$in": claimed}},
+                    {"numero_commande": 1, "_id": 0}
+                )
+            )
+        return verified
+
+    def find(
+        self,
+        query: Optional[Dict] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        projection: Optional[Dict] = None,
+        limit: int = 0,
+        batch_size: int = 0
+    ) -> Iterator[Dict]:
+        """
+        Read archived orders across partitions, oldest partition first
+
+        Args:
+            query: Filter applied in every partition
+            date_from: Optional start of date_commande range
+            date_to: Optional end of date_commande range
+            projection: Optional projection
+            limit: Max documents overall (0: no limit)
+            batch_size: Documents per cursor round trip (0: server default)
+
+        Yields:
+            Archived order documents
+        """
+        query = dict(query or {})
+        if date_from or date_to:
+            date_filter = {}
+            if date_from:
+                date_filter["$gte"] = date_from
+            if date_to:
+                date_filter["$lte"] = date_to
+            query["date_commande"] = date_filter
+
+        remaining = limit
+        for name in self.partitions_between(date_from, date_to):
+            cursor = self.db[name].find(query, projection)
+            if limit:
+                cursor = cursor.limit(remaining)
+            if batch_size:
+                cursor = cursor.batch_size(batch_size)
+            for doc in cursor:
+                yield doc
+                if limit:
+                    remaining -= 1
+                    if not remaining:
+                        return
@@ -0,0 +1,91 @@
+"""Platform simulator - asyncio orchestrator
+Same flow as platform_sim_changestreams.py, with every order modelled as a
+state machine driven by change events and timers in a single event loop.
+"""
+import os
+import sys
+import asyncio
+from pathlib import Path
+
+# Charger les variables d'environnement depuis .env
+try:
+    from dotenv import load_dotenv
+    env_path = Path(__file__).parent.parent / '.env'
+    load_dotenv(env_path)
+except ImportError:
+    print("⚠️  python-dotenv non installé")
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from config import Config
+from connection import get_client, release_client, client_options
+from indexes import IndexManager
+from metrics import MetricsRegistry, MetricsServer
+from orchestrator import AsyncOrchestrator
+
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:  # pymongo < 4.9
+    AsyncMongoClient = None
+
+MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
+DB_NAME = os.getenv('MONGODB_DATABASE', 'Ubereats')
+# Orders with a running state machine; new orders wait beyond that
+PLATFORM_MAX_ACTIVE = int(os.getenv('PLATFORM_MAX_ACTIVE', '10000'))
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# Livreurs offered an order are held for it this long (see reservations.py)
+PLATFORM_LEASE_SECONDS = float(os.getenv('PLATFORM_LEASE_SECONDS', '45'))
+
+config = Config(
+    mongodb_uri=MONGODB_URI,
+    database_name=DB_NAME,
+    mongo_app_name='platform_sim_async',
+    # Four change streams plus the in-flight writes of the event loop
+    mongo_max_pool_size=int(os.getenv('MONGO_MAX_POOL_SIZE', '50')),
+)
+
+
+async def main():
+    client = AsyncMongoClient(MONGODB_URI, **client_options(config))
+    registry = MetricsRegistry()
+    orchestrator = AsyncOrchestrator(
+        client[DB_NAME], registry=registry, max_active=PLATFORM_MAX_ACTIVE,
+        lease_seconds=PLATFORM_LEASE_SECONDS
+    )
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = MetricsServer(registry, METRICS_PORT)
+        metrics_server.start()
+    try:
+        await client.admin.command('ping')
+        print(f"✅ Connecté à la base: {DB_NAME}")
+        print("💡 Appuyez sur Ctrl+C pour arrêter")
+        await orchestrator.run()
+    finally:
+        print(orchestrator.get_stats_summary())
+        if metrics_server:
+            metrics_server.close()
+        await client.close()
+
+
+if __name__ == '__main__':
+    if AsyncMongoClient is None:
+        print("❌ pymongo>=4.9 est requis (pip install -U pymongo)")
+        sys.exit(1)
+
+    print()
+    print("=" * 70)
+    print("  🏢 PLATFORM SIMULATOR - Orchestrateur asyncio (machines à états)")
+    print("=" * 70)
+    print()
+
+    # Index reconciliation uses the synchronous driver, before the loop starts
+    sync_client = get_client(config)
+    try:
+        IndexManager(config, sync_client[DB_NAME]).reconcile()
+    finally:
+        release_client(sync_client)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print('\n[PLATFORM] Stopped by user')
@@ -2,9 +2,8 @@
 Monitors new orders using Change Streams and orchestrates the complete flow.
 """
 import os
-import time
+import sys
 from datetime import datetime, timezone
-from pymongo import MongoClient
 from pathlib import Path
 import threading
 
@@ -19,14 +18,61 @@ except ImportError:
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
 DB_NAME = os.getenv('MONGODB_DATABASE', 'Ubereats')
 
+# Shared connection factory of mongodb_archiver (pool sizing and stats)
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from config import Config
+from connection import get_client, release_client, format_pool_stats
+from indexes import IndexManager
+from executor import BoundedExecutor
+from response_router import ResponseRouter
+from reservations import LivreurReservations
+from assignment import (
+    send_delivery_requests, assign_livreur, livreur_display_name, LIVREUR_TAKEN, ORDER_CANCELLED
+)
+from metrics import MetricsRegistry, MetricsServer
+
+# Orders processed concurrently (each worker waits on one change stream at a
+# time) and orders admitted while all workers are busy
+PLATFORM_WORKERS = int(os.getenv('PLATFORM_WORKERS', '50'))
+PLATFORM_QUEUE_SIZE = int(os.getenv('PLATFORM_QUEUE_SIZE', '500'))
+# Max seconds to wait for room in the queue before refusing an order (0: wait);
+# refused orders are marked rejected_overload
+PLATFORM_ADMISSION_TIMEOUT = float(os.getenv('PLATFORM_ADMISSION_TIMEOUT', '0'))
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# Livreurs offered an order are held for it this long (covers the 30s wait)
+PLATFORM_LEASE_SECONDS = float(os.getenv('PLATFORM_LEASE_SECONDS', '45'))
+
+config = Config(
+    mongodb_uri=MONGODB_URI,
+    database_name=DB_NAME,
+    mongo_app_name='platform_sim',
+    # Short queries of the workers, plus the order, cancellation and
+    # response change streams
+    mongo_max_pool_size=int(os.getenv('MONGO_MAX_POOL_SIZE', str(PLATFORM_WORKERS + 10))),
+    mongo_wait_queue_timeout_ms=int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '0')),
+)
+
 print()
 print("=" * 70)
 print("  🏢 PLATFORM SIMULATOR - Orchestrateur (Change Streams)")
 print("=" * 70)
 print()
 print(f"🔗 Connexion à MongoDB...")
-client = MongoClient(MONGODB_URI)
+client = get_client(config)
 db = client[DB_NAME]
+# Livreur {statut, city} / 2dsphere, requests by numero_commande... (idempotent)
+IndexManager(config, db).reconcile()
+
+# Livreurs are offered to one order at a time (leases on Livreur.statut)
+reservations = LivreurReservations(db, PLATFORM_LEASE_SECONDS)
+
+# One change stream per request collection, shared by every waiting order
+restaurant_responses = ResponseRouter(db.RestaurantRequests, 'id_restaurant')
+delivery_responses = ResponseRouter(db.DeliveryRequests, 'id_livreur')
+for router in (restaurant_responses, delivery_responses):
+    router.start()
+    # Responses written before the stream is open would be missed
+    router.ready.wait(10)
 def _mask_mongo_uri(uri: str) -> str:
     # Mask userinfo (user:pass@) if present for safe printing
     try:
@@ -76,66 +122,6 @@ def _extract_order_price(doc):
             pass
     return 0.0
 
-def wait_for_restaurant_response(numero, rest_id, timeout=60):
-    """Wait for restaurant response using Change Streams"""
-    pipeline = [
-        {
-            '$match': {
-                'operationType': 'update',
-                'fullDocument.numero_commande': numero,
-                'fullDocument.id_restaurant': rest_id,
-                'fullDocument.status': {'$in': ['accepted', 'rejected']}
-            }
-        }
-    ]
-    
-    start_time = time.time()
-    try:
-        # Use full_document='updateLookup' to get the full document after update
-        with db.RestaurantRequests.watch(pipeline, full_document='updateLookup', max_await_time_ms=1000) as stream:
-            while time.time() - start_time < timeout:
-                try:
-                    change = stream.try_next()
-                    if change is not None:
-                        return change['fullDocument']
-                    time.sleep(0.1)
-                except Exception:
-                    time.sleep(0.1)
-    except Exception as e:
-        print(f"   ⚠️ Erreur Change Stream restaurant: {e}")
-    
-    return None
-
-def wait_for_livreur_response(numero, livreur_id, timeout=30):
-    """Wait for livreur response using Change Streams"""
-    pipeline = [
-        {
-            '$match': {
-                'operationType': 'update',
-                'fullDocument.numero_commande': numero,
-                'fullDocument.id_livreur': livreur_id,
-                'fullDocument.status': {'$in': ['accepted', 'rejected']}
-            }
-        }
-    ]
-    
-    start_time = time.time()
-    try:
-        # Use full_document='updateLookup' to get the full document after update
-        with db.DeliveryRequests.watch(pipeline, full_document='updateLookup', max_await_time_ms=1000) as stream:
-            while time.time() - start_time < timeout:
-                try:
-                    change = stream.try_next()
-                    if change is not None:
-                        return change['fullDocument']
-                    time.sleep(0.1)
-                except Exception:
-                    time.sleep(0.1)
-    except Exception as e:
-        print(f"   ⚠️ Erreur Change Stream livreur: {e}")
-    
-    return None
-
 def notify_client_cancel(numero, id_client, reason):
     """Insert a cancellation notification for the client (simulation)."""
     notification = {
@@ -205,6 +191,17 @@ def watch_cancellations(stop_event):
         print(f"   ⚠️ Watcher annulations échoué: {e}")
 
 
+def release_expired_leases(stop_event):
+    """Make livreurs held by a crashed or stuck order available again"""
+    while not stop_event.wait(PLATFORM_LEASE_SECONDS / 3):
+        try:
+            released = reservations.release_expired()
+            if released:
+                print(f"   🔓 {released} réservation(s) de livreur expirée(s) libérée(s)")
+        except Exception as e:
+            print(f"   ⚠️ Libération des réservations expirées échouée: {e}")
+
+
 def select_candidates_for_order(order, k=5, max_distance_m=2000):
     """Return up to k available livreurs prioritized by same city then proximity.
     Expects optional client snapshot with 'coords' == [lng, lat] or 'city'.
@@ -233,35 +230,6 @@ def select_candidates_for_order(order, k=5, max_distance_m=2000):
     return candidates[:k]
 
 
-def wait_for_any_livreur_response(numero, candidate_ids, timeout=30):
-    """Wait for any candidate to accept/reject using a single Change Stream.
-    Returns the fullDocument of the first matching update, or None on timeout/error.
-    """
-    if not candidate_ids:
-        return None
-    pipeline = [
-        {'$match': {
-            'operationType': 'update',
-            'fullDocument.numero_commande': numero,
-            'fullDocument.id_livreur': {'$in': candidate_ids},
-            'fullDocument.status': {'$in': ['accepted', 'rejected']}
-        }}
-    ]
-    start_time = time.time()
-    try:
-        with db.DeliveryRequests.watch(pipeline, full_document='updateLookup', max_await_time_ms=1000) as stream:
-            while time.time() - start_time < timeout:
-                try:
-                    change = stream.try_next()
-                    if change is not None:
-                        return change.get('fullDocument')
-                    time.sleep(0.1)
-                except Exception:
-                    time.sleep(0.1)
-    except Exception as e:
-        print(f"   ⚠️ Erreur Change Stream (candidats): {e}")
-    return None
-
 def process_order(order):
     """Process a single order through the complete flow"""
     numero = order['numero_commande']
@@ -290,12 +258,18 @@ def process_order(order):
         'status': 'requested',
         'requested_at': datetime.now(timezone.utc)
     }
-    db.RestaurantRequests.insert_one(req)
+    # Registered before the insert: an immediate answer cannot be missed
+    restaurant_waiter = restaurant_responses.expect(numero, [rest_id])
+    try:
+        db.RestaurantRequests.insert_one(req)
+    except Exception:
+        restaurant_responses.forget(restaurant_waiter)
+        raise
     print(f"   ✅ Requête envoyée")
 
-    # Wait for restaurant response using Change Streams
+    # Wait for restaurant response (routed from the shared Change Stream)
     print(f"   ⏳ Attente réponse restaurant (max 60s via Change Streams)...")
-    response = wait_for_restaurant_response(numero, rest_id, timeout=60)
+    response = restaurant_responses.wait(restaurant_waiter, timeout=60)
 
     if not response or response.get('status') != 'accepted':
         # Formatted rejection block
@@ -348,174 +322,102 @@ def process_order(order):
     except Exception:
         print("   🔎 Candidates found: (unable to determine length)")
 
-    if not candidates:
+    # Hold the candidates for this order: a livreur is only offered to one
+    # order at a time
+    livreur_ids = reservations.reserve_candidates(numero, [livreur['id_livreur'] for livreur in candidates])
+
+    if not livreur_ids:
         # Fallback to legacy behavior: pick any available livreur (maintains previous behavior)
-        print(f"   ⚠️ Aucun candidat top-K trouvé pour {numero}, fallback sur recherche simple (find_one)")
+        print(f"   ⚠️ Aucun candidat top-K réservé pour {numero}, fallback sur recherche simple (find_one)")
         livreur = db.Livreur.find_one({'statut': 'disponible'})
-        if not livreur:
+        if livreur and reservations.reserve(numero, livreur['id_livreur']):
+            livreur_ids = [livreur['id_livreur']]
+        else:
             print(f"   ⚠️ Aucun livreur disponible pour {numero}")
             db.Commande.update_one({'numero_commande': numero}, {'$set': {'status': 'waiting_for_livreur'}})
             return
 
-        # Create single delivery request and wait for the single livreur response (legacy path)
-        # record the time we sent the delivery request(s) for metrics
-        delivery_request_ts = datetime.now(timezone.utc)
-        try:
-            db.Commande.update_one({'numero_commande': numero}, {'$set': {'delivery_request_ts': delivery_request_ts}})
-        except Exception:
-            pass
-
-        fb_prix = _extract_order_price(current) if current else _extract_order_price(order)
-        delivery_req = {
-            'numero_commande': numero,
-            'id_livreur': livreur['id_livreur'],
-            'status': 'requested',
-            'requested_at': delivery_request_ts,
-            'offered_price': max(1.0, round(fb_prix * 0.15, 2))
-        }
-        db.DeliveryRequests.insert_one(delivery_req)
-        print(f"   📤 Requête envoyée au livreur {livreur['id_livreur']} (fallback)")
-        print(f"   ⏳ Attente réponse livreur (max 30s via Change Streams)...")
-        dr = wait_for_livreur_response(numero, livreur['id_livreur'], timeout=30)
-
-        if not dr or dr.get('status') != 'accepted':
-            print(f"   ❌ Livreur n'a pas accepté pour {numero} (fallback)")
-            db.Commande.update_one({'numero_commande': numero}, {'$set': {'status': 'waiting_for_livreur'}})
-            return
-
-        livreur_doc = db.Livreur.find_one({'id_livreur': livreur['id_livreur']}) or livreur
-        assigned_livreur = livreur_doc['id_livreur']
-    else:
-        # compute offered price for this delivery (example: 15% of order, min 1.0)
-        prix_total = _extract_order_price(current) if current else _extract_order_price(order)
-        offered_fee = max(1.0, round(prix_total * 0.15, 2))
-
-        # record a single delivery_request_ts for the whole candidate batch
-        delivery_request_ts = datetime.now(timezone.utc)
-        try:
-            db.Commande.update_one({'numero_commande': numero}, {'$set': {'delivery_request_ts': delivery_request_ts}})
-        except Exception:
-            pass
-
-        candidate_ids = []
-        for livreur in candidates:
-            try:
-                candidate_ids.append(livreur['id_livreur'])
-                delivery_req = {
-                    'numero_commande': numero,
-                    'id_livreur': livreur['id_livreur'],
-                    'status': 'requested',
-                    'requested_at': delivery_request_ts,
-                    'offered_price': offered_fee,
-                    'city': (order.get('client_snapshot') or {}).get('city')
-                }
-                db.DeliveryRequests.insert_one(delivery_req)
-            except Exception:
-                continue
-        print(f"   📤 Requêtes envoyées à {len(candidate_ids)} livreurs (fee={offered_fee})")
-
-        # Wait for any candidate to respond using a single Change Stream
-        print(f"   ⏳ Attente réponse(s) livreurs (max 30s via Change Streams)...")
-        dr = wait_for_any_livreur_response(numero, candidate_ids, timeout=30)
-
-        if not dr or dr.get('status') != 'accepted':
-            print(f"   ❌ Aucun livreur n'a accepté pour {numero} (top-{len(candidate_ids)} tentatives)")
-            db.Commande.update_one({'numero_commande': numero}, {'$set': {'status': 'waiting_for_livreur'}})
-            return
-
-        # If accepted, get the accepted livreur id and continue assignment
-        accepted_livreur_id = dr.get('id_livreur')
-        livreur_doc = db.Livreur.find_one({'id_livreur': accepted_livreur_id}) or {}
-        assigned_livreur = accepted_livreur_id
-
-    # Update commande and livreur records
-    db.Commande.update_one(
-        {'numero_commande': numero},
-        {'$set': {'status': 'en_cours', 'id_livreur': assigned_livreur}}
-    )
-    db.Livreur.update_one(
-        {'id_livreur': assigned_livreur},
-        {'$set': {'statut': 'en_course', 'numero_commande': numero}}
-    )
-
-    # Record assignment metrics (assignment delay) if we have a delivery_request_ts
     try:
-        assigned_at = datetime.now(timezone.utc)
-        cmd = db.Commande.find_one({'numero_commande': numero})
-        dr_ts = cmd.get('delivery_request_ts') if cmd else None
-        if dr_ts:
-            try:
-                assignment_delay_ms = int((assigned_at - dr_ts).total_seconds() * 1000)
-            except Exception:
-                assignment_delay_ms = None
-        else:
-            assignment_delay_ms = None
-
-        metric = {
-            'numero_commande': numero,
-            'delivery_request_ts': dr_ts,
-            'assigned_at': assigned_at,
-            'assignment_delay_ms': assignment_delay_ms,
-            'ts': datetime.now(timezone.utc)
-        }
-        try:
-            db.Metrics.insert_one(metric)
-        except Exception:
-            pass
+        assign_reserved_livreur(order, current, numero, livreur_ids)
+    finally:
+        # Candidates that were not assigned become available again
+        reservations.release(numero, livreur_ids)
+
+
+def assign_reserved_livreur(order, current, numero, livreur_ids):
+    """Send the delivery requests to the reserved livreurs and assign the first to accept"""
+    # compute offered price for this delivery (example: 15% of order, min 1.0)
+    prix_total = _extract_order_price(current) if current else _extract_order_price(order)
+    offered_fee = max(1.0, round(prix_total * 0.15, 2))
+
+    # One request time for the whole candidate batch, kept in memory for the
+    # assignment delay (written with the assignment)
+    delivery_request_ts = datetime.now(timezone.utc)
+    delivery_waiter = delivery_responses.expect(numero, livreur_ids)
+    try:
+        # One insert_many for every candidate
+        candidate_ids = send_delivery_requests(
+            db, numero, livreur_ids, delivery_request_ts, offered_fee,
+            (order.get('client_snapshot') or {}).get('city')
+        )
     except Exception:
-        pass
+        delivery_responses.forget(delivery_waiter)
+        raise
+    for id_livreur in set(livreur_ids) - set(candidate_ids):
+        delivery_responses.withdraw(delivery_waiter, id_livreur)
+    print(f"   📤 Requêtes envoyées à {len(candidate_ids)} livreurs (fee={offered_fee})")
+
+    # First acceptance wins; gives up once every candidate has refused
+    print(f"   ⏳ Attente réponse(s) livreurs (max 30s via Change Streams)...")
+    dr = delivery_responses.wait(delivery_waiter, timeout=30 if candidate_ids else 0)
+
+    if not dr or dr.get('status') != 'accepted':
+        print(f"   ❌ Aucun livreur n'a accepté pour {numero} (top-{len(candidate_ids)} tentatives)")
+        db.Commande.update_one({'numero_commande': numero}, {'$set': {'status': 'waiting_for_livreur'}})
+        return
 
-    # Pretty assignment block
-    prenom = livreur_doc.get('Prénom') or livreur_doc.get('prenom')
-    nom = livreur_doc.get('Nom') or livreur_doc.get('nom')
-    if prenom and nom:
-        livreur_name = f"{prenom} {nom}"
-    elif prenom:
-        livreur_name = f"{prenom} ({assigned_livreur})"
-    elif nom:
-        livreur_name = f"{nom} ({assigned_livreur})"
-    else:
-        livreur_name = str(assigned_livreur)
+    # Claim the livreur, assign the order, record the metric and notify the
+    # client in one transaction
+    assigned_livreur = dr.get('id_livreur')
+    outcome, livreur_doc = assign_livreur(
+        db, numero, assigned_livreur, order.get('id_client'), delivery_request_ts
+    )
+    if outcome == ORDER_CANCELLED:
+        print(f"   ⚠️ Commande {numero} annulée pendant l'attente du livreur, pas d'attribution")
+        return
+    if outcome == LIVREUR_TAKEN:
+        print(f"   ⚠️ Livreur {assigned_livreur} déjà pris par une autre commande")
+        db.Commande.update_one({'numero_commande': numero}, {'$set': {'status': 'waiting_for_livreur'}})
+        return
 
     print()
     print("─" * 70)
     print("🚀 ATTRIBUTION DE COMMANDE AU LIVREUR")
     print("─" * 70)
     print(f"   📦 Commande : {numero}")
-    print(f"   🧑‍🚚 Livreur  : {assigned_livreur} ({livreur_name})")
+    print(f"   🧑‍🚚 Livreur  : {assigned_livreur} ({livreur_display_name(livreur_doc, assigned_livreur)})")
     if livreur_doc.get('Téléphone') or livreur_doc.get('telephone'):
         phone = livreur_doc.get('Téléphone') or livreur_doc.get('telephone')
         print(f"   📞 Téléphone: {phone}")
     print(f"   ✅ Statut    : en_cours")
     print("   📝 Action    : Commande assignée et livreur notifié")
     print("─" * 70)
-
-    # Send enriched notification to client
-    prenom = livreur_doc.get('Prénom') or livreur_doc.get('prenom')
-    nom = livreur_doc.get('Nom') or livreur_doc.get('nom')
-    if prenom and nom:
-        livreur_name = f"{prenom} {nom}"
-    elif prenom:
-        livreur_name = f"{prenom} ({assigned_livreur})"
-    elif nom:
-        livreur_name = f"{nom} ({assigned_livreur})"
-    else:
-        livreur_name = str(assigned_livreur)
-
-    livreur_phone = livreur_doc.get('Téléphone') or livreur_doc.get('telephone')
-    message = f"Votre commande {numero} a été prise en charge par le livreur {livreur_name} (id: {assigned_livreur})"
-    if livreur_phone:
-        message += f" - Tel: {livreur_phone}"
-
-    notification = {
-        'numero_commande': numero,
-        'id_client': order.get('id_client'),
-        'message': message,
-        'sent_at': datetime.now(timezone.utc)
-    }
-    db.Notifications.insert_one(notification)
     print(f"   ✉️ Notification envoyée au client {order.get('id_client')}")
 
+# Bounded worker pool instead of one thread per order
+metrics = MetricsRegistry()
+executor = BoundedExecutor(PLATFORM_WORKERS, PLATFORM_QUEUE_SIZE, metrics, 'platform_orders')
+executor.start()
+for router, name in ((restaurant_responses, 'restaurant'), (delivery_responses, 'delivery')):
+    metrics.gauge(
+        f'platform_{name}_responses_waiting', 'Orders waiting for a response on the shared stream'
+    ).set_function(lambda router=router: router.waiting)
+metrics_server = None
+if METRICS_PORT:
+    metrics_server = MetricsServer(metrics, METRICS_PORT)
+    metrics_server.start()
+print(f"👷 {PLATFORM_WORKERS} workers, file d'attente de {PLATFORM_QUEUE_SIZE} commandes")
+
 try:
     # Use Change Streams to watch for new orders
     print("🔄 Écoute des nouvelles commandes via Change Streams...")
@@ -534,15 +436,43 @@ try:
     # Start a background watcher to process cancel requests in real time
     stop_event = threading.Event()
     threading.Thread(target=watch_cancellations, args=(stop_event,), daemon=True).start()
+    threading.Thread(target=release_expired_leases, args=(stop_event,), daemon=True).start()
 
     with db.Commande.watch(pipeline) as stream:
         for change in stream:
             order = change.get('fullDocument')
             if order:
-                # Process each order in a separate thread to handle multiple orders concurrently
-                threading.Thread(target=process_order, args=(order,), daemon=True).start()
+                # Blocks while the admission queue is full: the stream is only
+                # read as fast as the workers take orders (backpressure)
+                if not executor.submit(process_order, order, timeout=PLATFORM_ADMISSION_TIMEOUT or None):
+                    # The insert event is consumed: mark the order instead of
+                    # leaving it pending_request forever
+                    numero = order.get('numero_commande')
+                    db.Commande.update_one(
+                        {'_id': order['_id'], 'status': 'pending_request'},
+                        {'$set': {'status': 'rejected_overload'}}
+                    )
+                    print(f"   ⛔ File d'attente pleine, commande {numero} refusée -> rejected_overload")
 
 except KeyboardInterrupt:
     print('\n[PLATFORM] Stopped by user')
 finally:
-    client.close()
+    # Orders still queued are dropped, running ones end with the process
+    dropped = executor.shutdown(wait=False, cancel_pending=True)
+    if dropped:
+        # Never admitted to a worker: same terminal status as a refused order
+        db.Commande.update_many(
+            {'_id': {'$in': [order['_id'] for (order,) in dropped]}, 'status': 'pending_request'},
+            {'$set': {'status': 'rejected_overload'}}
+        )
+    executor_stats = executor.get_stats()
+    print(f"📊 Commandes : {executor_stats['completed']} traitées, {executor_stats['failed']} en erreur, "
+          f"{executor_stats['rejected']} refusées, {len(dropped)} abandonnées en file -> rejected_overload "
+          f"(attente moyenne {executor_stats['mean_queue_wait']:.2f}s)")
+    for router in (restaurant_responses, delivery_responses):
+        router.stop()
+    if metrics_server:
+        metrics_server.close()
+    # Peak connections in use: size MONGO_MAX_POOL_SIZE from it
+    print(format_pool_stats())
+    release_client(client)
@@ -0,0 +1,128 @@
+"""
+Livreur reservations - leases taken with find_one_and_update on the livreur status
+A livreur is offered to one order at a time; expired leases make it available again
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+
+RESERVED = "reserve"  # statut of a livreur held by an order (reserved_by, reserved_until)
+
+
+def reservable_filter(id_livreur, now: datetime) -> Dict:
+    """Livreur available, or held by a lease that has expired"""
+    return {
+        'id_livreur': id_livreur,
+        '$or': [
+            {'statut': 'disponible'},
+            {'statut': RESERVED, 'reserved_until': {'$lt': now}},
+        ]
+    }
+
+
+def reserve_update(numero: str, until: datetime) -> Dict:
+    return {'$set': {'statut': RESERVED, 'reserved_by': numero, 'reserved_until': until}}
+
+
+def release_filter(numero: str, livreur_ids: Optional[List] = None) -> Dict:
+    """Reservations still held by this order (optionally only these livreurs)"""
+    query: Dict = {'statut': RESERVED, 'reserved_by': numero}
+    if livreur_ids is not None:
+        query['id_livreur'] = {'$in': list(livreur_ids)}
+    return query
+
+
+RELEASE_UPDATE = {
+    '$set': {'statut': 'disponible'},
+    '$unset': {'reserved_by': '', 'reserved_until': ''}
+}
+
+
+def expired_filter(now: datetime) -> Dict:
+    return {'statut': RESERVED, 'reserved_until': {'$lt': now}}
+
+
+class LivreurReservations:
+    """
+    Hold livreurs for an order while it waits for their answer
+
+    reserve() only succeeds on an available livreur (or one whose lease
+    expired), atomically, so two orders can never hold the same livreur.
+    The final assignment (assignment.assign_livreur) only claims a livreur
+    reserved by its own order.
+    """
+
+    def __init__(self, db, lease_seconds: float = 45):
+        self.db = db
+        self.lease = timedelta(seconds=lease_seconds)
+
+    def reserve(self, numero: str, id_livreur) -> Optional[Dict]:
+        """
+        Take a lease on one livreur for an order
+
+        Returns:
+            The reserved livreur document, None if it is not available
+        """
+        now = datetime.now(timezone.utc)
+        return self.db.Livreur.find_one_and_update(
+            reservable_filter(id_livreur, now),
+            reserve_update(numero, now + self.lease),
+            return_document=ReturnDocument.AFTER
+        )
+
+    def reserve_candidates(self, numero: str, livreur_ids: List) -> List:
+        """
+        Reserve the top-K candidates of an order, in order
+
+        Args:
+            numero: numero_commande
+            livreur_ids: Candidates from the selection query
+
+        Returns:
+            Ids of the livreurs now held by this order
+        """
+        return [
+            id_livreur for id_livreur in livreur_ids
+            if self.reserve(numero, id_livreur) is not None
+        ]
+
+    def release(self, numero: str, livreur_ids: Optional[List] = None) -> int:
+        """Give back the livreurs still reserved by an order (all by default)"""
+        result = self.db.Livreur.update_many(release_filter(numero, livreur_ids), RELEASE_UPDATE)
+        return result.modified_count
+
+    def release_expired(self) -> int:
+        """Make livreurs whose lease expired visible to the selection queries again"""
+        now = datetime.now(timezone.utc)
+        result = self.db.Livreur.update_many(expired_filter(now), RELEASE_UPDATE)
+        return result.modified_count
+
+
+class AsyncLivreurReservations(LivreurReservations):
+    """LivreurReservations on the asyncio driver"""
+
+    async def reserve(self, numero: str, id_livreur) -> Optional[Dict]:
+        now = datetime.now(timezone.utc)
+        return await self.db.Livreur.find_one_and_update(
+            reservable_filter(id_livreur, now),
+            reserve_update(numero, now + self.lease),
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def reserve_candidates(self, numero: str, livreur_ids: List) -> List:
+        reserved = []
+        for id_livreur in livreur_ids:
+            if await self.reserve(numero, id_livreur) is not None:
+                reserved.append(id_livreur)
+        return reserved
+
+    async def release(self, numero: str, livreur_ids: Optional[List] = None) -> int:
+        result = await self.db.Livreur.update_many(release_filter(numero, livreur_ids), RELEASE_UPDATE)
+        return result.modified_count
+
+    async def release_expired(self) -> int:
+        now = datetime.now(timezone.utc)
+        result = await self.db.Livreur.update_many(expired_filter(now), RELEASE_UPDATE)
+        return result.modified_count
@@ -0,0 +1,196 @@
+"""
+Response router - one change stream per request collection for every waiting order
+Dispatches accepted/rejected updates to the orders waiting on (numero_commande, id)
+"""
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import threading
+import time
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from logger import setup_logger
+
+
+class ResponseWaiter:
+    """
+    Pending response of one order from one or more responders
+
+    Resolved by the first 'accepted' update, or by the last 'rejected'
+    once every responder has refused.
+    """
+
+    def __init__(self, numero: str, responder_ids: Iterable):
+        self.numero = numero
+        self.responder_ids: Set = set(responder_ids)
+        self.rejected: Set = set()
+        self.last_rejection: Optional[Dict] = None
+        self.result: Optional[Dict] = None
+        self.event = threading.Event()
+        # respond() runs on the router thread, withdraw() on the order's
+        self.lock = threading.Lock()
+
+    def respond(self, doc: Dict, responder_id):
+        with self.lock:
+            if self.event.is_set():
+                return
+            if doc.get('status') == 'accepted':
+                self.result = doc
+                self.event.set()
+                return
+            self.rejected.add(responder_id)
+            self.last_rejection = doc
+            self._resolve_if_all_rejected()
+
+    def withdraw(self, responder_id):
+        """Stop counting on a responder; the others may all have refused already"""
+        with self.lock:
+            self.responder_ids.discard(responder_id)
+            if not self.event.is_set():
+                self._resolve_if_all_rejected()
+
+    def _resolve_if_all_rejected(self):
+        if self.responder_ids and self.rejected >= self.responder_ids:
+            self.result = self.last_rejection
+            self.event.set()
+
+
+class ResponseRouter:
+    """
+    Watch a request collection once and route responses to waiting orders
+
+    Usage, registering before the request is written so that an immediate
+    response cannot be missed:
+
+        waiter = router.expect(numero, [id_restaurant])
+        db.RestaurantRequests.insert_one(request)
+        response = router.wait(waiter, timeout=60)
+    """
+
+    STATUSES = ('accepted', 'rejected')
+
+    def __init__(self, collection, id_field: str, logger=None, max_await_time_ms: int = 1000):
+        self.collection = collection
+        self.id_field = id_field
+        self.logger = logger or setup_logger(__name__)
+        self.max_await_time_ms = max_await_time_ms
+        self.pending: Dict[Tuple, ResponseWaiter] = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.ready = threading.Event()
+        self.resume_token = None
+        self.thread: Optional[threading.Thread] = None
+        self.stats = {'dispatched': 0, 'unmatched': 0, 'reconnects': 0}
+
+    def start(self):
+        """Open the change stream in a daemon thread"""
+        self.thread = threading.Thread(
+            target=self._run, name=f"router-{self.collection.name}", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout=self.max_await_time_ms / 1000 + 1)
+
+    def get_pipeline(self) -> List[Dict]:
+        return [{
+            '$match': {
+                'operationType': 'update',
+                'fullDocument.status': {'$in': list(self.STATUSES)}
+            }
+        }]
+
+    def _run(self):
+        while not self.stopping.is_set():
+            try:
+                with self.collection.watch(
+                    self.get_pipeline(),
+                    full_document='updateLookup',
+                    max_await_time_ms=self.max_await_time_ms,
+                    resume_after=self.resume_token
+                ) as stream:
+                    self.ready.set()
+                    while stream.alive and not self.stopping.is_set():
+                        # Blocks server-side up to max_await_time_ms
+                        change = stream.try_next()
+                        if change is None:
+                            continue
+                        self.resume_token = stream.resume_token
+                        if change.get('fullDocument'):
+                            self.dispatch(change['fullDocument'])
+            except PyMongoError as e:
+                if self.stopping.is_set():
+                    return
+                if isinstance(e, OperationFailure) and e.code == 286:
+                    # ChangeStreamHistoryLost: the token left the oplog
+                    self.resume_token = None
+                self.stats['reconnects'] += 1
+                self.logger.warning(f"⚠️  Change stream {self.collection.name}: {e}, reconnecting...")
+                time.sleep(1)
+
+    def expect(self, numero: str, responder_ids: Iterable) -> ResponseWaiter:
+        """
+        Register an order waiting for responses (before sending the requests)
+
+        Args:
+            numero: numero_commande of the order
+            responder_ids: ids (id_field) of the restaurant or livreurs asked
+
+        Returns:
+            Waiter to pass to wait()
+        """
+        waiter = ResponseWaiter(numero, responder_ids)
+        with self.lock:
+            for responder_id in waiter.responder_ids:
+                self.pending[(numero, responder_id)] = waiter
+        return waiter
+
+    def wait(self, waiter: ResponseWaiter, timeout: float) -> Optional[Dict]:
+        """
+        Wait for the response of a registered order
+
+        Args:
+            waiter: Returned by expect()
+            timeout: Max seconds to wait
+
+        Returns:
+            The accepted request document, the last rejection once every
+            responder refused, or None on timeout
+        """
+        try:
+            waiter.event.wait(timeout)
+            return waiter.result
+        finally:
+            self.forget(waiter)
+
+    def forget(self, waiter: ResponseWaiter):
+        """Unregister an order (responses arriving later are ignored)"""
+        with self.lock:
+            for responder_id in waiter.responder_ids:
+                if self.pending.get((waiter.numero, responder_id)) is waiter:
+                    del self.pending[(waiter.numero, responder_id)]
+
+    def withdraw(self, waiter: ResponseWaiter, responder_id):
+        """Stop waiting for one responder (its request could not be sent)"""
+        with self.lock:
+            if self.pending.get((waiter.numero, responder_id)) is waiter:
+                del self.pending[(waiter.numero, responder_id)]
+        waiter.withdraw(responder_id)
+
+    def dispatch(self, doc: Dict):
+        """Hand an accepted/rejected request document to its waiting order"""
+        responder_id = doc.get(self.id_field)
+        with self.lock:
+            waiter = self.pending.get((doc.get('numero_commande'), responder_id))
+        if waiter is None:
+            self.stats['unmatched'] += 1
+            return
+        self.stats['dispatched'] += 1
+        waiter.respond(doc, responder_id)
+
+    @property
+    def waiting(self) -> int:
+        """Orders currently waiting for a response"""
+        with self.lock:
+            return len({id(waiter) for waiter in self.pending.values()})
@@ -4,6 +4,7 @@ CLI for test data generation
 import argparse
 import sys
 import logging
+from datetime import datetime
 
 from config import Config
 from logger import setup_logger, get_log_filename
@@ -23,6 +24,9 @@ Examples:
   # Generate with specific seed for reproducibility
   python simulate.py --count 500 --seed 42
   
+  # Replay a run exactly: seed and reference time are both logged
+  python simulate.py --count 500 --seed 42 --reference-time 2025-06-01T12:00:00
+  
   # Generate with 50% delivered orders
   python simulate.py --count 1000 --p-delivered 0.5
   
@@ -34,6 +38,12 @@ Examples:
   
   # Use local MongoDB for testing
   python simulate.py --simulation --count 100
+  
+  # Load test: 5M orders streamed by 8 processes, constant memory
+  python simulate.py --count 5000000 --workers 8 --seed 42
+  
+  # Vectorized NumPy generator (pip install numpy), 10x+ faster
+  python simulate.py --count 5000000 --workers 8 --fast
 
 Environment Variables:
   MONGODB_URI       MongoDB connection string (required in production)
@@ -57,6 +67,17 @@ Environment Variables:
                        help='Probability of missing related IDs (0-1, default: 0.05)')
     parser.add_argument('--seed', type=int,
                        help='Random seed for reproducibility')
+    parser.add_argument('--reference-time', type=datetime.fromisoformat,
+                       help='Fixed "now" the dates are drawn against, ISO format '
+                            '(default: start of the run, logged next to the seed)')
+    parser.add_argument('--workers', type=int, default=0,
+                       help='Streaming mode: generate and insert chunks in N processes '
+                            '(default: 0, everything in memory)')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                       help='Documents per chunk in streaming mode (default: 10000)')
+    parser.add_argument('--fast', action='store_true',
+                       help='Vectorized generator: Faker vocabularies sampled once, '
+                            'fields built with NumPy (requires numpy)')
     parser.add_argument('--clear', action='store_true',
                        help='Clear existing data before generating')
     parser.add_argument('--simulation', action='store_true',
@@ -75,6 +96,10 @@ Environment Variables:
         print("❌ Error: --p-null must be between 0 and 1")
         sys.exit(1)
     
+    if args.workers < 0 or args.chunk_size < 1:
+        print("❌ Error: --workers must be >= 0 and --chunk-size >= 1")
+        sys.exit(1)
+    
     try:
         # Setup config and logger
         if args.simulation:
@@ -88,7 +113,17 @@ Environment Variables:
         logger = setup_logger('generator', log_file, log_level)
         
         # Create generator
-        generator = DataGenerator(config, seed=args.seed, logger=logger)
+        if args.fast:
+            from fast_generator import FastDataGenerator
+            generator = FastDataGenerator(
+                config, seed=args.seed, logger=logger,
+                reference_time=args.reference_time
+            )
+        else:
+            generator = DataGenerator(
+                config, seed=args.seed, logger=logger,
+                reference_time=args.reference_time
+            )
         
         # Warn if clearing data
         if args.clear:
@@ -106,7 +141,9 @@ Environment Variables:
             n_commandes=args.count,
             p_delivered=args.p_delivered,
             p_null_ids=args.p_null,
-            clear_existing=args.clear
+            clear_existing=args.clear,
+            workers=args.workers,
+            chunk_size=args.chunk_size
         )
         
         generator.close()
@@ -0,0 +1,119 @@
+"""
+Local supervisor for partitioned Change Stream watchers
+Spawns one watcher process per partition and restarts crashed ones
+"""
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from logger import setup_logger
+
+
+class WatcherSupervisor:
+    """Run N partitioned watchers as child processes"""
+
+    def __init__(self, partitions: int, worker_args: List[str], logger=None,
+                 max_restart_delay: int = 60, stop_timeout: int = 15):
+        """
+        Args:
+            partitions: Number of partitions (one process each)
+            worker_args: main.py arguments shared by every worker; the
+                supervisor appends --partition-id <i>
+            max_restart_delay: Max backoff between restarts (seconds)
+            stop_timeout: Seconds to wait for workers to flush on shutdown
+        """
+        self.partitions = partitions
+        self.worker_args = worker_args
+        self.logger = logger or setup_logger(__name__)
+        self.max_restart_delay = max_restart_delay
+        self.stop_timeout = stop_timeout
+
+        self.processes: Dict[int, subprocess.Popen] = {}
+        self.restart_delay: Dict[int, int] = {}
+        self.next_start: Dict[int, float] = {}
+        self.started_at: Dict[int, float] = {}
+        self.restarts = 0
+
+    def worker_command(self, partition_id: int) -> List[str]:
+        """Command line of the watcher owning one partition"""
+        main_py = str(Path(__file__).parent / 'main.py')
+        return [sys.executable, main_py] + self.worker_args + [
+            '--partition-id', str(partition_id)
+        ]
+
+    def start_worker(self, partition_id: int):
+        """Spawn the watcher of one partition"""
+        self.processes[partition_id] = subprocess.Popen(
+            self.worker_command(partition_id)
+        )
+        self.started_at[partition_id] = time.monotonic()
+        self.logger.info(
+            f"🚀 Started watcher {partition_id}/{self.partitions} "
+            f"(pid {self.processes[partition_id].pid})"
+        )
+
+    def check_workers(self):
+        """Restart crashed workers with exponential backoff"""
+        now = time.monotonic()
+        for partition_id in range(self.partitions):
+            process = self.processes.get(partition_id)
+
+            if process is not None:
+                returncode = process.poll()
+                if returncode is None:
+                    continue
+
+                # A worker that ran for a while gets a fresh backoff
+                if now - self.started_at[partition_id] > self.max_restart_delay:
+                    self.restart_delay[partition_id] = 1
+
+                # Each worker resumes from its own partition token
+                delay = self.restart_delay.get(partition_id, 1)
+                self.logger.warning(
+                    f"⚠️  Watcher {partition_id} exited with code {returncode}, "
+                    f"restarting in {delay}s"
+                )
+                self.processes[partition_id] = None
+                self.next_start[partition_id] = now + delay
+                self.restart_delay[partition_id] = min(delay * 2, self.max_restart_delay)
+                continue
+
+            if now >= self.next_start.get(partition_id, 0):
+                self.start_worker(partition_id)
+                if partition_id in self.next_start:
+                    self.restarts += 1
+
+    def stop(self):
+        """Let workers flush and exit, then kill the stragglers"""
+        self.logger.info("⏹️  Stopping watchers...")
+        deadline = time.monotonic() + self.stop_timeout
+
+        # Ctrl+C already reached the children (same console process group)
+        for partition_id, process in self.processes.items():
+            if process is None:
+                continue
+            try:
+                process.wait(timeout=max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                self.logger.warning(f"⚠️  Terminating watcher {partition_id}")
+                process.terminate()
+                process.wait()
+
+    def run(self, poll_interval: float = 1.0):
+        """Supervise workers until Ctrl+C"""
+        self.logger.info(f"👥 Supervising {self.partitions} partitioned watchers")
+        self.logger.info("💡 Press Ctrl+C to stop")
+
+        try:
+            while True:
+                self.check_workers()
+                time.sleep(poll_interval)
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            self.stop()
+            self.logger.info(f"✅ Supervisor stopped ({self.restarts} restarts)")
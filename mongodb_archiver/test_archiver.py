@@ -2,13 +2,39 @@
 Unit tests for MongoDB Order Archiver
 """
 import pytest
+import asyncio
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+import urllib.request
 from datetime import datetime
-from unittest.mock import Mock, MagicMock, patch
+from unittest.mock import Mock, MagicMock, AsyncMock, patch
 from bson import ObjectId
+from pymongo.errors import BulkWriteError, OperationFailure
 
 from config import Config
 from archiver import OrderArchiver
+from async_archiver import AsyncOrderArchiver
 from watcher import OrderWatcher
+from dimension_cache import DimensionCache, ClientSideEnricher
+from token_store import TokenStore, FileTokenStore, MongoTokenStore, ThrottledTokenWriter
+from supervisor import WatcherSupervisor
+from generator import DataGenerator, ChunkWriter
+from partitions import HistoriquePartitions
+from metrics import MetricsRegistry, MetricsServer
+import connection
+from logger import setup_logger, shutdown_logging, parse_sampling, SamplingFilter, DroppingQueueHandler
+from exporter import HistoriqueExporter
+from indexes import IndexManager, analyze_explain
+from executor import BoundedExecutor
+from response_router import ResponseRouter
+import orchestrator
+import assignment
+from orchestrator import AsyncOrchestrator
+from reservations import LivreurReservations
 
 
 @pytest.fixture
@@ -27,6 +53,21 @@ def mock_logger():
     return Mock()
 
 
+def mock_aggregate(collection, orders, skipped=0):
+    """Route aggregate(): $count pipelines get skipped, others stream orders"""
+    cursor = MagicMock()
+    cursor.__enter__.return_value = cursor
+    cursor.__iter__.side_effect = lambda: iter(orders)
+    
+    def aggregate(pipeline, **kwargs):
+        if '$count' in pipeline[-1]:
+            return iter([{'skipped': skipped}] if skipped else [])
+        return cursor
+    
+    collection.aggregate.side_effect = aggregate
+    return cursor
+
+
 class TestOrderArchiver:
     """Tests for OrderArchiver class"""
     
@@ -65,6 +106,232 @@ class TestOrderArchiver:
         lookup_stages = [stage for stage in pipeline if '$lookup' in stage]
         assert len(lookup_stages) == 4  # Client, Livreur, Restaurant, Menu
     
+    def test_get_bulk_enrichment_pipeline(self, mock_config, mock_logger):
+        """Test bulk pipeline matches delivered orders within the date range"""
+        archiver = OrderArchiver(mock_config, mock_logger)
+        date_from = datetime(2025, 1, 1)
+        pipeline = archiver.get_bulk_enrichment_pipeline(date_from=date_from)
+        
+        assert pipeline[0]['$match'] == {
+            'status': 'livrée',
+            'date_commande': {'$gte': date_from}
+        }
+        # Already archived orders are dropped before the enrichment stages
+        assert pipeline[1:4] == archiver.get_anti_join_stages()
+        assert pipeline[4:] == archiver.get_enrichment_pipeline("CMD-001")[1:]
+        
+        mock_config.prefilter_archived = False
+        pipeline = archiver.get_bulk_enrichment_pipeline(date_from=date_from)
+        assert pipeline[1:] == archiver.get_enrichment_pipeline("CMD-001")[1:]
+    
+    def test_archive_all_bulk_engine(self, mock_config, mock_logger):
+        """Test bulk engine streams one aggregation into batched inserts"""
+        archiver = OrderArchiver(mock_config, mock_logger)
+        archiver.db = MagicMock()
+        orders = [
+            {'numero_commande': f'CMD-{i:03d}', 'nom_client': 'Jean Dupont'}
+            for i in range(25)
+        ]
+        collection = archiver.db.__getitem__.return_value
+        mock_aggregate(collection, orders)
+        collection.count_documents.return_value = 29  # delivered, before the anti-join
+        collection.insert_many.side_effect = lambda docs, ordered: Mock(
+            inserted_ids=list(range(len(docs)))
+        )
+        
+        stats = archiver.archive_all(engine='bulk')
+        
+        assert collection.aggregate.call_count == 1  # no second anti-join for the count
+        match = archiver.get_bulk_enrichment_pipeline()[0]['$match']
+        collection.count_documents.assert_called_once_with(match)
+        assert collection.aggregate.call_args.kwargs['batchSize'] == \
+            mock_config.cursor_batch_size
+        assert collection.insert_many.call_count == 3  # 10 + 10 + 5
+        assert stats['found'] == 29
+        assert stats['archived'] == 25
+        assert stats['skipped'] == 4
+    
+    def test_get_merge_pipeline(self, mock_config, mock_logger):
+        """Test merge pipeline adds metadata and ends with $merge"""
+        archiver = OrderArchiver(mock_config, mock_logger)
+        run_id = ObjectId()
+        pipeline = archiver.get_merge_pipeline(run_id)
+        
+        merge = pipeline[-1]['$merge']
+        assert merge['into'] == mock_config.collection_historique
+        assert merge['on'] == 'numero_commande'
+        assert merge['whenMatched'] == 'keepExisting'
+        assert merge['whenNotMatched'] == 'insert'
+        
+        # Stamped after the merge, not by the pipeline
+        assert pipeline[-2]['$addFields'] == {'archive_run': run_id}
+        added = pipeline[-5]['$addFields']
+        assert 'date_archivage' not in added
+        assert added['archived_by'] == mock_config.get_archived_by_tag()
+        checked = [
+            cond['$cond'][1][0]
+            for cond in added['missing_fields']['$concatArrays']
+        ]
+        assert checked == archiver.REQUIRED_FIELDS
+    
+    def test_archive_all_merge_engine(self, mock_config, mock_logger):
+        """Test merge engine reports found/archived/duplicates/incomplete"""
+        archiver = OrderArchiver(mock_config, mock_logger)
+        archiver.db = MagicMock()
+        commande, historique = MagicMock(), MagicMock()
+        archiver.db.__getitem__.side_effect = lambda name: (
+            commande if name == mock_config.collection_commande else historique
+        )
+        commande.count_documents.return_value = 10
+        mock_aggregate(commande, [], skipped=2)
+        historique.count_documents.side_effect = [7, 2]  # archived, incomplete
+        
+        stats = archiver.archive_all(engine='merge')
+        
+        assert commande.aggregate.call_count == 1  # the $merge only
+        assert '$merge' in commande.aggregate.call_args.args[0][-1]
+        assert stats['found'] == 10
+        assert stats['skipped'] == 3
+        assert stats['archived'] == 7
+        assert stats['duplicates'] == 0
+        assert stats['incomplete'] == 2
+        
+        # Counted and stamped by the run marker written by the pipeline
+        run_id = commande.aggregate.call_args.args[0][-2]['$addFields']['archive_run']
+        assert historique.count_documents.call_args_list[0].args[0] == {'archive_run': run_id}
+        query, update = historique.update_many.call_args.args
+        assert query == {'archive_run': run_id}
+        assert update['$unset'] == {'archive_run': ''}
+        
+        # Dry runs have no merge output to derive the skipped count from
+        archiver = OrderArchiver(mock_config, mock_logger)
+        archiver.db = archiver_db = MagicMock()
+        archiver_db.__getitem__.side_effect = lambda name: commande
+        stats = archiver.archive_all(dry_run=True, engine='merge')
+        assert stats['skipped'] == 2
+        assert stats['archived'] == 8
+    
+    def test_archive_all_pipelined_engine(self, mock_config, mock_logger):
+        """Test pipelined engine flushes partial batches and merges writer stats"""
+        mock_config.writer_workers = 3
+        mock_config.queue_depth = 2
+        archiver = OrderArchiver(mock_config, mock_logger)
+        archiver.db = MagicMock()
+        orders = [{'numero_commande': f'CMD-{i:03d}'} for i in range(45)]
+        collection = archiver.db.__getitem__.return_value
+        mock_aggregate(collection, orders)
+        collection.count_documents.return_value = 49
+        
+        def insert_many(docs, ordered):
+            assert ordered is False
+            if docs[0]['numero_commande'] == 'CMD-000':
+                raise BulkWriteError({'writeErrors': [{'code': 11000}] * 2})
+            return Mock(inserted_ids=list(range(len(docs))))
+        collection.insert_many.side_effect = insert_many
+        
+        stats = archiver.archive_all(engine='pipelined')
+        
+        assert collection.insert_many.call_count == 5  # 4 x 10 + 5
+        assert stats['found'] == 49
+        assert stats['archived'] == 43
+        assert stats['duplicates'] == 2
+        assert stats['skipped'] == 4
+        assert stats['errors'] == 0
+    
+    def test_bulk_pipeline_after_checkpoint(self, mock_config, mock_logger):
+        """Test range pagination from a (date_commande, _id) checkpoint"""
+        archiver = OrderArchiver(mock_config, mock_logger)
+        after = {'date_commande': datetime(2025, 1, 2), '_id': ObjectId()}
+        pipeline = archiver.get_bulk_enrichment_pipeline(after=after)
+        
+        assert pipeline[0]['$match']['$or'] == [
+            {'date_commande': {'$gt': after['date_commande']}},
+            {'date_commande': after['date_commande'], '_id': {'$gt': after['_id']}}
+        ]
+        assert pipeline[1] == {'$sort': {'date_commande': 1, '_id': 1}}
+    
+    def test_bulk_pipeline_after_undated_checkpoint(self, mock_config, mock_logger):
+        """Test a checkpoint on an undated order still reaches the dated ones"""
+        archiver = OrderArchiver(mock_config, mock_logger)
+        after = {'date_commande': None, '_id': ObjectId()}
+        pipeline = archiver.get_bulk_enrichment_pipeline(after=after)
+        
+        assert pipeline[0]['$match']['$or'] == [
+            {'date_commande': None, '_id': {'$gt': after['_id']}},
+            {'date_commande': {'$ne': None}}
+        ]
+        assert pipeline[1] == {'$sort': {'date_commande': 1, '_id': 1}}
+    
+    def test_archive_all_bulk_resume(self, mock_config, mock_logger, tmp_path):
+        """Test bulk engine checkpoints each batch and resumes from it"""
+        mock_config.batch_checkpoint_file = str(tmp_path / 'checkpoint.json')
+        archiver = OrderArchiver(mock_config, mock_logger)
+        archiver.db = MagicMock()
+        orders = [
+            {
+                '_id': ObjectId(),
+                'numero_commande': f'CMD-{i:03d}',
+                'date_commande': datetime(2025, 1, 1, 12, i)
+            }
+            for i in range(15)
+        ]
+        
+        def stream():
+            yield from orders[:10]
+            raise OperationFailure("cursor killed")
+        collection = archiver.db.__getitem__.return_value
+        cursor = mock_aggregate(collection, orders)
+        cursor.__iter__.side_effect = stream
+        collection.count_documents.return_value = len(orders)
+        collection.insert_many.side_effect = lambda docs, ordered: Mock(
+            inserted_ids=list(range(len(docs)))
+        )
+        
+        # First run dies after one committed batch
+        archiver.archive_all(engine='bulk', resume=True)
+        checkpoint = archiver.load_checkpoint()
+        assert checkpoint['_id'] == orders[9]['_id']
+        hint = collection.aggregate.call_args.kwargs['hint']
+        assert list(hint.items()) == [('status', 1), ('date_commande', 1), ('_id', 1)]
+        
+        # Second run restarts after the checkpoint and clears it at the end
+        cursor.__iter__.side_effect = lambda: iter(orders[10:])
+        archiver.stats['errors'] = 0
+        archiver.archive_all(engine='bulk', resume=True)
+        match = collection.aggregate.call_args.args[0][0]['$match']
+        assert match['$or'][1]['_id'] == {'$gt': orders[9]['_id']}
+        assert archiver.load_checkpoint() is None
+    
+    def test_find_delivered_orders_prefilter(self, mock_config, mock_logger):
+        """Test already archived orders are removed before enrichment"""
+        archiver = OrderArchiver(mock_config, mock_logger)
+        archiver.db = MagicMock()
+        commande, historique = MagicMock(), MagicMock()
+        archiver.db.__getitem__.side_effect = lambda name: (
+            commande if name == mock_config.collection_commande else historique
+        )
+        commande.find.return_value = [
+            {'numero_commande': f'CMD-{i:03d}'} for i in range(15)
+        ]
+        historique.find.side_effect = [
+            [{'numero_commande': 'CMD-001'}, {'numero_commande': 'CMD-004'}],
+            [{'numero_commande': 'CMD-012'}]
+        ]
+        
+        order_numbers = archiver.find_delivered_orders()
+        
+        assert historique.find.call_count == 2  # chunks of batch_size
+        assert 'CMD-004' not in order_numbers
+        assert len(order_numbers) == 12
+        assert archiver.stats['found'] == 15
+        assert archiver.stats['skipped'] == 3
+    
+    def test_archive_all_unknown_engine(self, mock_config, mock_logger):
+        """Test archive_all rejects unknown engines"""
+        archiver = OrderArchiver(mock_config, mock_logger)
+        with pytest.raises(ValueError, match="engine"):
+            archiver.archive_all(engine='nope')
+    
     def test_check_completeness_complete(self, mock_config, mock_logger):
         """Test completeness check with complete order"""
         archiver = OrderArchiver(mock_config, mock_logger)
@@ -114,6 +381,225 @@ class TestOrderArchiver:
         assert 'Found:       100' in summary
         assert 'Archived:    95' in summary
         assert 'Duplicates:  3' in summary
+    
+    def test_purge_deletes_only_verified_orders(self, mock_config, mock_logger):
+        """Test purge pages Commande by _id and deletes orders found in Historique"""
+        mock_config.purge_batch_size = 2
+        archiver = OrderArchiver(mock_config, mock_logger)
+        archiver.db = MagicMock()
+        commande, historique = MagicMock(), MagicMock()
+        archiver.db.__getitem__.side_effect = lambda name: (
+            commande if name == mock_config.collection_commande else historique
+        )
+        ids = [ObjectId() for _ in range(3)]
+        pages = [
+            [{'_id': ids[0], 'numero_commande': 'CMD-1'}, {'_id': ids[1], 'numero_commande': 'CMD-2'}],
+            [{'_id': ids[2], 'numero_commande': 'CMD-3'}],
+            [],
+        ]
+        commande.find.return_value.sort.return_value.hint.return_value.limit.side_effect = pages
+        historique.find.side_effect = [
+            iter([{'numero_commande': 'CMD-1'}]),
+            iter([{'numero_commande': 'CMD-3'}]),
+        ]
+        commande.delete_many.side_effect = lambda query: Mock(deleted_count=len(query['_id']['$in']))
+        
+        assert archiver.purge_archived() == 2
+        
+        deleted = [c.args[0]['_id']['$in'] for c in commande.delete_many.call_args_list]
+        assert deleted == [[ids[0]], [ids[2]]]
+        assert commande.delete_many.call_args.args[0]['status'] == 'livrée'
+        assert commande.find.call_args_list[1].args[0]['_id'] == {'$gt': ids[1]}
+        assert archiver.stats['purged'] == 2
+    
+    def test_purge_dry_run(self, mock_config, mock_logger):
+        """Test dry-run purge reports verified orders without deleting"""
+        archiver = OrderArchiver(mock_config, mock_logger)
+        archiver.db = MagicMock()
+        commande, historique = MagicMock(), MagicMock()
+        archiver.db.__getitem__.side_effect = lambda name: (
+            commande if name == mock_config.collection_commande else historique
+        )
+        commande.find.return_value.sort.return_value.hint.return_value.limit.side_effect = [
+            [{'_id': ObjectId(), 'numero_commande': 'CMD-1'}], []
+        ]
+        historique.find.return_value = iter([{'numero_commande': 'CMD-1'}])
+        
+        assert archiver.purge_archived(dry_run=True) == 1
+        commande.delete_many.assert_not_called()
+
+
+class TestAsyncOrderArchiver:
+    """Tests for the asyncio archiving engine"""
+    
+    def test_bounded_fan_out_and_batched_inserts(self, mock_config, mock_logger):
+        """Test enrichment stays under the concurrency limit and inserts full batches"""
+        mock_config.batch_size = 4
+        mock_config.async_concurrency = 3
+        mock_config.prefilter_archived = False
+        archiver = AsyncOrderArchiver(mock_config, mock_logger)
+        archiver.db = MagicMock()
+        numeros = [f'CMD-{i}' for i in range(10)]
+        archiver.db.__getitem__.return_value.find.return_value = [
+            {'numero_commande': n} for n in numeros
+        ]
+        
+        in_flight = {'now': 0, 'max': 0}
+        
+        async def aggregate(pipeline):
+            in_flight['now'] += 1
+            in_flight['max'] = max(in_flight['max'], in_flight['now'])
+            await asyncio.sleep(0.001)
+            in_flight['now'] -= 1
+            cursor = Mock()
+            cursor.to_list = AsyncMock(return_value=[{
+                'numero_commande': pipeline[0]['$match']['numero_commande'],
+                'nom_client': 'A', 'nom_livreur': 'B', 'nom_restaurant': 'C',
+                'nom_menu': 'D', 'coût_commande': 10
+            }])
+            return cursor
+        
+        async_db = MagicMock()
+        async_db.__getitem__.return_value.aggregate = aggregate
+        async_db.__getitem__.return_value.insert_many = AsyncMock(
+            side_effect=lambda orders, ordered: Mock(inserted_ids=[o['numero_commande'] for o in orders])
+        )
+        
+        async def connect_async():
+            archiver.async_client = Mock(close=AsyncMock())
+            archiver.async_db = async_db
+        
+        with patch.object(archiver, 'connect_async', side_effect=connect_async):
+            stats = archiver.archive_all(purge=False)
+        
+        assert stats['archived'] == 10
+        assert in_flight['max'] == 3
+        inserted = [
+            o['numero_commande']
+            for c in async_db.__getitem__.return_value.insert_many.call_args_list
+            for o in c.args[0]
+        ]
+        assert sorted(inserted) == sorted(numeros)
+        assert all(len(c.args[0]) <= 4 for c in async_db.__getitem__.return_value.insert_many.call_args_list)
+    
+    def test_write_errors_and_failed_connect(self, mock_config, mock_logger):
+        """Test write errors are counted like the sync engine, a failed ping closes the client"""
+        archiver = AsyncOrderArchiver(mock_config, mock_logger)
+        archiver.async_db = MagicMock()
+        archiver.async_db.__getitem__.return_value.insert_many = AsyncMock(
+            side_effect=BulkWriteError({'writeErrors': [
+                {'index': 0, 'code': 11000}, {'index': 1, 'code': 121}
+            ]})
+        )
+        orders = [{'numero_commande': f'CMD-{i}'} for i in range(3)]
+        
+        assert asyncio.run(archiver.archive_orders_batch_async(orders)) == 1
+        assert archiver.stats['duplicates'] == 1 and archiver.stats['errors'] == 1
+        
+        archiver.find_delivered_orders = Mock(return_value=['CMD-1'])
+        client = Mock(close=AsyncMock())
+        
+        async def connect_async():
+            archiver.async_client = client
+            raise OperationFailure("ping failed")
+        
+        with patch.object(archiver, 'connect_async', side_effect=connect_async):
+            with pytest.raises(OperationFailure):
+                archiver.archive_all(purge=False)
+        client.close.assert_awaited_once()
+        assert archiver.async_client is None
+
+
+class TestDimensionCache:
+    """Tests for the client-side enrichment engine"""
+    
+    def test_lru_eviction_and_ttl(self):
+        """Test least recently used eviction, TTL expiry and invalidation"""
+        loads = []
+        cache = DimensionCache(
+            lambda key: loads.append(key) or {'_id': key, 'id': key},
+            max_size=2, ttl=60
+        )
+        cache.get('A')
+        cache.get('B')
+        cache.get('A')  # hit, A becomes most recent
+        cache.get('C')  # evicts B
+        assert loads == ['A', 'B', 'C']
+        assert cache.stats['evictions'] == 1
+        
+        cache.get('B')
+        assert loads[-1] == 'B'
+        
+        cache.invalidate(doc_id='B')
+        cache.get('B')
+        assert loads.count('B') == 3
+        
+        cache.ttl = 0
+        cache.get('B')
+        assert loads.count('B') == 4
+    
+    def test_enrich_matches_pipeline_output(self, mock_config, mock_logger):
+        """Test enrich reproduces the $project output and field order"""
+        db = MagicMock()
+        dims = {
+            mock_config.collection_client: {'id_client': 'CLI-1', 'Prénom': 'Jean', 'Nom': 'Dupont', 'Email': 'j@d.fr'},
+            mock_config.collection_livreur: {'id_livreur': 'LIV-1', 'Prénom': 'Alice', 'Nom': 'Martin'},
+            mock_config.collection_restaurants: {'id_restaurant': 'RES-1', 'name': 'Le Bistrot'},
+            mock_config.collection_menu: None,
+        }
+        db.__getitem__.side_effect = lambda name: Mock(
+            find_one=Mock(return_value=dims[name])
+        )
+        enricher = ClientSideEnricher(mock_config, db, mock_logger)
+        order = {
+            '_id': 1, 'numero_commande': 'CMD-001', 'id_client': 'CLI-1',
+            'id_livreur': 'LIV-1', 'id_restaurant': 'RES-1', 'id_menu': 'MEN-9',
+            'Produit': None, 'coût_commande': 15.5, 'status': 'livrée'
+        }
+        
+        enriched = enricher.enrich(order)
+        
+        assert list(enriched.items()) == [
+            ('_id', 1),
+            ('numero_commande', 'CMD-001'),
+            ('coût_commande', 15.5),
+            ('status', 'livrée'),
+            ('nom_client', 'Jean Dupont'),
+            ('email_client', 'j@d.fr'),
+            ('nom_livreur', 'Alice Martin'),
+            ('nom_restaurant', 'Le Bistrot'),
+            # Missing menu: "$menu" is missing, not null, so $cond takes the
+            # "then" branch and "$menu.name" adds no field
+            ('prix_menu', 0),
+        ]
+    
+    def test_archive_all_cached_engine(self, mock_config, mock_logger):
+        """Test cached engine enriches a plain find without aggregations"""
+        mock_config.dimension_cache_watch = False
+        archiver = OrderArchiver(mock_config, mock_logger)
+        archiver.db = MagicMock()
+        collection = archiver.db.__getitem__.return_value
+        orders = [
+            {'numero_commande': f'CMD-{i:03d}', 'id_client': 'CLI-1'}
+            for i in range(12)
+        ]
+        cursor = MagicMock()
+        cursor.__enter__.return_value = cursor
+        cursor.__iter__.return_value = iter(orders)
+        collection.find.side_effect = lambda query, *args, **kwargs: (
+            cursor if 'status' in query else []
+        )
+        collection.find_one.return_value = {'id_client': 'CLI-1', 'Nom': 'Dupont'}
+        collection.insert_many.side_effect = lambda docs, ordered: Mock(
+            inserted_ids=list(range(len(docs)))
+        )
+        
+        stats = archiver.archive_all(engine='cached')
+        
+        assert collection.aggregate.call_count == 0
+        assert collection.insert_many.call_count == 2
+        assert stats['found'] == 12
+        assert stats['archived'] == 12
 
 
 class TestOrderWatcher:
@@ -184,6 +670,1069 @@ class TestOrderWatcher:
         assert watcher.should_archive(change) is False
 
 
+    def test_micro_batch_flush_on_size(self, mock_config, mock_logger, tmp_path):
+        """Test buffered events are enriched with one $in and one bulk insert"""
+        mock_config.watch_batch_size = 3
+        mock_config.watch_flush_interval_ms = 60000
+        mock_config.watch_resume_token_file = str(tmp_path / 'token.json')
+        watcher = OrderWatcher(mock_config, mock_logger)
+        watcher.archiver.db = MagicMock()
+        collection = watcher.archiver.db.__getitem__.return_value
+        collection.aggregate.side_effect = lambda pipeline: iter([
+            {'numero_commande': n} for n in pipeline[0]['$match']['numero_commande']['$in']
+        ])
+        collection.insert_many.side_effect = lambda docs, ordered: Mock(
+            inserted_ids=list(range(len(docs)))
+        )
+        
+        for i in range(3):
+            assert watcher.should_flush() is False
+            watcher.buffer_change({
+                'operationType': 'update',
+                'fullDocument': {'numero_commande': f'CMD-{i}', 'status': 'livrée'}
+            })
+        assert watcher.should_flush() is True
+        
+        assert watcher.commit({'_data': 'token-1'}) is True
+        assert collection.aggregate.call_count == 1
+        assert collection.insert_many.call_count == 1
+        assert watcher.archiver.stats['archived'] == 3
+        assert watcher.pending == []
+        assert watcher.load_resume_token() == {'_data': 'token-1'}
+    
+    def test_micro_batch_token_not_saved_on_failure(self, mock_config, mock_logger, tmp_path):
+        """Test the resume token only advances once the batch is committed"""
+        mock_config.watch_resume_token_file = str(tmp_path / 'token.json')
+        watcher = OrderWatcher(mock_config, mock_logger)
+        watcher.archiver.db = MagicMock()
+        collection = watcher.archiver.db.__getitem__.return_value
+        collection.aggregate.return_value = iter([{'numero_commande': 'CMD-1'}])
+        collection.insert_many.side_effect = OperationFailure("not primary")
+        
+        watcher.buffer_change({
+            'operationType': 'insert',
+            'fullDocument': {'numero_commande': 'CMD-1', 'status': 'livrée'}
+        })
+        
+        assert watcher.commit({'_data': 'token-1'}) is False
+        assert watcher.pending == ['CMD-1']
+        assert watcher.load_resume_token() is None
+
+    def test_micro_batch_dead_letters_after_max_replays(self, mock_config, mock_logger, tmp_path):
+        """Test an order that keeps failing is dead-lettered and the token advances"""
+        mock_config.watch_max_replays = 2
+        mock_config.watch_resume_token_file = str(tmp_path / 'token.json')
+        watcher = OrderWatcher(mock_config, mock_logger)
+        collections = {}
+        watcher.archiver.db = MagicMock()
+        watcher.archiver.db.__getitem__.side_effect = (
+            lambda name: collections.setdefault(name, MagicMock())
+        )
+        commande = watcher.archiver.db[mock_config.collection_commande]
+        commande.aggregate.side_effect = lambda pipeline: iter([
+            {'numero_commande': n} for n in pipeline[0]['$match']['numero_commande']['$in']
+        ])
+
+        def insert_many(docs, ordered):
+            rejected = [
+                {'index': i, 'code': 121} for i, doc in enumerate(docs)
+                if doc['numero_commande'] == 'CMD-BAD'
+            ]
+            if rejected:
+                raise BulkWriteError({'writeErrors': rejected})
+            return Mock(inserted_ids=list(range(len(docs))))
+
+        historique = watcher.archiver.db[mock_config.collection_historique]
+        historique.insert_many.side_effect = insert_many
+
+        def replay():
+            watcher.clear_pending()
+            for numero in ('CMD-BAD', 'CMD-OK'):
+                watcher.buffer_change({
+                    'operationType': 'insert',
+                    'fullDocument': {'numero_commande': numero, 'status': 'livrée'}
+                })
+            return watcher.commit({'_data': 'token-1'})
+
+        assert replay() is False
+        assert replay() is False
+        assert watcher.load_resume_token() is None
+
+        assert replay() is True
+        assert watcher.replays == 0
+        assert watcher.load_resume_token() == {'_data': 'token-1'}
+        dead_letters = collections[mock_config.watch_dead_letter_collection]
+        letter = dead_letters.insert_many.call_args.args[0][0]
+        assert letter['numero_commande'] == 'CMD-BAD'
+        assert letter['attempts'] == 3
+        assert watcher.archiver.stats['errors'] == 3
+
+    def test_lean_stream_options(self, mock_config, mock_logger):
+        """Test lean mode projects events and drops the updateLookup"""
+        mock_config.watch_stream_mode = 'lean'
+        mock_config.watch_partitions = 2
+        watcher = OrderWatcher(mock_config, mock_logger)
+        
+        options = watcher.get_watch_options()
+        assert 'full_document' not in options
+        assert options['pipeline'][-1] == {'$project': OrderWatcher.LEAN_PROJECTION}
+        expr = options['pipeline'][1]['$match']['$expr']['$eq']
+        assert expr[0]['$abs']['$mod'][0] == {'$toHashedIndexKey': '$documentKey._id'}
+        
+        mock_config.watch_stream_mode = 'full'
+        assert OrderWatcher(mock_config, mock_logger).get_watch_options()['full_document'] == 'updateLookup'
+    
+    def test_lean_events_fetched_by_id(self, mock_config, mock_logger, tmp_path):
+        """Test lean update events are enriched by _id in the batch aggregation"""
+        mock_config.watch_stream_mode = 'lean'
+        mock_config.watch_resume_token_file = str(tmp_path / 'token.json')
+        watcher = OrderWatcher(mock_config, mock_logger)
+        watcher.archiver.db = MagicMock()
+        collection = watcher.archiver.db.__getitem__.return_value
+        order_id = ObjectId()
+        collection.aggregate.return_value = iter([
+            {'_id': ObjectId(), 'numero_commande': 'CMD-1'},
+            {'_id': order_id, 'numero_commande': 'CMD-2'},
+        ])
+        collection.insert_many.side_effect = lambda docs, ordered: Mock(
+            inserted_ids=list(range(len(docs)))
+        )
+        
+        watcher.buffer_change({
+            'operationType': 'insert',
+            'fullDocument': {'numero_commande': 'CMD-1', 'status': 'livrée'}
+        })
+        watcher.buffer_change({
+            'operationType': 'update',
+            'documentKey': {'_id': order_id},
+            'updateDescription': {'updatedFields': {'status': 'livrée'}}
+        })
+        assert watcher.pending == ['CMD-1']
+        assert watcher.pending_ids == [order_id]
+        
+        assert watcher.commit({'_data': 'token-1'}) is True
+        match = collection.aggregate.call_args.args[0][0]['$match']
+        assert match == {'$or': [
+            {'numero_commande': {'$in': ['CMD-1']}},
+            {'_id': {'$in': [order_id]}}
+        ]}
+        assert watcher.archiver.stats['archived'] == 2
+        assert watcher.archiver.stats['errors'] == 0
+        assert watcher.has_pending() is False
+
+
+class TestPartitionedWatchers:
+    """Tests for partitioned watchers"""
+    
+    def test_partition_filter_and_token_file(self, mock_config, mock_logger):
+        """Test each partition matches its hash bucket and owns its token"""
+        mock_config.watch_partitions = 4
+        mock_config.watch_partition_id = 2
+        watcher = OrderWatcher(mock_config, mock_logger)
+        
+        expr = watcher.get_partition_filter()['$match']['$expr']['$eq']
+        assert expr[1] == 2
+        assert expr[0]['$abs']['$mod'][1] == 4
+        assert expr[0]['$abs']['$mod'][0] == {
+            '$toHashedIndexKey': '$fullDocument.numero_commande'
+        }
+        assert watcher.resume_token_file.name == '.resume_token.p2of4.json'
+    
+    def test_partition_filter_precomputed_field(self, mock_config, mock_logger):
+        """Test partitioning on a precomputed shard key"""
+        mock_config.watch_partitions = 3
+        mock_config.watch_partition_field = 'shard_key'
+        watcher = OrderWatcher(mock_config, mock_logger)
+        
+        expr = watcher.get_partition_filter()['$match']['$expr']['$eq']
+        assert expr[0]['$abs']['$mod'] == ['$fullDocument.shard_key', 3]
+    
+    def test_not_partitioned(self, mock_config, mock_logger):
+        """Test a single watcher keeps the historical token file"""
+        watcher = OrderWatcher(mock_config, mock_logger)
+        assert watcher.get_partition_filter() is None
+        assert str(watcher.resume_token_file) == mock_config.watch_resume_token_file
+    
+    def test_supervisor_restarts_crashed_worker(self, mock_logger):
+        """Test a crashed worker is restarted with its partition id"""
+        supervisor = WatcherSupervisor(2, ['watch', '--partitions', '2'], mock_logger)
+        with patch('supervisor.subprocess.Popen') as popen:
+            popen.return_value.poll.return_value = None
+            supervisor.check_workers()
+            assert popen.call_count == 2
+            assert popen.call_args.args[0][-2:] == ['--partition-id', '1']
+            
+            supervisor.processes[0].poll.return_value = 1
+            supervisor.processes[1] = Mock(poll=Mock(return_value=None))
+            supervisor.check_workers()  # crash detected, restart scheduled
+            supervisor.next_start[0] = 0
+            supervisor.check_workers()
+            
+            assert popen.call_count == 3
+            assert popen.call_args.args[0][-2:] == ['--partition-id', '0']
+            assert supervisor.restarts == 1
+
+
+class TestMetrics:
+    """Tests for the live metrics endpoint"""
+    
+    def test_registry_renders_prometheus_text(self, mock_logger):
+        """Test stats counters, histogram buckets and gauges over HTTP"""
+        registry = MetricsRegistry()
+        stats = {'archived': 0, 'errors': 0}
+        registry.register_stats('archiver', stats)
+        histogram = registry.histogram('archiver_insert_seconds', 'Insert latency', buckets=(0.01, 0.1))
+        registry.gauge('archiver_queue_depth', 'Queue depth').set_function(lambda: 3)
+        
+        stats['archived'] += 5
+        histogram.observe(0.005)
+        histogram.observe(0.05)
+        histogram.observe(2)
+        assert registry.histogram('archiver_insert_seconds', 'Insert latency') is histogram
+        
+        server = MetricsServer(registry, port=0, logger=mock_logger)
+        server.start()
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics') as response:
+                body = response.read().decode()
+        finally:
+            server.close()
+        
+        assert '# TYPE archiver_archived_total counter\narchiver_archived_total 5' in body
+        assert 'archiver_insert_seconds_bucket{le="0.01"} 1' in body
+        assert 'archiver_insert_seconds_bucket{le="0.1"} 2' in body
+        assert 'archiver_insert_seconds_bucket{le="+Inf"} 3' in body
+        assert 'archiver_insert_seconds_count 3' in body
+        assert 'archiver_queue_depth 3' in body
+    
+    def test_watcher_event_lag_and_pending(self, mock_config, mock_logger, tmp_path):
+        """Test the lag from wallTime is observed once the micro-batch commits"""
+        mock_config.watch_resume_token_file = str(tmp_path / 'token.json')
+        watcher = OrderWatcher(mock_config, mock_logger)
+        watcher.archiver.db = MagicMock()
+        collection = watcher.archiver.db.__getitem__.return_value
+        collection.aggregate.return_value = iter([{'numero_commande': 'CMD-1'}])
+        collection.insert_many.return_value = Mock(inserted_ids=[1])
+        
+        watcher.buffer_change({
+            'operationType': 'update',
+            'wallTime': datetime.utcnow(),
+            'fullDocument': {'numero_commande': 'CMD-1', 'status': 'livrée'}
+        })
+        assert 'watcher_pending_orders 1' in watcher.archiver.metrics.render()
+        
+        assert watcher.commit({'_data': 'token-1'}) is True
+        assert watcher.event_lag.count == 1
+        assert watcher.archiver.insert_latency.count == 1
+        assert watcher.archiver.batch_enrichment_latency.count == 1
+        assert 'watcher_pending_orders 0' in watcher.archiver.metrics.render()
+
+
+class TestLogging:
+    """Tests for queued, JSON and sampled logging"""
+    
+    def test_queue_handler_writes_json_lines(self, tmp_path):
+        """Test records reach the file from the listener thread as JSON objects"""
+        log_file = tmp_path / 'queued.log'
+        logger = setup_logger('test_queued_json', str(log_file), use_queue=True, json_lines=True)
+        assert isinstance(logger.handlers[0], DroppingQueueHandler)
+        
+        logger.info("🔔 Change detected: %s on order %s", 'update', 'CMD-1')
+        shutdown_logging()
+        
+        entry = json.loads(log_file.read_text(encoding='utf-8').splitlines()[0])
+        assert entry['message'] == "🔔 Change detected: update on order CMD-1"
+        assert entry['level'] == 'INFO' and entry['logger'] == 'test_queued_json'
+    
+    def test_sampling_and_full_queue(self):
+        """Test 1 in N records per template are kept and a full queue drops records"""
+        assert parse_sampling('INFO:3, debug:10') == {logging.INFO: 3, logging.DEBUG: 10}
+        with pytest.raises(ValueError):
+            parse_sampling('INFO')
+        
+        sampling = SamplingFilter({logging.INFO: 3})
+        def record(msg, level=logging.INFO):
+            return logging.LogRecord('t', level, __file__, 1, msg, ('x',), None)
+        kept = [sampling.filter(record("🔔 %s")) for _ in range(7)]
+        assert kept == [True, False, False, True, False, False, True]
+        assert sampling.filter(record("✅ rare %s")) is True
+        assert all(sampling.filter(record("⚠️ %s", logging.WARNING)) for _ in range(5))
+        
+        # Counters are capped (LRU): the oldest template is forgotten
+        capped = SamplingFilter({logging.INFO: 3}, max_templates=2)
+        for msg in ("a %s", "b %s", "a %s", "c %s"):
+            capped.filter(record(msg))
+        assert list(capped.seen) == [(logging.INFO, "a %s"), (logging.INFO, "c %s")]
+        
+        handler = DroppingQueueHandler(queue.Queue(maxsize=2))
+        args = ['CMD-1']
+        handler.emit(logging.LogRecord('t', logging.INFO, __file__, 1, "first %s", (args,), None))
+        args.append('CMD-2')  # mutated after the call, before the listener runs
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            handler.emit(logging.LogRecord('t', logging.ERROR, __file__, 1, "second", None, sys.exc_info()))
+        handler.emit(record("third %s"))
+        assert handler.dropped == 1
+        
+        first = handler.queue.get_nowait()
+        assert (first.msg, first.args) == ("first ['CMD-1']", None)  # merged by the caller
+        second = handler.queue.get_nowait()
+        assert second.exc_info is None and 'ValueError: boom' in second.exc_text
+        assert 'ValueError: boom' in logging.Formatter().format(second)
+
+
+class TestConnectionPool:
+    """Tests for the shared connection factory"""
+    
+    def test_client_shared_per_settings_and_released(self, mock_config):
+        """Test one client per URI and pool settings, closed with its last user"""
+        mock_config.mongo_max_pool_size = 20
+        mock_config.mongo_write_concern = 'majority'
+        mock_config.mongo_compressors = 'zstd,lz77,zlib'
+        
+        with patch('connection.MongoClient') as client_cls:
+            client_cls.side_effect = lambda *args, **kwargs: MagicMock()
+            first = connection.get_client(mock_config)
+            second = connection.get_client(mock_config)
+            assert first is second
+            
+            options = client_cls.call_args.kwargs
+            assert options['maxPoolSize'] == 20 and options['w'] == 'majority'
+            assert options['appname'] == 'mongodb_archiver'
+            assert 'zlib' in options['compressors'] and 'lz77' not in options['compressors']
+            
+            mock_config.mongo_max_pool_size = 5
+            assert connection.get_client(mock_config) is not first
+            
+            connection.release_client(first)
+            first.close.assert_not_called()
+            connection.release_client(second)
+            first.close.assert_called_once()
+    
+    def test_pool_stats_from_events(self, mock_config):
+        """Test pool events are turned into per-server utilisation"""
+        with patch('connection.MongoClient') as client_cls:
+            client = connection.get_client(mock_config)
+            listener = client_cls.call_args.kwargs['event_listeners'][0]
+            event = Mock(address=('db', 27017))
+            for _ in range(3):
+                listener.connection_created(event)
+                listener.connection_check_out_started(event)
+                listener.connection_checked_out(event)
+            listener.connection_checked_in(event)
+            listener.connection_check_out_started(event)
+            
+            stats = [s for s in connection.pool_stats() if s['address'] == 'db:27017']
+            connection.release_client(client)
+        
+        assert stats[0]['open'] == 3 and stats[0]['in_use'] == 2
+        assert stats[0]['peak_in_use'] == 3 and stats[0]['waiting'] == 1
+        assert stats[0]['utilisation'] == 2 / mock_config.mongo_max_pool_size
+
+
+class TestIndexManager:
+    """Tests for declared index reconciliation and explain checks"""
+    
+    def test_reconcile_is_idempotent(self, mock_config):
+        """Test missing indexes are created, drifted and undeclared only reported"""
+        existing = {
+            'Commande': [
+                {'name': '_id_', 'key': {'_id': 1}},
+                {'name': 'idx_status', 'key': {'status': 1}},
+                {'name': 'idx_date_commande', 'key': {'date_commande': 1}},
+            ],
+            'Historique': [
+                # Declared unique
+                {'name': 'idx_numero_commande_unique', 'key': {'numero_commande': 1}},
+            ],
+        }
+        db = MagicMock()
+        db.__getitem__.side_effect = lambda name: collections.setdefault(name, MagicMock())
+        collections = {}
+        for name, indexes in existing.items():
+            collections[name] = MagicMock()
+            collections[name].list_indexes.return_value = indexes
+        
+        report = IndexManager(mock_config, db, Mock()).reconcile()
+        
+        assert 'Commande.idx_date_commande' in report.unchanged
+        assert 'Commande.idx_status' in report.extra
+        assert 'Historique.idx_numero_commande_unique' in report.drifted
+        assert report.rebuilt == []
+        assert 'Commande.idx_status_date_commande' in report.created
+        assert 'Livreur.idx_location_2dsphere_statut' in report.created
+        collections['Historique'].drop_index.assert_not_called()
+        collections['Commande'].drop_index.assert_not_called()
+        
+        IndexManager(mock_config, db, Mock()).reconcile(prune=True)
+        collections['Commande'].drop_index.assert_called_once_with('idx_status')
+        
+        # The unique index is never dropped by a plain rebuild
+        report = IndexManager(mock_config, db, Mock()).reconcile(rebuild=True)
+        assert 'Historique.idx_numero_commande_unique' in report.drifted
+        collections['Historique'].drop_index.assert_not_called()
+        
+        report = IndexManager(mock_config, db, Mock()).reconcile(rebuild_unique=True)
+        assert 'Historique.idx_numero_commande_unique' in report.rebuilt
+        collections['Historique'].drop_index.assert_called_once_with('idx_numero_commande_unique')
+        collections['Historique'].create_index.assert_any_call(
+            [('numero_commande', 1)], name='idx_numero_commande_unique', unique=True
+        )
+    
+    def test_analyze_explain_flags_scans(self):
+        """Test COLLSCAN, in-memory sort and examined ratio are reported"""
+        explain = {
+            'queryPlanner': {'winningPlan': {'queryPlan': {
+                'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}
+            }}},
+            'executionStats': {'nReturned': 5, 'totalDocsExamined': 5000,
+                               'totalKeysExamined': 0, 'executionTimeMillis': 12},
+        }
+        summary = analyze_explain(explain, slow_ms=100, max_ratio=10)
+        assert summary['stages'] == ['SORT', 'COLLSCAN']
+        assert summary['problems'][:2] == ['collection scan', 'in-memory sort']
+        assert len(summary['problems']) == 3
+        
+        indexed = {'stages': [{'$cursor': {
+            'queryPlanner': {'winningPlan': {
+                'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}
+            }},
+            'executionStats': {'nReturned': 5, 'totalDocsExamined': 5,
+                               'executionTimeMillis': 1},
+        }}]}
+        assert analyze_explain(indexed, slow_ms=100, max_ratio=10)['problems'] == []
+
+
+class TestBoundedExecutor:
+    """Tests for the platform's bounded worker pool"""
+    
+    def test_backpressure_and_metrics(self):
+        """Test a full queue rejects, tasks run on max_workers threads"""
+        release = threading.Event()
+        running = []
+        registry = MetricsRegistry()
+        executor = BoundedExecutor(2, 1, registry, 'orders', Mock())
+        executor.start()
+        
+        def task(n):
+            running.append(n)
+            release.wait(5)
+        
+        for n in range(3):
+            assert executor.submit(task, n, timeout=1)
+        deadline = time.time() + 2
+        while len(running) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        
+        # 2 running, 1 queued: no room left
+        assert executor.submit(task, 3, timeout=0.05) is False
+        assert executor.in_flight == 2 and executor.queue.qsize() == 1
+        text = registry.render()
+        assert 'orders_in_flight 2' in text and 'orders_queued 1' in text
+        
+        release.set()
+        executor.shutdown(wait=True)
+        stats = executor.get_stats()
+        assert stats['completed'] == 3 and stats['rejected'] == 1
+        assert executor.queue_wait.count == 3 and sorted(running) == [0, 1, 2]
+    
+    def test_failed_task_and_cancel_pending(self):
+        """Test a raising task is counted, pending tasks can be dropped"""
+        idle = BoundedExecutor(1, 10, prefix='idle', logger=Mock())
+        for delay in range(3):
+            idle.submit(time.sleep, delay)
+        # Never started: every task is still queued, handed back with its arguments
+        assert idle.shutdown(wait=False, cancel_pending=True) == [(0,), (1,), (2,)]
+        
+        executor = BoundedExecutor(1, 10, prefix='jobs', logger=Mock())
+        executor.submit(lambda: 1 / 0)
+        executor.submit(time.sleep, 0)
+        executor.start()
+        executor.shutdown(wait=True)
+        assert executor.stats['failed'] == 1 and executor.stats['completed'] == 1
+
+
+class TestResponseRouter:
+    """Tests for the shared restaurant/livreur response stream"""
+    
+    def test_first_acceptance_or_all_rejections(self):
+        """Test responses are routed by (numero_commande, id) to their waiter"""
+        router = ResponseRouter(MagicMock(), 'id_livreur', Mock())
+        waiter = router.expect('CMD-1', ['L1', 'L2', 'L3'])
+        other = router.expect('CMD-2', ['L1'])
+        
+        router.dispatch({'numero_commande': 'CMD-1', 'id_livreur': 'L1', 'status': 'rejected'})
+        assert not waiter.event.is_set()
+        router.dispatch({'numero_commande': 'CMD-1', 'id_livreur': 'L2', 'status': 'accepted'})
+        router.dispatch({'numero_commande': 'CMD-9', 'id_livreur': 'L2', 'status': 'accepted'})
+        assert router.wait(waiter, timeout=1)['id_livreur'] == 'L2'
+        assert router.stats['unmatched'] == 1 and router.waiting == 1
+        
+        router.withdraw(other, 'L1')
+        assert router.wait(other, timeout=0) is None and router.waiting == 0
+        
+        refused = router.expect('CMD-3', ['L1', 'L2'])
+        for livreur in ('L1', 'L2'):
+            router.dispatch({'numero_commande': 'CMD-3', 'id_livreur': livreur, 'status': 'rejected'})
+        assert router.wait(refused, timeout=1)['status'] == 'rejected'
+        
+        # The others refused before the failed request was withdrawn
+        late = router.expect('CMD-4', ['L1', 'L2', 'L3'])
+        for livreur in ('L1', 'L2'):
+            router.dispatch({'numero_commande': 'CMD-4', 'id_livreur': livreur, 'status': 'rejected'})
+        assert not late.event.is_set()
+        router.withdraw(late, 'L3')
+        assert late.event.is_set()
+        assert router.wait(late, timeout=0)['id_livreur'] == 'L2'
+    
+    def test_single_stream_dispatches_to_waiters(self):
+        """Test one change stream thread wakes the waiting order without polling"""
+        change = {'fullDocument': {'numero_commande': 'CMD-1', 'id_restaurant': 'R1',
+                                   'status': 'accepted'}}
+        stream = MagicMock(alive=True, resume_token={'_data': '01'})
+        collection = MagicMock()
+        collection.name = 'RestaurantRequests'
+        collection.watch.return_value.__enter__.return_value = stream
+        
+        router = ResponseRouter(collection, 'id_restaurant', Mock(), max_await_time_ms=10)
+        waiter = router.expect('CMD-1', ['R1'])
+        responses = iter([None, change])
+        
+        def try_next():
+            try:
+                return next(responses)
+            except StopIteration:
+                time.sleep(0.01)
+                return None
+        
+        stream.try_next.side_effect = try_next
+        router.start()
+        assert router.ready.wait(2)
+        
+        assert router.wait(waiter, timeout=2)['status'] == 'accepted'
+        router.stop()
+        assert collection.watch.call_count == 1
+        assert router.resume_token == {'_data': '01'}
+
+
+class TestAsyncOrchestrator:
+    """Tests for the asyncio order state machines"""
+    
+    @staticmethod
+    def make_db(livreurs):
+        db = MagicMock()
+        for name in ('Commande', 'RestaurantRequests', 'DeliveryRequests', 'Livreur',
+                     'Metrics', 'Notifications', 'Refunds'):
+            collection = getattr(db, name)
+            collection.insert_one = AsyncMock()
+            collection.insert_many = AsyncMock()
+            collection.update_one = AsyncMock(return_value=Mock(matched_count=1))
+            collection.update_many = AsyncMock(return_value=Mock(modified_count=0))
+            collection.find_one = AsyncMock(return_value=None)
+            collection.find_one_and_update = AsyncMock(return_value=None)
+        db.Livreur.find.return_value.limit.return_value.to_list = AsyncMock(return_value=livreurs)
+        db.Livreur.find_one_and_update.side_effect = (
+            lambda query, update, **kwargs: {'id_livreur': query['id_livreur'], 'prenom': 'Ali'}
+        )
+        
+        async def with_transaction(callback):
+            return await callback(session)
+        
+        session = MagicMock()
+        session.__aenter__ = AsyncMock(return_value=session)
+        session.__aexit__ = AsyncMock(return_value=False)
+        session.with_transaction = AsyncMock(side_effect=with_transaction)
+        session.abort_transaction = AsyncMock()
+        db.client.start_session.return_value = session
+        return db
+    
+    def test_order_flow_to_assignment(self):
+        """Test restaurant acceptance, one refusal, then the first acceptance wins"""
+        db = self.make_db([{'id_livreur': 'L1'}, {'id_livreur': 'L2'}])
+        
+        async def scenario():
+            platform = AsyncOrchestrator(db, Mock())
+            await platform.on_new_order({'numero_commande': 'CMD-1', 'id_restaurant': 'R1',
+                                         'id_client': 'C1', 'prix_total': 20.0})
+            await asyncio.gather(*platform.tasks)
+            flow = platform.flows['CMD-1']
+            assert flow.state == orchestrator.RESTAURANT_PENDING
+            
+            await platform.dispatch('CMD-1', orchestrator.RESTAURANT_RESPONSE,
+                                    {'id_restaurant': 'R1', 'status': 'accepted'})
+            assert flow.state == orchestrator.DELIVERY_PENDING
+            assert flow.candidates == ['L1', 'L2']
+            
+            await platform.dispatch('CMD-1', orchestrator.DELIVERY_RESPONSE,
+                                    {'id_livreur': 'L1', 'status': 'rejected'})
+            assert flow.state == orchestrator.DELIVERY_PENDING
+            await platform.dispatch('CMD-1', orchestrator.DELIVERY_RESPONSE,
+                                    {'id_livreur': 'L2', 'status': 'accepted'})
+            return platform, flow
+        
+        platform, flow = asyncio.run(scenario())
+        
+        assert flow.state == orchestrator.ASSIGNED and platform.flows == {}
+        assert platform.stats['assigned'] == 1
+        # Claim, order update, metric and notification in one transaction
+        claim = db.Livreur.find_one_and_update.call_args
+        assert claim.args[0]['id_livreur'] == 'L2' and 'session' in claim.kwargs
+        assert {'statut': 'reserve', 'reserved_by': 'CMD-1'} in claim.args[0]['$or']
+        # Candidates reserved before the requests, released once assigned
+        reserve = db.Livreur.find_one_and_update.call_args_list[0]
+        assert reserve.args[1]['$set']['reserved_by'] == 'CMD-1'
+        release = db.Livreur.update_many.await_args
+        assert release.args[0] == {'statut': 'reserve', 'reserved_by': 'CMD-1'}
+        order_update = db.Commande.update_one.await_args
+        assert order_update.args[1]['$set']['delivery_request_ts'] == flow.delivery_request_ts
+        assert db.Metrics.insert_one.await_args.args[0]['assignment_delay_ms'] >= 0
+        assert 'Ali' in db.Notifications.insert_one.await_args.args[0]['message']
+        requests = db.DeliveryRequests.insert_many.await_args.args[0]
+        assert [r['id_livreur'] for r in requests] == ['L1', 'L2']
+        assert requests[0]['offered_price'] == 3.0
+        db.DeliveryRequests.insert_one.assert_not_awaited()
+    
+    def test_timer_and_cancellation_events(self):
+        """Test a response deadline and a cancel request after preparation"""
+        db = self.make_db([{'id_livreur': 'L1'}])
+        db.Commande.find_one_and_update.return_value = {'id_client': 'C2', 'prix_total': 10.0}
+        
+        async def scenario():
+            platform = AsyncOrchestrator(db, Mock(), restaurant_timeout=0.01)
+            await platform.on_new_order({'numero_commande': 'CMD-1', 'id_restaurant': 'R1'})
+            await platform.on_new_order({'numero_commande': 'CMD-2', 'id_restaurant': 'R2',
+                                         'id_client': 'C2', 'prix_total': 10.0})
+            await asyncio.gather(*platform.tasks)
+            await platform.dispatch('CMD-2', orchestrator.RESTAURANT_RESPONSE,
+                                    {'id_restaurant': 'R2', 'status': 'accepted'})
+            await asyncio.sleep(0.05)
+            await asyncio.gather(*platform.tasks)
+            assert 'CMD-1' not in platform.flows
+            
+            await platform.on_cancel_requested({'numero_commande': 'CMD-2'})
+            await asyncio.gather(*platform.tasks)
+            return platform
+        
+        platform = asyncio.run(scenario())
+        
+        assert platform.stats['rejected_by_restaurant'] == 1
+        assert platform.stats['cancelled'] == 1 and platform.flows == {}
+        kinds = [call.args[0]['kind'] for call in db.Refunds.insert_one.await_args_list]
+        assert kinds == ['refund_restaurant_preparation', 'full_refund_client']
+
+    def test_assignment_transaction_outcomes(self):
+        """Test a taken livreur or a cancelled order aborts the assignment"""
+        db = MagicMock()
+        session = MagicMock()
+        session.__enter__.return_value = session
+        session.with_transaction.side_effect = lambda callback: callback(session)
+        db.client.start_session.return_value = session
+        
+        db.Livreur.find_one_and_update.return_value = None
+        assert assignment.assign_livreur(db, 'CMD-1', 'L1')[0] == assignment.LIVREUR_TAKEN
+        db.Commande.update_one.assert_not_called()
+        
+        db.Livreur.find_one_and_update.return_value = {'id_livreur': 'L1'}
+        db.Commande.update_one.return_value = Mock(matched_count=0)
+        assert assignment.assign_livreur(db, 'CMD-1', 'L1')[0] == assignment.ORDER_CANCELLED
+        assert session.abort_transaction.call_count == 2
+        db.Metrics.insert_one.assert_not_called()
+        
+        error = BulkWriteError({'writeErrors': [{'index': 1, 'code': 11000}]})
+        db.DeliveryRequests.insert_many.side_effect = error
+        sent = assignment.send_delivery_requests(db, 'CMD-1', ['L1', 'L2', 'L3'], datetime.now(), 2.0)
+        assert sent == ['L1', 'L3']
+        assert db.DeliveryRequests.insert_many.call_count == 1
+    
+    def test_livreur_reservations(self):
+        """Test only available or expired livreurs are reserved, and release"""
+        db = MagicMock()
+        taken = {'L2'}
+        db.Livreur.find_one_and_update.side_effect = (
+            lambda query, update, **kwargs: None if query['id_livreur'] in taken
+            else {'id_livreur': query['id_livreur']}
+        )
+        reservations = LivreurReservations(db, lease_seconds=45)
+        
+        assert reservations.reserve_candidates('CMD-1', ['L1', 'L2', 'L3']) == ['L1', 'L3']
+        query, update = db.Livreur.find_one_and_update.call_args.args
+        assert {'statut': 'disponible'} in query['$or']
+        expired = next(c for c in query['$or'] if c['statut'] == 'reserve')
+        assert update['$set']['reserved_until'] > expired['reserved_until']['$lt']
+        
+        db.Livreur.update_many.return_value = Mock(modified_count=1)
+        assert reservations.release('CMD-1', ['L3']) == 1
+        query, update = db.Livreur.update_many.call_args.args
+        assert query == {'statut': 'reserve', 'reserved_by': 'CMD-1', 'id_livreur': {'$in': ['L3']}}
+        assert update['$set'] == {'statut': 'disponible'} and 'reserved_by' in update['$unset']
+        reservations.release_expired()
+        assert 'reserved_by' not in db.Livreur.update_many.call_args.args[0]
+
+
+class TestTokenStore:
+    """Tests for resume token persistence"""
+    
+    def test_file_store_atomic_roundtrip(self, tmp_path):
+        """Test the file store writes through a temp file"""
+        store = FileTokenStore(str(tmp_path / 'state' / 'token.json'))
+        assert store.load() is None
+        
+        store.save({'_data': 'abc'})
+        assert store.load() == {'_data': 'abc'}
+        assert not (tmp_path / 'state' / 'token.json.tmp').exists()
+    
+    def test_backend_must_implement_load_and_save(self):
+        """Test a backend missing load() or save() cannot be instantiated"""
+        class SaveOnly(TokenStore):
+            def save(self, token):
+                pass
+        
+        with pytest.raises(TypeError):
+            TokenStore()
+        with pytest.raises(TypeError):
+            SaveOnly()
+    
+    def test_mongo_store_upserts_per_watcher(self):
+        """Test the MongoDB store keeps one document per watcher id"""
+        collection = MagicMock()
+        store = MongoTokenStore(collection, 'watcher-0')
+        store.save({'_data': 'abc'})
+        
+        query, update = collection.update_one.call_args.args
+        assert query == {'_id': 'watcher-0'}
+        assert update['$set']['resume_token'] == {'_data': 'abc'}
+        assert collection.update_one.call_args.kwargs['upsert'] is True
+    
+    def test_throttled_writer_batches_and_final_flush(self):
+        """Test tokens are written every N updates and on close"""
+        store = Mock()
+        writer = ThrottledTokenWriter(store, every_n=3, interval_ms=60000, logger=Mock())
+        writer.start()
+        
+        for i in range(7):
+            writer.update({'_data': i})
+        # Wait for the background thread to pick up the batches
+        for _ in range(100):
+            if store.save.call_count >= 1:
+                break
+            time.sleep(0.01)
+        writer.close()
+        
+        saved = [c.args[0]['_data'] for c in store.save.call_args_list]
+        assert store.save.call_count < 7
+        assert saved[-1] == 6
+
+
+class TestDataGenerator:
+    """Tests for the streaming data generator"""
+    
+    def test_chunks_are_deterministic(self, mock_config):
+        """Test a chunk only depends on the seed, not on what was generated before"""
+        counts = {'clients': 10, 'livreurs': 5, 'restaurants': 3, 'menus': 8, 'commandes': 40}
+        args = (mock_config, 42, counts, {'p_delivered': 0.3, 'p_null_ids': 0.05},
+                datetime(2025, 1, 1))
+        
+        first = ChunkWriter(*args)
+        expected = first.generate_chunk('commandes', 20, 20)
+        
+        second = ChunkWriter(*args)
+        second.generate_chunk('clients', 0, 10)
+        second.generate_chunk('commandes', 0, 20)
+        assert second.generate_chunk('commandes', 20, 20) == expected
+        first.close()
+        second.close()
+        
+        assert expected[0]['numero_commande'] == 'CMD-2025-000021'
+        assert all(
+            order['id_client'] is None or order['id_client'] <= 'CLI-00010'
+            for order in expected
+        )
+    
+    def test_populate_streaming_single_worker(self, mock_config, mock_logger):
+        """Test streaming mode inserts unordered chunks and counts deliveries"""
+        generator = DataGenerator(mock_config, seed=7, logger=mock_logger)
+        generator.client = MagicMock()
+        generator.db = MagicMock()
+        
+        with patch('connection.MongoClient') as client_cls:
+            collection = client_cls.return_value.__getitem__.return_value.__getitem__.return_value
+            inserted = []
+            collection.insert_many.side_effect = lambda docs, ordered: inserted.extend(docs)
+            
+            generator.populate_database(
+                n_clients=5, n_livreurs=3, n_restaurants=2, n_menus=4,
+                n_commandes=25, workers=1, chunk_size=10
+            )
+        
+        # 1 + 1 + 1 + 1 + 3 chunks
+        assert collection.insert_many.call_count == 7
+        assert all(call.kwargs['ordered'] is False for call in collection.insert_many.call_args_list)
+        orders = [doc for doc in inserted if 'numero_commande' in doc]
+        assert len(orders) == 25
+        assert orders[-1]['numero_commande'] == 'CMD-2025-000025'
+    
+    def test_seed_and_reference_time_replay(self, mock_config, mock_logger):
+        """Test a seed and a reference time give the same data on replay"""
+        def run(reference_time):
+            generator = DataGenerator(
+                mock_config, seed=11, logger=mock_logger, reference_time=reference_time
+            )
+            docs = generator.generate_clients(5) + generator.generate_commandes(
+                10, ['CLI-00001'], ['LIV-00001'], ['RES-00001'], ['MEN-00001']
+            )
+            # ObjectIds are only drawn from the seed in streaming chunks
+            return [{k: v for k, v in doc.items() if k != 'id_commande'} for doc in docs]
+        
+        reference_time = datetime(2025, 6, 1, 12, 0)
+        assert run(reference_time) == run(reference_time)
+        
+        unpinned = DataGenerator(mock_config, seed=11, logger=mock_logger)
+        pinned = unpinned.pin_reference_time()
+        assert pinned.microsecond == 0
+        assert unpinned.pin_reference_time() == pinned
+        mock_logger.info.assert_any_call(
+            f"🕒 Reference time: {pinned.isoformat()} "
+            f"(pass --reference-time {pinned.isoformat()} to replay)"
+        )
+    
+    def test_fast_generator_matches_layout(self, mock_config, mock_logger):
+        """Test vectorized documents have the same fields and BSON types"""
+        pytest.importorskip('numpy')
+        from fast_generator import FastDataGenerator
+        import bson
+        
+        with patch.object(FastDataGenerator, 'VOCABULARY_SIZE', 50):
+            fast = FastDataGenerator(mock_config, seed=3, logger=mock_logger)
+        slow = DataGenerator(mock_config, seed=3, logger=mock_logger)
+        ids = (['CLI-00001'], ['LIV-00001'], ['RES-00001'], ['MEN-00001'])
+        
+        for kind in ('clients', 'livreurs', 'restaurants', 'menus', 'commandes'):
+            args = ids if kind == 'commandes' else ()
+            expected = getattr(slow, f'generate_{kind}')(5, *args)[0]
+            docs = getattr(fast, f'generate_{kind}')(5, *args, start=10)
+            assert len(docs) == 5
+            assert list(docs[0]) == list(expected)
+            bson.encode(docs[0])
+        
+        fast.seed_chunk('3:commandes:0')
+        first = fast.generate_commandes(20, *ids, p_null_ids=0.5)
+        fast.seed_chunk('3:commandes:0')
+        assert fast.generate_commandes(20, *ids, p_null_ids=0.5) == first
+        assert all((order['Nom'] is None) == (order['id_client'] is not None) for order in first)
+
+
+class TestHistoriquePartitions:
+    """Tests for the time-partitioned Historique"""
+    
+    def test_partition_names_and_range(self, mock_config):
+        """Test routing on date_commande and partition pruning for date ranges"""
+        mock_config.historique_partitioning = 'monthly'
+        db = MagicMock()
+        db.list_collection_names.return_value = [
+            'Commande', 'Historique_2025_02', 'Historique_2025_01',
+            'Historique_undated', 'Historique_registry', 'Historique_2025_03'
+        ]
+        partitions = HistoriquePartitions(mock_config, db, Mock())
+        
+        assert partitions.partition_name(datetime(2025, 1, 31)) == 'Historique_2025_01'
+        assert partitions.partition_name(None) == 'Historique_undated'
+        assert partitions.list_partitions() == [
+            'Historique_2025_01', 'Historique_2025_02', 'Historique_2025_03', 'Historique_undated'
+        ]
+        assert partitions.partitions_between(datetime(2025, 2, 10), datetime(2025, 3, 1)) == [
+            'Historique_2025_02', 'Historique_2025_03'
+        ]
+        
+        mock_config.historique_partitioning = 'yearly'
+        assert partitions.partition_name(datetime(2025, 1, 31)) == 'Historique_2025'
+        
+        mock_config.historique_partitioning = 'weekly'
+        with pytest.raises(ValueError):
+            HistoriquePartitions(mock_config, db, Mock())
+    
+    def test_insert_claims_numero_across_partitions(self, mock_config):
+        """Test a numero claimed by another partition is a duplicate, a retry is not"""
+        mock_config.historique_partitioning = 'monthly'
+        db = MagicMock()
+        collections = {}
+        db.__getitem__.side_effect = lambda name: collections.setdefault(name, MagicMock())
+        partitions = HistoriquePartitions(mock_config, db, Mock())
+        
+        orders = [
+            {'numero_commande': 'CMD-1', 'date_commande': datetime(2025, 1, 5)},
+            {'numero_commande': 'CMD-2', 'date_commande': datetime(2025, 2, 5)},
+            {'numero_commande': 'CMD-3', 'date_commande': datetime(2025, 2, 6)},
+        ]
+        registry = db['Historique_registry']
+        registry.insert_many.side_effect = BulkWriteError({'writeErrors': [
+            {'index': 1, 'code': 11000}, {'index': 2, 'code': 11000}
+        ]})
+        # CMD-2 was claimed for January (date changed), CMD-3 is a retry
+        registry.find.return_value = iter([
+            {'_id': 'CMD-2', 'partition': 'Historique_2025_01'},
+            {'_id': 'CMD-3', 'partition': 'Historique_2025_02'},
+        ])
+        for name in ('Historique_2025_01', 'Historique_2025_02'):
+            db[name].insert_many.side_effect = lambda docs, ordered: Mock(inserted_ids=list(docs))
+        
+        inserted, duplicates = partitions.insert(orders)
+        
+        assert (inserted, duplicates) == (2, 1)
+        assert db['Historique_2025_01'].insert_many.call_args.args[0] == [orders[0]]
+        assert db['Historique_2025_02'].insert_many.call_args.args[0] == [orders[2]]
+        db['Historique_2025_02'].create_index.assert_called()
+    
+    def test_insert_order_without_numero(self, mock_config):
+        """Test an order without numero_commande goes to its partition unclaimed"""
+        mock_config.historique_partitioning = 'monthly'
+        db = MagicMock()
+        collections = {}
+        db.__getitem__.side_effect = lambda name: collections.setdefault(name, MagicMock())
+        partitions = HistoriquePartitions(mock_config, db, Mock())
+        db['Historique_2025_01'].insert_many.side_effect = lambda docs, ordered: Mock(inserted_ids=list(docs))
+        
+        orders = [{'_id': ObjectId(), 'date_commande': datetime(2025, 1, 5)}]
+        
+        assert partitions.insert(orders) == (1, 0)
+        db['Historique_registry'].insert_many.assert_not_called()
+        assert db['Historique_2025_01'].insert_many.call_args.args[0] == orders
+    
+    def test_archive_batch_and_fan_out_read(self, mock_config, mock_logger):
+        """Test the archiver routes inserts and reads across partitions"""
+        mock_config.historique_partitioning = 'monthly'
+        archiver = OrderArchiver(mock_config, mock_logger)
+        archiver.db = MagicMock()
+        with patch.object(HistoriquePartitions, 'insert', return_value=(3, 1)) as insert:
+            assert archiver.archive_orders_batch([{'numero_commande': 'CMD-1'}] * 4) == 3
+        insert.assert_called_once()
+        assert archiver.stats['duplicates'] == 1
+        
+        archiver.db.list_collection_names.return_value = ['Historique_2025_01', 'Historique_2025_02']
+        archiver.db.__getitem__.return_value.find.return_value.limit.side_effect = [
+            iter([{'n': 1}, {'n': 2}]), iter([{'n': 3}])
+        ]
+        docs = list(archiver.partitions.find(limit=3))
+        assert docs == [{'n': 1}, {'n': 2}, {'n': 3}]
+        assert archiver.get_anti_join_stages()[0]['$lookup']['from'] == 'Historique_registry'
+
+
+class TestHistoriqueExporter:
+    """Tests for the Parquet/Arrow export of Historique"""
+    
+    def test_write_partitioned_parquet(self, mock_config, mock_logger, tmp_path):
+        """Test batches land in one zstd file per month and read back typed"""
+        pq = pytest.importorskip('pyarrow.parquet')
+        mock_config.export_dir = str(tmp_path)
+        mock_config.export_batch_size = 2
+        exporter = HistoriqueExporter(mock_config, Mock(), mock_logger)
+        
+        docs = [
+            {'_id': ObjectId(), 'numero_commande': 'CMD-1', 'date_commande': datetime(2025, 1, 5),
+             'coût_commande': 12, 'date_archivage': datetime(2025, 3, 1)},
+            {'_id': ObjectId(), 'numero_commande': 'CMD-2', 'date_commande': datetime(2025, 2, 5),
+             'incomplete': True, 'missing_fields': ['nom_client']},
+            {'_id': ObjectId(), 'numero_commande': 'CMD-3', 'date_commande': datetime(2025, 1, 9),
+             'date_archivage': datetime(2025, 3, 2)},
+        ]
+        assert exporter.write(iter(docs), run_id='r1') == datetime(2025, 3, 2)
+        
+        january = pq.read_table(tmp_path / 'annee=2025' / 'mois=01' / 'part-r1.parquet')
+        assert january.column('numero_commande').to_pylist() == ['CMD-1', 'CMD-3']
+        assert january.column('coût_commande').to_pylist() == [12.0, None]
+        assert january.column('_id').to_pylist()[0] == str(docs[0]['_id'])
+        february = pq.ParquetFile(tmp_path / 'annee=2025' / 'mois=02' / 'part-r1.parquet')
+        assert february.metadata.row_group(0).column(0).compression == 'ZSTD'
+        assert exporter.stats['documents'] == 3 and exporter.stats['files'] == 2
+    
+    def test_export_is_incremental(self, mock_config, mock_logger, tmp_path):
+        """Test the second run only asks for orders archived after the watermark"""
+        pytest.importorskip('pyarrow')
+        mock_config.export_dir = str(tmp_path)
+        archiver = Mock()
+        archiver.partitions.find.return_value = iter([
+            {'numero_commande': 'CMD-1', 'date_archivage': datetime(2025, 3, 1, 10)},
+            {'numero_commande': 'CMD-2', 'date_archivage': datetime(2025, 3, 1, 9)},
+        ])
+        exporter = HistoriqueExporter(mock_config, archiver, mock_logger)
+        
+        exporter.export()
+        first_query = archiver.partitions.find.call_args.args[0]
+        assert '$gt' not in first_query['date_archivage']
+        # The last exported document, not the cutoff
+        watermark = exporter.load_watermark()
+        assert watermark == datetime(2025, 3, 1, 10)
+        assert 'nom_client' in archiver.partitions.find.call_args.kwargs['projection']
+        
+        archiver.partitions.find.return_value = iter([])
+        exporter.export()
+        assert archiver.partitions.find.call_args.args[0]['date_archivage']['$gt'] == watermark
+        assert exporter.load_watermark() == watermark
+        
+        exporter.export(full=True)
+        assert '$gt' not in archiver.partitions.find.call_args.args[0]['date_archivage']
+    
+    def test_long_running_archive_is_exported(self, mock_config, mock_logger, tmp_path):
+        """Test orders enriched before an export but written after it are not skipped"""
+        pytest.importorskip('pyarrow')
+        mock_config.export_dir = str(tmp_path)
+        mock_config.export_safety_lag = 0
+        archiver = OrderArchiver(mock_config, mock_logger)
+        archiver.db = MagicMock()
+        archiver.db.__getitem__.return_value.insert_many.side_effect = lambda docs, ordered: Mock(
+            inserted_ids=list(range(len(docs)))
+        )
+        exporter = HistoriqueExporter(mock_config, archiver, mock_logger)
+        
+        # A slow run enriches an order, then an export runs...
+        order = archiver.finalize_order({'numero_commande': 'CMD-1'})
+        time.sleep(0.01)
+        exported = [{'numero_commande': 'CMD-0', 'date_archivage': datetime.now()}]
+        with patch.object(HistoriquePartitions, 'find', return_value=iter(exported)):
+            exporter.export()
+        watermark = exporter.load_watermark()
+        assert order['date_archivage'] < watermark
+        
+        # ...before the order is written: it is stamped above the watermark
+        time.sleep(0.01)
+        assert archiver.archive_orders_batch([order]) == 1
+        assert order['date_archivage'] > watermark
+    
+    def test_long_merge_run_is_stamped_after_export(self, mock_config, mock_logger, tmp_path):
+        """Test a $merge run outlasting an export is stamped once, above its watermark"""
+        pytest.importorskip('pyarrow')
+        mock_config.export_dir = str(tmp_path)
+        mock_config.export_safety_lag = 0
+        archiver = OrderArchiver(mock_config, mock_logger)
+        archiver.db = MagicMock()
+        commande, historique = MagicMock(), MagicMock()
+        archiver.db.__getitem__.side_effect = lambda name: (
+            commande if name == mock_config.collection_commande else historique
+        )
+        commande.count_documents.return_value = 3
+        historique.count_documents.side_effect = [3, 0]
+        exporter = HistoriqueExporter(mock_config, archiver, mock_logger)
+        
+        def slow_merge(pipeline, allowDiskUse):
+            # The run's documents carry no date_archivage: the export only
+            # sees (and moves its watermark past) older documents
+            assert all('date_archivage' not in stage.get('$addFields', {}) for stage in pipeline)
+            time.sleep(0.01)
+            exported = [{'numero_commande': 'CMD-0', 'date_archivage': datetime.now()}]
+            with patch.object(HistoriquePartitions, 'find', return_value=iter(exported)):
+                exporter.export()
+            time.sleep(0.01)
+            return iter([])
+        commande.aggregate.side_effect = slow_merge
+        
+        stats = archiver.archive_all(engine='merge')
+        
+        assert stats['archived'] == 3
+        historique.update_many.assert_called_once()
+        stamped = historique.update_many.call_args.args[1]['$set']['date_archivage']
+        assert stamped > exporter.load_watermark()
+
+
 class TestIntegration:
     """Integration tests (require actual MongoDB connection)"""
     
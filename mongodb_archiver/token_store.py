@@ -0,0 +1,162 @@
+"""
+Resume token persistence for the Change Stream watcher
+File and MongoDB backends, plus a throttled background writer
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict
+import json
+import os
+import threading
+
+from logger import setup_logger
+
+
+class TokenStore(ABC):
+    """Base class for resume token backends"""
+
+    @abstractmethod
+    def load(self) -> Optional[Dict]:
+        """Return the saved resume token, or None"""
+
+    @abstractmethod
+    def save(self, token: Dict):
+        """Persist the resume token (synchronous)"""
+
+    def describe(self) -> str:
+        """Human readable location for logs"""
+        return self.__class__.__name__
+
+
+class FileTokenStore(TokenStore):
+    """Resume token in a local JSON file, written atomically"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    def load(self) -> Optional[Dict]:
+        if not self.path.exists():
+            return None
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def save(self, token: Dict):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+
+        # Write + fsync a temp file, then rename over the previous token
+        with open(tmp_path, 'w') as f:
+            json.dump(token, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def describe(self) -> str:
+        return f"file {self.path}"
+
+
+class MongoTokenStore(TokenStore):
+    """Resume token in a MongoDB collection, one document per watcher"""
+
+    def __init__(self, collection, watcher_id: str):
+        self.collection = collection
+        self.watcher_id = watcher_id
+
+    def load(self) -> Optional[Dict]:
+        doc = self.collection.find_one({'_id': self.watcher_id})
+        return doc.get('resume_token') if doc else None
+
+    def save(self, token: Dict):
+        self.collection.update_one(
+            {'_id': self.watcher_id},
+            {'$set': {'resume_token': token, 'updated_at': datetime.now()}},
+            upsert=True
+        )
+
+    def describe(self) -> str:
+        return f"collection {self.collection.name} (_id: {self.watcher_id})"
+
+
+class ThrottledTokenWriter:
+    """
+    Persist resume tokens from a background thread
+
+    update() only records the latest token; the writer thread saves it once
+    every_n updates have accumulated or interval_ms has elapsed, whichever
+    comes first. close() always performs a final save.
+    """
+
+    def __init__(self, store: TokenStore, every_n: int = 100,
+                 interval_ms: int = 1000, logger=None):
+        self.store = store
+        self.every_n = max(1, every_n)
+        self.interval = max(1, interval_ms) / 1000
+        self.logger = logger or setup_logger(__name__)
+
+        self._latest = None
+        self._dirty = 0
+        self._stopping = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+        # Statistics
+        self.stats = {'updates': 0, 'writes': 0, 'errors': 0}
+
+    def start(self):
+        """Start the writer thread"""
+        self._thread = threading.Thread(
+            target=self._run, name="resume-token-writer", daemon=True
+        )
+        self._thread.start()
+
+    def update(self, token: Dict):
+        """Record the latest committed token (non-blocking)"""
+        with self._condition:
+            self._latest = token
+            self._dirty += 1
+            self.stats['updates'] += 1
+            if self._dirty >= self.every_n:
+                self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._stopping or self._dirty >= self.every_n,
+                    timeout=self.interval
+                )
+                if self._stopping:
+                    return
+                token = self._take()
+            self._write(token)
+
+    def _take(self) -> Optional[Dict]:
+        """Grab the pending token (caller holds the lock)"""
+        if not self._dirty:
+            return None
+        self._dirty = 0
+        return self._latest
+
+    def _write(self, token: Optional[Dict]):
+        if token is None:
+            return
+        try:
+            self.store.save(token)
+            self.stats['writes'] += 1
+            self.logger.debug("💾 Saved resume token")
+        except Exception as e:
+            self.stats['errors'] += 1
+            self.logger.warning(f"⚠️  Could not save resume token: {e}")
+
+    def close(self):
+        """Stop the writer thread and flush the last token"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        with self._condition:
+            token = self._take()
+        self._write(token)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Benchmark the lookup engine (one aggregation at a time) against --async.
+
+Usage:
+  py .\tools\benchmark_async.py --orders 100000
+  py .\tools\benchmark_async.py --orders 100000 --concurrency 32 64 128
+
+Requires a local mongod. A scratch database (Ubereats_Bench_Async) is
+filled with delivered orders, then archived once by the synchronous lookup
+engine and once per --concurrency value by AsyncOrderArchiver, emptying
+Historique between runs. Prints orders/sec for each run.
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import Config
+from logger import setup_logger
+from archiver import OrderArchiver
+from async_archiver import AsyncOrderArchiver
+from generator import DataGenerator
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark the lookup and async archiving engines")
+    p.add_argument('--orders', type=int, default=100000, help='Delivered orders (default: 100000)')
+    p.add_argument('--concurrency', type=int, nargs='+', default=[16, 64, 256],
+                   help='Async concurrency levels to try (default: 16 64 256)')
+    p.add_argument('--uri', default='mongodb://localhost:27017/', help='Local mongod URI')
+    p.add_argument('--keep', action='store_true', help='Keep the scratch database')
+    return p.parse_args()
+
+
+def run(archiver, historique):
+    """Archive every delivered order, return orders/sec"""
+    historique.delete_many({})
+    if not archiver.connect():
+        sys.exit(1)
+    t0 = time.perf_counter()
+    stats = archiver.archive_all(engine='lookup')
+    elapsed = time.perf_counter() - t0
+    archiver.close()
+    return stats['archived'] / elapsed
+
+
+def main():
+    args = parse_args()
+    config = Config.for_simulation(args.uri)
+    config.database_name = 'Ubereats_Bench_Async'
+    config.batch_size = 500
+    config.prefilter_archived = False
+    logger = setup_logger('benchmark_async')
+    logger.disabled = True
+
+    generator = DataGenerator(config, seed=42, logger=logger)
+    generator.populate_database(
+        n_clients=10000, n_livreurs=1000, n_restaurants=500, n_menus=5000,
+        n_commandes=args.orders, p_delivered=1.0, clear_existing=True, workers=1
+    )
+    db = generator.db
+
+    setup = OrderArchiver(config, logger)
+    setup.connect()
+    setup.ensure_indexes()
+    setup.close()
+    historique = db[config.collection_historique]
+
+    print(f"{'engine':20} {'orders/s':>10}")
+    print(f"{'lookup (sync)':20} {run(OrderArchiver(config, logger), historique):10,.0f}")
+    for concurrency in args.concurrency:
+        config.async_concurrency = concurrency
+        rate = run(AsyncOrderArchiver(config, logger), historique)
+        print(f"{'async x' + str(concurrency):20} {rate:10,.0f}")
+
+    if not args.keep:
+        generator.client.drop_database(config.database_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Benchmark the full and lean change stream modes of the watcher.
+
+Usage:
+  py .\tools\benchmark_change_stream.py --simulation --events 500
+  py .\tools\benchmark_change_stream.py --events 1000 --mode lean
+
+Delivered orders are copied to a scratch collection (dropped at the end),
+reset to "en cours", then set to "livrée" one by one while the watcher
+pipeline of each mode is open on that collection. For every event the
+raw BSON size and the delay between the update and its arrival on the
+stream are recorded. The lean figures exclude the per-batch _id lookup
+done by flush_pending(), which is shared by the whole micro-batch.
+"""
+import sys
+import time
+import argparse
+import statistics
+from pathlib import Path
+
+from bson.raw_bson import RawBSONDocument
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import Config
+from archiver import OrderArchiver
+from watcher import OrderWatcher
+
+SCRATCH_COLLECTION = '_bench_change_stream'
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark full vs lean change stream modes")
+    p.add_argument('--events', type=int, default=200, help='Status updates per mode (default: 200)')
+    p.add_argument('--mode', choices=['full', 'lean', 'both'], default='both',
+                   help='Mode(s) to benchmark (default: both)')
+    p.add_argument('--simulation', action='store_true', help='Use local MongoDB for testing')
+    return p.parse_args()
+
+
+def run_mode(config, archiver, mode, orders):
+    """Update every scratch order to livrée and time its change event"""
+    config.watch_stream_mode = mode
+    watcher = OrderWatcher(config, archiver.logger)
+    options = watcher.get_watch_options()
+    options['max_await_time_ms'] = 1000
+
+    collection = archiver.db.get_collection(SCRATCH_COLLECTION)
+    collection.update_many({}, {'$set': {'status': 'en cours'}})
+
+    sizes, latencies = [], []
+    raw_collection = collection.with_options(
+        codec_options=collection.codec_options.with_options(document_class=RawBSONDocument)
+    )
+    with raw_collection.watch(**options) as stream:
+        for order in orders:
+            start = time.perf_counter()
+            collection.update_one({'_id': order['_id']}, {'$set': {'status': 'livrée'}})
+            change = None
+            while change is None:
+                change = stream.try_next()
+            latencies.append((time.perf_counter() - start) * 1000)
+            sizes.append(len(change.raw))
+
+    return sizes, latencies
+
+
+def report(mode, sizes, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1]
+    print(f'{mode:5} mode: {statistics.mean(sizes):8.0f} bytes/event '
+          f'(total {sum(sizes) / 1024:.1f} KiB), '
+          f'latency avg {statistics.mean(latencies):.2f} ms, p95 {p95:.2f} ms')
+
+
+def main():
+    args = parse_args()
+    config = Config.for_simulation() if args.simulation else Config.from_env()
+
+    archiver = OrderArchiver(config)
+    if not archiver.connect():
+        sys.exit(1)
+
+    orders = list(
+        archiver.db[config.collection_commande]
+        .find(archiver.build_delivered_query())
+        .limit(args.events)
+    )
+    if not orders:
+        print('No delivered orders found')
+        return
+
+    scratch = archiver.db[SCRATCH_COLLECTION]
+    scratch.drop()
+    scratch.insert_many(orders)
+
+    try:
+        modes = ['full', 'lean'] if args.mode == 'both' else [args.mode]
+        print(f'Benchmarking {len(orders)} status updates per mode')
+        for mode in modes:
+            sizes, latencies = run_mode(config, archiver, mode, orders)
+            report(mode, sizes, latencies)
+    finally:
+        scratch.drop()
+        archiver.close()
+
+
+if __name__ == '__main__':
+    main()
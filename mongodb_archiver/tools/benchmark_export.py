@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Benchmark the JSON sample exporter against the Parquet/Arrow exporter.
+
+Usage:
+  py .\tools\benchmark_export.py --count 200000
+  py .\tools\benchmark_export.py --count 1000000 --batch-size 50000
+
+Archived orders are synthesized in memory (no MongoDB needed) and written
+with json_util (as OrderArchiver.export_sample does), then as zstd Parquet
+and Arrow IPC files. Prints orders/sec and output size for each format.
+"""
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from bson import ObjectId, json_util
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import Config
+from logger import setup_logger
+from exporter import HistoriqueExporter
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark the JSON and columnar exporters")
+    p.add_argument('--count', type=int, default=200000, help='Archived orders (default: 200000)')
+    p.add_argument('--batch-size', type=int, default=10000, help='Documents per record batch (default: 10000)')
+    p.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+    return p.parse_args()
+
+
+def archived_orders(count, seed):
+    """Documents shaped like the enrichment pipeline output"""
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    for i in range(count):
+        prix = round(rng.uniform(8.0, 40.0), 2)
+        frais = round(rng.uniform(1.5, 5.0), 2)
+        yield {
+            "_id": ObjectId(),
+            "numero_commande": f"CMD-2025-{i+1:06d}",
+            "id_commande": str(ObjectId()),
+            "adresse_livraison": f"{rng.randint(1, 200)} rue de la Paix, 75002 Paris",
+            "adresse_commande": f"{rng.randint(1, 200)} avenue Foch, 75016 Paris",
+            "coût_commande": round(prix + frais, 2),
+            "rémunération_livreur": round(frais * 0.7, 2),
+            "moyen_de_payement": rng.choice(["carte", "espèces", "paypal"]),
+            "status": "livrée",
+            "date_commande": now - timedelta(seconds=rng.randint(0, 86400 * 365)),
+            "temps_estimee": rng.randint(20, 60),
+            "nom_client": f"Client {rng.randint(1, 10000)}",
+            "email_client": f"client{rng.randint(1, 10000)}@example.com",
+            "telephone_client": f"06{rng.randint(10000000, 99999999)}",
+            "nom_livreur": f"Livreur {rng.randint(1, 1000)}",
+            "nom_restaurant": f"Restaurant {rng.randint(1, 500)}",
+            "adresse_restaurant": f"{rng.randint(1, 200)} boulevard Haussmann, 75009 Paris",
+            "nom_menu": rng.choice(["Pizza Margherita", "Burger Classic", "Sushi Mix", "Pad Thai"]),
+            "prix_menu": prix,
+            "date_archivage": now,
+            "archived_by": "archive_commandes.py",
+        }
+
+
+def directory_size(path):
+    return sum(f.stat().st_size for f in Path(path).rglob('*') if f.is_file())
+
+
+def run_json(docs, directory):
+    path = Path(directory) / 'historique.json'
+    t0 = time.perf_counter()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json_util.dumps(list(docs), indent=2, ensure_ascii=False))
+    return time.perf_counter() - t0, path.stat().st_size
+
+
+def run_columnar(docs, directory, fmt, batch_size, logger):
+    config = Config(mongodb_uri="mongodb://localhost:27017/", export_dir=directory,
+                    export_batch_size=batch_size)
+    exporter = HistoriqueExporter(config, archiver=None, logger=logger)
+    t0 = time.perf_counter()
+    exporter.write(docs, run_id='bench', fmt=fmt)
+    return time.perf_counter() - t0, directory_size(directory)
+
+
+def main():
+    args = parse_args()
+    logger = setup_logger('benchmark_export')
+    logger.disabled = True
+
+    print(f"{'format':16} {'orders/s':>12} {'size (MiB)':>12}")
+    runs = [
+        ('json', lambda docs, d: run_json(docs, d)),
+        ('parquet (zstd)', lambda docs, d: run_columnar(docs, d, 'parquet', args.batch_size, logger)),
+        ('arrow (zstd)', lambda docs, d: run_columnar(docs, d, 'arrow', args.batch_size, logger)),
+    ]
+    for name, run in runs:
+        with tempfile.TemporaryDirectory() as directory:
+            seconds, size = run(archived_orders(args.count, args.seed), directory)
+        print(f'{name:16} {args.count / seconds:12,.0f} {size / 1024 / 1024:12.1f}')
+
+
+if __name__ == '__main__':
+    main()
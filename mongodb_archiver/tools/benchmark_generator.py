@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Benchmark the Faker generator against the vectorized --fast generator.
+
+Usage:
+  py .\tools\benchmark_generator.py --count 100000
+  py .\tools\benchmark_generator.py --count 1000000 --chunk-size 50000
+
+Documents are generated in memory only (no MongoDB needed), chunk by chunk
+as in streaming mode. Prints documents/sec for each collection and the
+speedup of the fast generator.
+"""
+import sys
+import time
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import Config
+from logger import setup_logger
+from generator import DataGenerator, IdSequence
+from fast_generator import FastDataGenerator
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark the Faker and vectorized generators")
+    p.add_argument('--count', type=int, default=100000, help='Orders per generator (default: 100000)')
+    p.add_argument('--chunk-size', type=int, default=10000, help='Documents per chunk (default: 10000)')
+    p.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+    return p.parse_args()
+
+
+def run(generator, kind, count, chunk_size):
+    """Generate count documents of one kind, return documents/sec"""
+    foreign_ids = {
+        'client_ids': IdSequence('CLI', 10000),
+        'livreur_ids': IdSequence('LIV', 1000),
+        'restaurant_ids': IdSequence('RES', 500),
+        'menu_ids': IdSequence('MEN', 5000),
+    }
+    t0 = time.perf_counter()
+    for start in range(0, count, chunk_size):
+        size = min(chunk_size, count - start)
+        generator.seed_chunk(f"bench:{kind}:{start}")
+        if kind == 'commandes':
+            generator.generate_commandes(size, start=start, **foreign_ids)
+        else:
+            getattr(generator, f"generate_{kind}")(size, start=start)
+    return count / (time.perf_counter() - t0)
+
+
+def main():
+    args = parse_args()
+    config = Config(mongodb_uri="mongodb://localhost:27017/")
+    logger = setup_logger('benchmark_generator')
+
+    t0 = time.perf_counter()
+    fast = FastDataGenerator(config, seed=args.seed, logger=logger)
+    vocabulary_time = time.perf_counter() - t0
+    faker = DataGenerator(config, seed=args.seed, logger=logger)
+    fast.reference_time = faker.reference_time = datetime.now()
+
+    print(f'Vocabulary sampling: {vocabulary_time:.2f}s (once per process)')
+    print(f"{'collection':12} {'faker docs/s':>14} {'fast docs/s':>14} {'speedup':>8}")
+    for kind in ('clients', 'commandes'):
+        slow_rate = run(faker, kind, args.count, args.chunk_size)
+        fast_rate = run(fast, kind, args.count, args.chunk_size)
+        print(f'{kind:12} {slow_rate:14,.0f} {fast_rate:14,.0f} {fast_rate / slow_rate:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
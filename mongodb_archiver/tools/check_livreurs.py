@@ -1,15 +1,22 @@
 import os
-from pymongo import MongoClient
+import sys
+from pathlib import Path
 from pprint import pprint
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import Config
+from connection import get_client, release_client
+
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
 DB_NAME = os.getenv('MONGODB_DATABASE', 'Ubereats')
 
 print('Using URI:', 'MONGODB_URI' in os.environ)
 print('DB_NAME:', DB_NAME)
 
+client = None
 try:
-    client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
+    client = get_client(Config(mongodb_uri=MONGODB_URI, database_name=DB_NAME))
     db = client[DB_NAME]
     # connection ping
     client.admin.command('ping')
@@ -48,7 +55,4 @@ try:
 except Exception as e:
     print('ERROR connecting to MongoDB:', type(e).__name__, str(e))
 finally:
-    try:
-        client.close()
-    except Exception:
-        pass
+    release_client(client)
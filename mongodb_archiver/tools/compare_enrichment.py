@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Compare the cached (client-side) and lookup (aggregation) enrichment engines.
+
+Usage:
+  py .\tools\compare_enrichment.py --sample 500
+  py .\tools\compare_enrichment.py --simulation --sample 100
+
+For each sampled delivered order, the document produced by the $lookup
+pipeline and the one produced by ClientSideEnricher are BSON-encoded and
+compared byte for byte. Timings of both engines are printed at the end.
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import bson
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import Config
+from archiver import OrderArchiver
+from dimension_cache import ClientSideEnricher
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Compare cached and lookup enrichment engines")
+    p.add_argument('--sample', type=int, default=200, help='Number of delivered orders to compare (default: 200)')
+    p.add_argument('--simulation', action='store_true', help='Use local MongoDB for testing')
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = Config.for_simulation() if args.simulation else Config.from_env()
+
+    archiver = OrderArchiver(config)
+    if not archiver.connect():
+        sys.exit(1)
+
+    orders = list(
+        archiver.db[config.collection_commande]
+        .find(archiver.build_delivered_query())
+        .limit(args.sample)
+    )
+    if not orders:
+        print('No delivered orders found')
+        return
+
+    enricher = ClientSideEnricher(config, archiver.db, archiver.logger)
+
+    mismatches = 0
+    lookup_time = cached_time = 0.0
+    for order in orders:
+        t0 = time.perf_counter()
+        expected = list(
+            archiver.db[config.collection_commande]
+            .aggregate(archiver.get_enrichment_pipeline(order['numero_commande']))
+        )
+        t1 = time.perf_counter()
+        actual = enricher.enrich(order)
+        t2 = time.perf_counter()
+        lookup_time += t1 - t0
+        cached_time += t2 - t1
+
+        if not expected or bson.encode(expected[0]) != bson.encode(actual):
+            mismatches += 1
+            print(f"❌ {order['numero_commande']}")
+            print(f"   lookup: {expected[0] if expected else None}")
+            print(f"   cached: {actual}")
+
+    n = len(orders)
+    print(f'Compared {n} orders: {n - mismatches} identical, {mismatches} different')
+    print(f'lookup engine: {lookup_time / n * 1000:.3f} ms/order')
+    print(f'cached engine: {cached_time / n * 1000:.3f} ms/order')
+    print(f'cache stats:   {enricher.get_stats()}')
+
+    archiver.close()
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,18 +3,30 @@
 """
 from __future__ import annotations
 import os
+import sys
+from pathlib import Path
 from dotenv import load_dotenv
-from pymongo import MongoClient
 import numpy as np
 import pprint
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import Config
+from connection import get_client, release_client
+
 def main():
     load_dotenv()
     uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
     dbname = os.getenv('MONGODB_DATABASE', 'Ubereats')
     print('Using URI:', uri)
-    client = MongoClient(uri, serverSelectionTimeoutMS=5000)
-    db = client[dbname]
+    client = get_client(Config(mongodb_uri=uri, database_name=dbname))
+    try:
+        report(client[dbname])
+    finally:
+        release_client(client)
+
+
+def report(db):
     cursor = db.Metrics.find({'assignment_delay_ms': {'$type': ['int','double','long']}})
     vals = [d['assignment_delay_ms'] for d in cursor]
     if not vals:
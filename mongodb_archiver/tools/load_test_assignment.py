@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Load test livreur assignment: no livreur may end up with two orders.
+
+Usage:
+  py .\tools\load_test_assignment.py --orders 1000 --livreurs 300
+  py .\tools\load_test_assignment.py --orders 1000 --livreurs 300 --naive
+
+Requires a local mongod started as a replica set (transactions), e.g.
+  mongod --replSet rs0  then  mongosh --eval "rs.initiate()"
+
+A scratch database (Ubereats_Bench_Assign) is filled with available
+livreurs and restaurant-accepted orders, then every order runs at once
+in one event loop: top-K candidates, reservation (reservations.py),
+simulated livreur answers, transactional claim (assignment.py), release.
+--naive replaces reservation and claim by the former unconditional
+update_one, for comparison. Prints assigned/waiting orders and the number
+of livreurs assigned to more than one order; exits 1 if there is any.
+"""
+import sys
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from pymongo import AsyncMongoClient, ASCENDING
+
+from reservations import AsyncLivreurReservations, RESERVED
+from assignment import assign_livreur_async, ASSIGNED
+
+DB_NAME = 'Ubereats_Bench_Assign'
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Concurrent livreur assignment load test")
+    p.add_argument('--orders', type=int, default=1000, help='Concurrent orders (default: 1000)')
+    p.add_argument('--livreurs', type=int, default=300, help='Available livreurs (default: 300)')
+    p.add_argument('--k', type=int, default=5, help='Candidates per order (default: 5)')
+    p.add_argument('--accept-rate', type=float, default=0.7,
+                   help='Probability that a livreur accepts (default: 0.7)')
+    p.add_argument('--naive', action='store_true', help='Unconditional assignment, no reservation')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--uri', default='mongodb://localhost:27017/', help='Local replica set URI')
+    p.add_argument('--keep', action='store_true', help='Keep the scratch database')
+    return p.parse_args()
+
+
+async def seed(db, n_orders: int, n_livreurs: int):
+    await db.Livreur.drop()
+    await db.Commande.drop()
+    await db.Livreur.create_index([('id_livreur', ASCENDING)], unique=True)
+    await db.Livreur.create_index([('statut', ASCENDING)])
+    await db.Commande.create_index([('numero_commande', ASCENDING)], unique=True)
+    await db.Livreur.insert_many([
+        {'id_livreur': f"L{i:05d}", 'prenom': f"Livreur{i}", 'statut': 'disponible', 'city': 'Paris'}
+        for i in range(n_livreurs)
+    ])
+    await db.Commande.insert_many([
+        {'numero_commande': f"LT-{i:06d}", 'id_client': f"C{i:06d}", 'status': 'accepted'}
+        for i in range(n_orders)
+    ])
+
+
+async def answers(rng: random.Random, livreur_ids, accept_rate: float):
+    """Livreurs who accept, in the order their answers arrive"""
+    await asyncio.sleep(rng.uniform(0.0, 0.05))
+    accepted = [id_livreur for id_livreur in livreur_ids if rng.random() < accept_rate]
+    rng.shuffle(accepted)
+    return accepted
+
+
+async def run_order(db, reservations, numero: str, args, rng: random.Random) -> bool:
+    """Run one order to assignment (True) or waiting_for_livreur (False)"""
+    candidates = await db.Livreur.find({'statut': 'disponible'}).limit(args.k).to_list()
+    livreur_ids = [livreur['id_livreur'] for livreur in candidates]
+
+    if args.naive:
+        for id_livreur in await answers(rng, livreur_ids, args.accept_rate):
+            await db.Livreur.update_one(
+                {'id_livreur': id_livreur},
+                {'$set': {'statut': 'en_course', 'numero_commande': numero}}
+            )
+            await db.Commande.update_one(
+                {'numero_commande': numero},
+                {'$set': {'status': 'en_cours', 'id_livreur': id_livreur}}
+            )
+            return True
+        return False
+
+    livreur_ids = await reservations.reserve_candidates(numero, livreur_ids)
+    try:
+        requested_at = datetime.now(timezone.utc)
+        for id_livreur in await answers(rng, livreur_ids, args.accept_rate):
+            outcome, _ = await assign_livreur_async(db, numero, id_livreur, None, requested_at)
+            if outcome == ASSIGNED:
+                return True
+        return False
+    finally:
+        await reservations.release(numero, livreur_ids)
+
+
+async def double_assignments(db) -> int:
+    """Livreurs holding more than one en_cours order"""
+    pipeline = [
+        {'$match': {'status': 'en_cours'}},
+        {'$group': {'_id': '$id_livreur', 'orders': {'$sum': 1}}},
+        {'$match': {'orders': {'$gt': 1}}},
+        {'$count': 'livreurs'},
+    ]
+    # AsyncCollection.aggregate is a coroutine returning the cursor
+    cursor = await db.Commande.aggregate(pipeline)
+    result = await cursor.to_list()
+    return result[0]['livreurs'] if result else 0
+
+
+async def main():
+    args = parse_args()
+    client = AsyncMongoClient(args.uri, maxPoolSize=max(100, args.orders // 4))
+    db = client[DB_NAME]
+    doubles, errors = 0, []
+    try:
+        await seed(db, args.orders, args.livreurs)
+        reservations = AsyncLivreurReservations(db, lease_seconds=60)
+        rng = random.Random(args.seed)
+
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(
+            run_order(db, reservations, f"LT-{i:06d}", args, random.Random(rng.random()))
+            for i in range(args.orders)
+        ), return_exceptions=True)
+        elapsed = time.perf_counter() - t0
+
+        errors = [r for r in results if isinstance(r, Exception)]
+        assigned = sum(1 for r in results if r is True)
+        doubles = await double_assignments(db)
+        left_reserved = await db.Livreur.count_documents({'statut': RESERVED})
+        busy = await db.Livreur.count_documents({'statut': 'en_course'})
+
+        print(f"mode            : {'naive' if args.naive else 'reservations'}")
+        print(f"orders          : {args.orders} in {elapsed:.2f}s")
+        print(f"assigned        : {assigned}")
+        print(f"waiting         : {args.orders - assigned - len(errors)}")
+        print(f"errors          : {len(errors)}")
+        print(f"livreurs busy   : {busy}/{args.livreurs}")
+        print(f"left reserved   : {left_reserved}")
+        print(f"double assigned : {doubles}")
+        for error in errors[:3]:
+            print(f"  {type(error).__name__}: {error}")
+    finally:
+        if not args.keep:
+            await client.drop_database(DB_NAME)
+        await client.close()
+    return 1 if doubles or errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
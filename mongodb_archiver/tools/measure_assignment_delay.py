@@ -14,10 +14,15 @@ a timestamp `ts`.
 import os
 import sys
 import argparse
-from pymongo import MongoClient
+from pathlib import Path
 import numpy as np
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import Config
+from connection import get_client, release_client
+
 
 def parse_args():
     p = argparse.ArgumentParser(description="Measure assignment delay from MongoDB Metrics collection")
@@ -32,7 +37,7 @@ def main():
     dbname = os.getenv('MONGODB_DATABASE', 'Ubereats')
 
     try:
-        client = MongoClient(uri)
+        client = get_client(Config(mongodb_uri=uri, database_name=dbname))
         db = client[dbname]
     except Exception as e:
         print(f"Erreur connexion MongoDB: {e}")
@@ -41,14 +46,14 @@ def main():
     docs = list(db.Metrics.find().sort('ts', -1).limit(args.n))
     if not docs:
         print("Aucune métrique trouvée dans la collection 'Metrics'.")
-        client.close()
+        release_client(client)
         sys.exit(1)
 
     # Extract delays (ms), keep only numeric values
     delays = [d.get('assignment_delay_ms') for d in docs if isinstance(d.get('assignment_delay_ms'), (int, float))]
     if not delays:
         print("Aucune valeur 'assignment_delay_ms' numérique trouvée dans les documents récupérés.")
-        client.close()
+        release_client(client)
         sys.exit(1)
 
     # Reverse to chronological order (oldest -> newest)
@@ -88,7 +93,7 @@ def main():
     except Exception as e:
         print(f"Erreur lors de la sauvegarde du graphique: {e}")
 
-    client.close()
+    release_client(client)
 
 
 if __name__ == '__main__':
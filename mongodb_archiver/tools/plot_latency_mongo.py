@@ -15,12 +15,18 @@ from __future__ import annotations
 import os
 import sys
 import argparse
+from pathlib import Path
 from typing import List
 from pymongo import MongoClient
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.patches import Patch
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import Config
+from connection import get_client, release_client
+
 # Load .env automatically when available so scripts that rely on MONGODB_URI work
 try:
     from dotenv import load_dotenv
@@ -112,8 +118,8 @@ def main():
     args = parse_args()
 
     try:
-        # Use a short serverSelectionTimeoutMS so failures are reported quickly
-        client = MongoClient(args.mongo_uri, serverSelectionTimeoutMS=5000)
+        # Shared pool (connection.py): serverSelectionTimeoutMS=5000 reports failures quickly
+        client = get_client(Config(mongodb_uri=args.mongo_uri, database_name=args.db))
         # force a connection attempt to surface auth/network errors early
         client.server_info()
     except Exception as e:
@@ -124,12 +130,12 @@ def main():
         values = fetch_numeric_values(client, args.db, args.collection, args.field, args.limit)
     except Exception as e:
         print(f"Erreur lors de la lecture des documents: {e}")
-        client.close()
+        release_client(client)
         sys.exit(2)
 
     if not values:
         print(f"Aucun enregistrement numérique trouvé pour le champ '{args.field}' dans {args.db}.{args.collection}.")
-        client.close()
+        release_client(client)
         sys.exit(3)
 
     # Compute stats
@@ -145,10 +151,10 @@ def main():
         plot_and_save(min_v, avg_v, max_v, n, args.out)
     except Exception as e:
         print(f"Erreur lors de la génération du graphique: {e}")
-        client.close()
+        release_client(client)
         sys.exit(4)
 
-    client.close()
+    release_client(client)
 
 
 if __name__ == '__main__':
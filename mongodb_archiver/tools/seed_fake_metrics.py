@@ -15,7 +15,12 @@ import sys
 import argparse
 import random
 from datetime import datetime, timedelta, timezone
-from pymongo import MongoClient
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import Config
+from connection import get_client, release_client
 
 
 def parse_args():
@@ -31,7 +36,7 @@ def main():
     args = parse_args()
 
     try:
-        client = MongoClient(args.mongo_uri)
+        client = get_client(Config(mongodb_uri=args.mongo_uri, database_name=args.db))
     except Exception as e:
         print(f"Erreur de connexion MongoDB: {e}")
         sys.exit(2)
@@ -64,7 +69,7 @@ def main():
 
     if not docs:
         print("Aucun document à insérer")
-        client.close()
+        release_client(client)
         return
 
     try:
@@ -72,10 +77,10 @@ def main():
         print(f"Insertés {len(res.inserted_ids)} documents dans {args.db}.{args.collection}")
     except Exception as e:
         print(f"Erreur insertion: {e}")
-        client.close()
+        release_client(client)
         sys.exit(3)
 
-    client.close()
+    release_client(client)
 
 
 if __name__ == '__main__':
@@ -92,10 +97,14 @@ import os
 import sys
 import argparse
 from datetime import datetime, timedelta, timezone
-from pymongo import MongoClient
 import random
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import Config
+from connection import get_client, release_client
+
 # load .env if present (same convention as other scripts)
 try:
     from dotenv import load_dotenv
@@ -129,7 +138,7 @@ def main():
         pass
 
     try:
-        client = MongoClient(uri)
+        client = get_client(Config(mongodb_uri=uri, database_name=dbname))
         db = client[dbname]
     except Exception as e:
         print(f"Erreur connexion MongoDB: {e}")
@@ -165,7 +174,7 @@ def main():
     except Exception as e:
         print(f"Erreur insertion: {e}")
     finally:
-        client.close()
+        release_client(client)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,12 @@
-from pymongo import MongoClient
 from urllib.parse import quote_plus
 import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import Config
+from connection import get_client, release_client
 
 # Lit MONGODB_URI depuis les variables d'environnement ou .env
 uri = os.getenv('MONGODB_URI') or os.getenv('MONGO_URI') or ""
@@ -8,8 +14,9 @@ if not uri:
     print('ERROR: aucune variable MONGODB_URI trouvée dans l\'environnement')
     raise SystemExit(2)
 
+client = None
 try:
-    client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+    client = get_client(Config(mongodb_uri=uri))
     # petite opération pour forcer la connexion
     client.admin.command('ping')
     print('✅ MongoDB : connexion OK')
@@ -17,7 +24,4 @@ except Exception as e:
     print('❌ MongoDB : échec de connexion —', type(e).__name__, str(e))
     raise
 finally:
-    try:
-        client.close()
-    except Exception:
-        pass
+    release_client(client)
@@ -2,47 +2,205 @@
 MongoDB Change Stream Watcher - Real-time order archiving
 Watches for status changes and archives orders automatically
 """
-from pymongo import MongoClient
 from pymongo.errors import PyMongoError
-from datetime import datetime
+from datetime import datetime, timezone
 import json
 import time
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Any, Optional, Dict, List
 
 from config import Config
 from logger import setup_logger
 from archiver import OrderArchiver
+from token_store import TokenStore, FileTokenStore, MongoTokenStore, ThrottledTokenWriter
 
 
 class OrderWatcher:
     """Watch for order status changes using MongoDB Change Streams"""
     
+    # Fields kept on change events in lean stream mode (_id is the resume token)
+    LEAN_PROJECTION = {
+        'operationType': 1,
+        'documentKey': 1,
+        'clusterTime': 1,
+        'wallTime': 1,
+        'fullDocument.numero_commande': 1,
+        'fullDocument.status': 1,
+        'updateDescription.updatedFields.numero_commande': 1,
+        'updateDescription.updatedFields.status': 1,
+    }
+    
     def __init__(self, config: Config, logger=None):
         self.config = config
         self.logger = logger or setup_logger(__name__)
         self.archiver = OrderArchiver(config, logger)
         self.resume_token = None
-        self.resume_token_file = Path(config.watch_resume_token_file)
+        self.resume_token_file = self.partitioned_token_file()
+        self.token_store: TokenStore = FileTokenStore(str(self.resume_token_file))
+        self.token_writer: Optional[ThrottledTokenWriter] = None
+        
+        # Micro-batch of order numbers waiting to be archived, plus the
+        # _ids of orders whose number is not on the event (lean mode)
+        self.pending = []
+        self.pending_ids = []
+        self.pending_since = None
+        self.pending_event_times = []  # epoch seconds of the buffered events
+        self.replays = 0  # failed commits since the resume token last advanced
+        
+        # Live metrics (counters come from self.archiver.stats)
+        metrics = self.archiver.metrics
+        self.event_lag = metrics.histogram(
+            'watcher_event_lag_seconds',
+            'Change event cluster time to archive commit'
+        )
+        metrics.gauge(
+            'watcher_pending_orders', 'Orders buffered in the current micro-batch'
+        ).set_function(lambda: len(self.pending) + len(self.pending_ids))
+        
+    @property
+    def partition_suffix(self) -> str:
+        """Suffix identifying this watcher's partition ('' when not partitioned)"""
+        if self.config.watch_partitions <= 1:
+            return ""
+        return f"p{self.config.watch_partition_id}of{self.config.watch_partitions}"
+    
+    def partitioned_token_file(self) -> Path:
+        """Resume token file of this partition (.resume_token.p0of4.json)"""
+        path = Path(self.config.watch_resume_token_file)
+        if not self.partition_suffix:
+            return path
+        return path.with_name(f"{path.stem}.{self.partition_suffix}{path.suffix}")
+    
+    def get_partition_filter(self) -> Optional[Dict]:
+        """
+        Build the $match keeping only the events owned by this partition
+        
+        Orders are assigned with a $mod on a hash of numero_commande
+        ($toHashedIndexKey, MongoDB 7.0+), or on a precomputed integer
+        field when config.watch_partition_field is set. Lean mode events
+        carry no fullDocument on updates, so they are hashed on
+        documentKey._id instead.
+        
+        Returns:
+            $match stage, or None when not partitioned
+        """
+        partitions = self.config.watch_partitions
+        if partitions <= 1:
+            return None
+        
+        if self.is_lean:
+            key = {"$toHashedIndexKey": "$documentKey._id"}
+        elif self.config.watch_partition_field:
+            key = f"$fullDocument.{self.config.watch_partition_field}"
+        else:
+            key = {"$toHashedIndexKey": "$fullDocument.numero_commande"}
+        
+        return {
+            '$match': {
+                '$expr': {
+                    '$eq': [
+                        {'$abs': {'$mod': [key, partitions]}},
+                        self.config.watch_partition_id
+                    ]
+                }
+            }
+        }
+    
+    @property
+    def is_lean(self) -> bool:
+        """True when change events are projected instead of looked up"""
+        return self.config.watch_stream_mode == 'lean'
+    
+    def build_pipeline(self) -> List[Dict]:
+        """
+        Build the change stream pipeline
+        
+        Returns:
+            $match on delivered orders, the partition filter and, in lean
+            mode, a $project trimming events to the fields we read
+        """
+        pipeline = [
+            {
+                '$match': {
+                    'operationType': {'$in': ['insert', 'update', 'replace']},
+                    '$or': [
+                        {'fullDocument.status': 'livrée'},
+                        {'updateDescription.updatedFields.status': 'livrée'}
+                    ]
+                }
+            }
+        ]
+        
+        # Keep only this watcher's share of the orders
+        partition_filter = self.get_partition_filter()
+        if partition_filter:
+            pipeline.append(partition_filter)
         
+        if self.is_lean:
+            pipeline.append({'$project': dict(self.LEAN_PROJECTION)})
+        
+        return pipeline
+    
+    def get_watch_options(self) -> Dict[str, Any]:
+        """
+        Options for collection.watch()
+        
+        Full mode looks up the whole order on every update; lean mode leaves
+        inserts/replaces as-is (they already carry the document) and lets
+        flush_pending() fetch updated orders by _id in the micro-batch.
+        """
+        watch_options = {'pipeline': self.build_pipeline()}
+        if not self.is_lean:
+            watch_options['full_document'] = 'updateLookup'
+        
+        if self.resume_token:
+            watch_options['resume_after'] = self.resume_token
+        
+        # Wake up at least once per flush interval to honour it
+        watch_options['max_await_time_ms'] = max(
+            1, int(self.config.watch_flush_interval_ms)
+        )
+        return watch_options
+    
+    def setup_token_store(self):
+        """Select the resume token backend (needs a connection for mongodb)"""
+        if self.config.watch_token_store == 'mongodb':
+            state_id = self.config.watch_state_id
+            if self.partition_suffix:
+                state_id = f"{state_id}.{self.partition_suffix}"
+            self.token_store = MongoTokenStore(
+                self.archiver.db[self.config.watch_state_collection],
+                state_id
+            )
+        else:
+            self.token_store = FileTokenStore(str(self.resume_token_file))
+        
+        self.logger.info(f"💾 Resume token stored in {self.token_store.describe()}")
+    
     def load_resume_token(self) -> Optional[Dict]:
-        """Load resume token from file for fault tolerance"""
+        """Load resume token for fault tolerance"""
         try:
-            if self.resume_token_file.exists():
-                with open(self.resume_token_file, 'r') as f:
-                    token_data = json.load(f)
-                    self.logger.info("📋 Loaded resume token from file")
-                    return token_data
+            token_data = self.token_store.load()
+            if token_data:
+                self.logger.info("📋 Loaded resume token")
+                return token_data
         except Exception as e:
             self.logger.warning(f"⚠️  Could not load resume token: {e}")
         return None
     
     def save_resume_token(self, token: Dict):
-        """Save resume token to file for fault tolerance"""
+        """
+        Save resume token for fault tolerance
+        
+        While watching, the token is handed to the throttled background
+        writer; otherwise it is written synchronously.
+        """
+        if self.token_writer:
+            self.token_writer.update(token)
+            return
+        
         try:
-            self.resume_token_file.parent.mkdir(parents=True, exist_ok=True)
-            with open(self.resume_token_file, 'w') as f:
-                json.dump(token, f)
+            self.token_store.save(token)
             self.logger.debug("💾 Saved resume token")
         except Exception as e:
             self.logger.warning(f"⚠️  Could not save resume token: {e}")
@@ -63,8 +221,8 @@ class OrderWatcher:
         if operation_type not in ['insert', 'update', 'replace']:
             return False
         
-        # Get the full document
-        full_document = change.get('fullDocument', {})
+        # Get the full document (null when the order was deleted meanwhile)
+        full_document = change.get('fullDocument') or {}
         status = full_document.get('status', '')
         
         # Archive if status is "livrée"
@@ -124,6 +282,208 @@ class OrderWatcher:
             self.logger.error(f"❌ Error processing change: {e}")
             self.archiver.stats['errors'] += 1
     
+    def buffer_change(self, change: Dict):
+        """
+        Add a change event to the current micro-batch
+        
+        Args:
+            change: Change stream event
+        """
+        operation_type = change.get('operationType')
+        full_document = change.get('fullDocument') or {}
+        updated_fields = (change.get('updateDescription') or {}).get('updatedFields') or {}
+        numero_commande = (
+            full_document.get('numero_commande') or updated_fields.get('numero_commande')
+        )
+        doc_id = (change.get('documentKey') or {}).get('_id')
+        
+        # Lazy %-style: formatted only if the record is kept (see logger.py)
+        self.logger.info(
+            "🔔 Change detected: %s on order %s",
+            operation_type, numero_commande or doc_id or 'N/A'
+        )
+        
+        if not self.should_archive(change):
+            return
+        
+        if numero_commande:
+            if not self.has_pending():
+                self.pending_since = time.monotonic()
+            if numero_commande not in self.pending:
+                self.pending.append(numero_commande)
+                self.record_event_time(change)
+        elif doc_id is not None:
+            # Number not on the event: the order is fetched by _id at flush time
+            if not self.has_pending():
+                self.pending_since = time.monotonic()
+            if doc_id not in self.pending_ids:
+                self.pending_ids.append(doc_id)
+                self.record_event_time(change)
+    
+    def record_event_time(self, change: Dict):
+        """Remember when the event happened on the cluster (for the lag histogram)"""
+        wall_time = change.get('wallTime')  # MongoDB 6.0+, millisecond precision
+        if isinstance(wall_time, datetime):
+            if wall_time.tzinfo is None:
+                wall_time = wall_time.replace(tzinfo=timezone.utc)
+            self.pending_event_times.append(wall_time.timestamp())
+        elif change.get('clusterTime') is not None:
+            self.pending_event_times.append(change['clusterTime'].time)
+    
+    def has_pending(self) -> bool:
+        """True when the micro-batch holds at least one order"""
+        return bool(self.pending or self.pending_ids)
+    
+    def clear_pending(self):
+        """Drop the micro-batch"""
+        self.pending = []
+        self.pending_ids = []
+        self.pending_since = None
+        self.pending_event_times = []
+    
+    def should_flush(self) -> bool:
+        """True when the micro-batch is full or its oldest event is too old"""
+        if not self.has_pending():
+            return False
+        if len(self.pending) + len(self.pending_ids) >= self.config.watch_batch_size:
+            return True
+        age_ms = (time.monotonic() - self.pending_since) * 1000
+        return age_ms >= self.config.watch_flush_interval_ms
+    
+    def flush_pending(self) -> bool:
+        """
+        Enrich the micro-batch with one aggregation and insert it in one bulk write
+        
+        Returns:
+            True if the batch was committed (the resume token may advance)
+        """
+        if not self.has_pending():
+            return True
+        
+        numeros = self.pending
+        ids = self.pending_ids
+        total = len(numeros) + len(ids)
+        
+        if self.replays >= self.config.watch_max_replays:
+            # The same batch keeps failing: isolate and dead-letter the culprits
+            archived = self.flush_isolated()
+            if archived is None:
+                return False
+        else:
+            archived = self.archive_pending(numeros, ids)
+            if archived is None:
+                return False
+        
+        self.archiver.stats['archived'] += archived
+        self.logger.info("✅ Archived %d/%d orders in real-time", archived, total)
+        
+        committed_at = time.time()
+        for event_time in self.pending_event_times:
+            self.event_lag.observe(max(0.0, committed_at - event_time))
+        
+        self.clear_pending()
+        return True
+    
+    def archive_pending(self, numeros: List[str], ids: List) -> Optional[int]:
+        """
+        Enrich orders with one aggregation and insert them in one bulk write
+        
+        Orders that no longer exist are counted as errors and skipped.
+        
+        Returns:
+            Number of orders archived, or None if the batch failed
+        """
+        errors_before = self.archiver.stats['errors']
+        
+        enriched = self.archiver.enrich_orders(numeros, ids)
+        if self.archiver.stats['errors'] > errors_before:
+            return None
+        
+        # An order may be buffered both by number and by _id
+        found_numeros = {order.get('numero_commande') for order in enriched}
+        found_ids = {order.get('_id') for order in enriched}
+        missing = (
+            sum(1 for numero in numeros if numero not in found_numeros)
+            + sum(1 for doc_id in ids if doc_id not in found_ids)
+        )
+        if missing:
+            self.logger.error(f"❌ Failed to enrich {missing} orders")
+            self.archiver.stats['errors'] += missing
+            errors_before += missing
+        
+        archived = self.archiver.archive_orders_batch(enriched)
+        if self.archiver.stats['errors'] > errors_before:
+            return None
+        return archived
+    
+    def flush_isolated(self) -> Optional[int]:
+        """
+        Archive the micro-batch one order at a time after repeated replays
+        
+        Orders that still fail are written to the dead-letter collection
+        (their failures are already counted in stats['errors']) so the
+        resume token can move past them.
+        
+        Returns:
+            Number of orders archived, or None if the dead letters could
+            not be written (the batch is replayed again)
+        """
+        archived = 0
+        dead_letters = []
+        # (dead-letter field, numeros, ids) for each buffered order
+        keys = [('numero_commande', [numero], []) for numero in self.pending] + [
+            ('commande_id', [], [doc_id]) for doc_id in self.pending_ids
+        ]
+        
+        for field, numeros, ids in keys:
+            result = self.archive_pending(numeros, ids)
+            if result is None:
+                dead_letters.append({
+                    field: (numeros or ids)[0],
+                    'watcher': self.config.watch_state_id,
+                    'partition': self.partition_suffix or None,
+                    'attempts': self.replays + 1,
+                    'failed_at': datetime.now()
+                })
+            else:
+                archived += result
+        
+        if dead_letters:
+            try:
+                self.archiver.db[self.config.watch_dead_letter_collection].insert_many(
+                    dead_letters, ordered=False
+                )
+            except PyMongoError as e:
+                self.logger.error(f"❌ Could not dead-letter {len(dead_letters)} orders: {e}")
+                return None
+            
+            self.logger.error(
+                f"☠️  {len(dead_letters)} orders failed {self.replays + 1} times, moved to "
+                f"{self.config.watch_dead_letter_collection}"
+            )
+        return archived
+    
+    def commit(self, token: Optional[Dict]) -> bool:
+        """
+        Flush the micro-batch, then persist the resume token
+        
+        The token is only saved once every buffered event is archived, so a
+        crash replays uncommitted events (at-least-once). After
+        config.watch_max_replays failed commits in a row, the orders that
+        still fail are dead-lettered instead of being replayed forever.
+        
+        Returns:
+            True if committed
+        """
+        if not self.flush_pending():
+            self.replays += 1
+            return False
+        self.replays = 0
+        if token and token != self.resume_token:
+            self.resume_token = token
+            self.save_resume_token(token)
+        return True
+    
     def watch(self, resume: bool = True):
         """
         Start watching for changes using Change Streams
@@ -136,71 +496,90 @@ class OrderWatcher:
             return
         
         self.archiver.ensure_indexes()
+        self.archiver.start_metrics_server(port_offset=self.config.watch_partition_id)
+        self.setup_token_store()
         
         # Load resume token if requested
         if resume:
             self.resume_token = self.load_resume_token()
         
+        # Persist tokens off the hot path, at most every N events or T ms
+        self.token_writer = ThrottledTokenWriter(
+            self.token_store,
+            every_n=self.config.watch_token_flush_every,
+            interval_ms=self.config.watch_token_flush_ms,
+            logger=self.logger
+        )
+        self.token_writer.start()
+        
         self.logger.info("👀 Starting Change Stream watcher...")
         self.logger.info(f"📡 Watching collection: {self.config.collection_commande}")
         self.logger.info("💡 Press Ctrl+C to stop")
         
-        # Pipeline to filter only relevant changes
-        pipeline = [
-            {
-                '$match': {
-                    'operationType': {'$in': ['insert', 'update', 'replace']},
-                    '$or': [
-                        {'fullDocument.status': 'livrée'},
-                        {'updateDescription.updatedFields.status': 'livrée'}
-                    ]
-                }
-            }
-        ]
+        if self.config.watch_partitions > 1:
+            self.logger.info(
+                f"🧩 Partition {self.config.watch_partition_id}"
+                f"/{self.config.watch_partitions}"
+            )
+        if self.is_lean:
+            self.logger.info("🪶 Lean stream mode: projected events, no updateLookup")
         
         retry_delay = 1
         max_retry_delay = 60
+        latest_token = None
         
-        while True:
-            try:
-                # Open change stream with resume token
-                watch_options = {
-                    'pipeline': pipeline,
-                    'full_document': 'updateLookup'
-                }
-                
-                if self.resume_token:
-                    watch_options['resume_after'] = self.resume_token
-                    self.logger.info("🔄 Resuming from saved position")
-                
-                with self.archiver.db[self.config.collection_commande].watch(**watch_options) as stream:
-                    self.logger.info("✅ Change Stream opened successfully")
-                    retry_delay = 1  # Reset retry delay on success
+        try:
+            while True:
+                try:
+                    # Open change stream with resume token
+                    watch_options = self.get_watch_options()
+                    if self.resume_token:
+                        self.logger.info("🔄 Resuming from saved position")
                     
-                    for change in stream:
-                        # Process the change
-                        self.process_change(change)
+                    with self.archiver.db[self.config.collection_commande].watch(**watch_options) as stream:
+                        self.logger.info("✅ Change Stream opened successfully")
+                        retry_delay = 1  # Reset retry delay on success
                         
-                        # Save resume token periodically
-                        self.resume_token = stream.resume_token
-                        self.save_resume_token(self.resume_token)
+                        while stream.alive:
+                            change = stream.try_next()
+                            if change is not None:
+                                self.buffer_change(change)
+                            latest_token = stream.resume_token
+                            
+                            # Flush on size or age, or advance the token when idle
+                            if self.should_flush() or not self.has_pending():
+                                if not self.commit(latest_token):
+                                    # Reopen from the last committed token
+                                    self.clear_pending()
+                                    raise PyMongoError("Micro-batch not committed, replaying")
                 
-            except KeyboardInterrupt:
-                self.logger.info("\n⏹️  Stopping watcher (user interrupted)")
-                break
-                
-            except PyMongoError as e:
-                self.logger.error(f"❌ Change Stream error: {e}")
-                self.logger.info(f"⏳ Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                except KeyboardInterrupt:
+                    self.logger.info("\n⏹️  Stopping watcher (user interrupted)")
+                    # Final flush; the token only moves if the batch commits
+                    if not self.commit(latest_token):
+                        self.logger.warning(
+                            f"⚠️  {len(self.pending) + len(self.pending_ids)} buffered orders not archived, "
+                            "they will be replayed on restart"
+                        )
+                    break
                 
-                # Exponential backoff
-                retry_delay = min(retry_delay * 2, max_retry_delay)
+                except PyMongoError as e:
+                    self.logger.error(f"❌ Change Stream error: {e}")
+                    self.logger.info(f"⏳ Retrying in {retry_delay} seconds...")
+                    time.sleep(retry_delay)
+                    
+                    # Exponential backoff
+                    retry_delay = min(retry_delay * 2, max_retry_delay)
                 
-            except Exception as e:
-                self.logger.error(f"❌ Unexpected error: {e}")
-                self.logger.info(f"⏳ Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                except Exception as e:
+                    self.logger.error(f"❌ Unexpected error: {e}")
+                    self.logger.info(f"⏳ Retrying in {retry_delay} seconds...")
+                    time.sleep(retry_delay)
+
+        finally:
+            # Final token flush, also when Ctrl+C lands outside the stream loop
+            self.token_writer.close()
+            self.token_writer = None
         
         # Print final stats
         self.logger.info(self.archiver.get_stats_summary())